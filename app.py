@@ -1,225 +1,191 @@
 import os
-import csv
-import requests
-import resend
-import threading
+import hmac
+import importlib
+import time
 import uuid
-from io import StringIO
+import logging
+from collections import Counter
+from functools import lru_cache
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, make_response
-from user_agents import parse
-
-# --- ALTERAÇÃO: Importando funções do DB ---
-from db_utils import get_table_id_by_name, get_sheet_data, insert_tracking_event, get_tracking_settings
+from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, make_response, g
+from flask import before_render_template, template_rendered
 
+# Carrega o .env antes dos módulos internos, que leem a configuração na importação
 load_dotenv()
 
+from logs import configurar_logging
+configurar_logging()
+
+# --- ALTERAÇÃO: Importando funções do DB ---
+from db_utils import enqueue_tracking_event, get_tracking_settings, get_tracking_stats, db_cursor
+from background import submit_background
+from geoip import get_location_data_rich
+from click_buffer import adicionar_clique, drenar_cliques, devolver_cliques, sites_com_cliques, CLICK_BUFFER_MAX_POR_SITE
+from portfolio import get_portfolio_data, versao_portfolio, renovar_portfolios
+from page_cache import pagina_em_cache
+from notifications import enfileirar_email, render_email, acordar_sender
+from partitions import manter_particoes
+from metrics import METRICS_ATIVO, HTTP_LATENCIA, TEMPLATE_RENDER, exportar
+from assets import iniciar_assets
+from rate_limit import ListaDeIPs, filtrar_cliques
+from warmup import registrar_etapa, iniciar_aquecimento, estado
+from tenants import (TENANT_PADRAO, TENANTS_ESTRITO, cabecalhos_cors, cookie_entre_sites, resolver_tenant,
+                     tenant_por_site)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'chave_dev_padrao')
-resend.api_key = os.getenv('RESEND_API_KEY')
+# CSS/JS empacotados, ícones redimensionados e nomes com hash (static/dist/)
+iniciar_assets(app)
 
-BUFFER_CLIQUES = []
-PORTFOLIO_CACHE = []
-ULTIMA_ATUALIZACAO_PORTFOLIO = None
-CACHE_TIMEOUT_HORAS = 1
-MEUS_IPS_IGNORADOS = ['177.5.139.35']
-HOST_URL = "https://merlodigital.com"
+# IPs/redes (CIDR) que não geram tracking, separados por vírgula
+MEUS_IPS_IGNORADOS = ListaDeIPs.de_texto(os.getenv('TRACKING_IPS_IGNORADOS', '177.5.139.35'))
+# Site padrão; os demais sites (tenants) vêm da configuração em tenants.py
+HOST_URL = TENANT_PADRAO.host_url
+SITE_SOURCE_NAME = TENANT_PADRAO.site_source
 
-# Nome do Site para o DB (Deve ser igual ao configurado no My Ô)
-SITE_SOURCE_NAME = "Merlô Digital - Site"
+# Relatórios grandes listam só os últimos N cliques (o resumo conta todos)
+EMAIL_MAX_CLIQUES_LISTADOS = int(os.getenv('EMAIL_MAX_CLIQUES_LISTADOS', '30'))
+# Token do /api/stats (sem token configurado a rota fica desligada)
+STATS_TOKEN = os.getenv('STATS_TOKEN')
+# Token do /metrics (Bearer ou ?token=). Sem ele a rota fica fechada, como o /api/stats:
+# as séries citam os site_source dos clientes e as contagens de erro
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
 
+logger = logging.getLogger(__name__)
 
-def get_location_data_rich(ip_address):
-    """
-    Busca dados enriquecidos de GeoIP.
-    """
-    try:
-        url = f'http://ip-api.com/json/{ip_address}?fields=status,message,countryCode,regionName,city,isp,org,zip'
-        response = requests.get(url, timeout=3)
-        data = response.json()
-
-        if data['status'] == 'success':
-            local_base = f"{data['city']}/{data['regionName']} ({data['countryCode']})"
-            detalhe_rede = data['org'] if data['org'] else data['isp']
-            if data['isp'] and data['isp'] != data['org']:
-                detalhe_rede = f"{data['isp']} ({data['org']})"
-
-            return {
-                "local": local_base,
-                "rede": detalhe_rede,
-                "zip": data['zip']
-            }
-        return {"local": "Local Desconhecido", "rede": "N/A", "zip": ""}
-    except Exception as e:
-        print(f"Erro no GeoIP: {e}")
-        return {"local": "N/A", "rede": "N/A", "zip": ""}
 
+@app.before_request
+def _identificar_site():
+    # Páginas e rotas comuns seguem o Host; o tracking olha também o Origin (_contexto_visitante)
+    g.tenant = resolver_tenant(request.host)
 
-def get_portfolio_data(force_refresh=False):
-    """
-    Busca dados direto do Banco Neon (PostgreSQL).
-    """
-    global PORTFOLIO_CACHE, ULTIMA_ATUALIZACAO_PORTFOLIO
-    agora = datetime.now()
 
-    if not force_refresh and PORTFOLIO_CACHE and ULTIMA_ATUALIZACAO_PORTFOLIO:
-        tempo_passado = agora - ULTIMA_ATUALIZACAO_PORTFOLIO
-        if tempo_passado < timedelta(hours=CACHE_TIMEOUT_HORAS):
-            return PORTFOLIO_CACHE
+# --- CORS DAS ROTAS DE TRACKING ---
+# O t.js dos sites clientes posta de outro domínio. O OPTIONS (preflight) é
+# respondido pelo próprio Flask; aqui entram os cabeçalhos para as origens configuradas.
+ROTAS_CORS = ('/api/track-click', '/api/track-batch')
 
-    try:
-        print("🔌 Conectando ao Neon DB para buscar Portfolio...")
-        portfolio_tab_id = get_table_id_by_name('Portfolio')
-        if not portfolio_tab_id:
-            portfolio_tab_id = get_table_id_by_name('Portfólio')
-
-        if not portfolio_tab_id:
-            print("⚠️ Aviso: Tabela Portfolio não encontrada no Banco de Dados.")
-            return PORTFOLIO_CACHE or []
-
-        projects = get_sheet_data(portfolio_tab_id)
-        final_projects = []
-        for row in projects:
-            titulo = row.get('Título', '')
-            if not titulo: continue
-
-            logo_url = row.get('Logo', '').strip()
-            if 'drive.google.com' in logo_url and 'id=' in logo_url:
-                try:
-                    file_id = logo_url.split('id=')[1].split('&')[0]
-                    logo_url = f"https://lh3.googleusercontent.com/d/{file_id}"
-                except:
-                    pass
-
-            item = {
-                'Título': titulo.strip(),
-                'Descrição': row.get('Descrição', '').strip(),
-                'Link': row.get('Link do site', '').strip(),
-                'Logo': logo_url,
-                'Tipo': row.get('Tipo', '').strip()
-            }
-            final_projects.append(item)
-
-        PORTFOLIO_CACHE = final_projects
-        ULTIMA_ATUALIZACAO_PORTFOLIO = agora
-        print(f"🚀 Portfólio atualizado via DB! {len(final_projects)} projetos.")
-
-        return final_projects
 
-    except Exception as e:
-        print(f"❌ Erro crítico ao buscar portfólio: {e}")
-        return PORTFOLIO_CACHE if PORTFOLIO_CACHE else []
+@app.after_request
+def _cors_tracking(response):
+    if request.path in ROTAS_CORS:
+        response.headers.update(cabecalhos_cors(request.headers.get('Origin'), request.method == 'OPTIONS'))
+        response.vary.add('Origin')
+    return response
+
+
+# --- MÉTRICAS POR ROTA ---
+if METRICS_ATIVO:
+    @app.before_request
+    def _iniciar_cronometro():
+        g._inicio_requisicao = time.perf_counter()
 
+    @app.after_request
+    def _medir_requisicao(response):
+        inicio = g.pop('_inicio_requisicao', None)
+        if inicio is not None:
+            rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+            HTTP_LATENCIA.observe(time.perf_counter() - inicio, rota=rota, metodo=request.method,
+                                  status=response.status_code)
+        return response
 
-def processar_envio_background(lista_cliques, motivo):
+    def _iniciar_render(sender, template, context, **extra):
+        g._inicio_render = time.perf_counter()
+
+    def _medir_render(sender, template, context, **extra):
+        inicio = g.pop('_inicio_render', None)
+        if inicio is not None:
+            TEMPLATE_RENDER.observe(time.perf_counter() - inicio, template=template.name)
+
+    before_render_template.connect(_iniciar_render, app)
+    template_rendered.connect(_medir_render, app)
+
+
+def processar_envio_background(lista_cliques, motivo, site_source=SITE_SOURCE_NAME):
     """
-    Roda em Thread separada para envio de e-mails.
-    Agora respeita a configuração do My Ô.
+    Roda no executor em background para envio de e-mails.
+    Agora respeita a configuração do My Ô (do site dono dos cliques).
     """
     # 1. Busca configurações atualizadas do banco
-    settings = get_tracking_settings(SITE_SOURCE_NAME)
+    settings = get_tracking_settings(site_source)
     email_ativo = settings.get('email_enabled', True)
 
     if not email_ativo:
-        print(f"🔕 E-mail desativado nas configurações do My Ô. Apenas salvando no banco.")
+        logger.info("E-mail desativado nas configurações do My Ô. Apenas salvando no banco.",
+                    extra={"site_source": site_source})
         return
 
-    email_destino = os.getenv('EMAIL_DESTINO')
+    tenant = tenant_por_site(site_source)
+    email_destino = tenant.email_destino
     if not lista_cliques or not email_destino:
         return
 
-    itens_html = ""
-    for item in lista_cliques:
-        # A lista já vem com geolocalização processada do 'save_click_async'
-        loc = item.get('localizacao', 'Processando...')
-        rede = item.get('provedor', 'Processando...')
-
-        cor_titulo = "#16305D"
-        icone_status = "🖱️"
-        bg_card = "#f8f9fa"
-
-        if "WhatsApp" in item['botao'] or "Contato" in item['botao']:
-            cor_titulo = "#25D366"
-            icone_status = "💬"
-            bg_card = "#e8f5e9"
-
-        tag_visitante = "👤 Novo" if item.get('is_new_user') else "🔄 Retorno"
-
-        itens_html += f"""
-        <li style="margin-bottom: 15px; border-left: 4px solid {cor_titulo}; list-style: none; background-color: {bg_card}; padding: 12px; border-radius: 6px; font-family: sans-serif;">
-            <div style="font-size: 14px; font-weight: bold; color: {cor_titulo}; display: flex; justify-content: space-between; align-items: center;">
-                <span>{icone_status} {item['botao']}</span>
-                <span style="font-size: 10px; background: #fff; border: 1px solid #ddd; padding: 2px 8px; border-radius: 12px; color: #555; text-transform: uppercase;">{tag_visitante}</span>
-            </div>
-            <div style="font-size: 12px; color: #555; line-height: 1.6; margin-top: 8px;">
-                🕒 <strong>Hora:</strong> {item['hora_fmt']} <br>
-                🌍 <strong>Local:</strong> {loc} <br>
-                🏢 <strong>Rede:</strong> {rede} <br>
-                🔧 <strong>Device:</strong> {item['device_str']} <br>
-                🔗 <a href="{HOST_URL}{item['pagina_origem']}" style="color: #666;">{item['pagina_origem']}</a> → {item['url_destino']}
-            </div>
-        </li>
-        """
+    # Resumo agregado no topo; a lista detalhada mostra só os cliques mais recentes
+    resumo_botoes = Counter(item['botao'] for item in lista_cliques).most_common()
+    html = render_email(
+        'relatorio_cliques.html',
+        total_cliques=len(lista_cliques),
+        resumo_botoes=resumo_botoes,
+        cliques=lista_cliques[-EMAIL_MAX_CLIQUES_LISTADOS:],
+        motivo=motivo,
+        bucket_size=settings.get('bucket_size'),
+        host_url=tenant.host_url
+    )
 
-    try:
-        resend.Emails.send({
-            "from": "Merlô Tracker <merlotracker@merlodigital.com>",
-            "to": [email_destino],
-            "subject": f"🎯 {len(lista_cliques)} Interações (Merlô Track v3)",
-            "html": f"""
-            <div style="font-family: sans-serif; color: #333; max-width: 600px;">
-                <div style="padding: 15px; border-bottom: 2px solid #16305D;">
-                    <h3 style="color: #16305D; margin: 0;">Relatório de Inteligência</h3>
-                    <p style="font-size: 12px; color: #777; margin: 5px 0 0 0;">
-                        Motivo: {motivo} • Config: {settings.get('bucket_size')} cliques
-                    </p>
-                </div>
-                <ul style="padding: 0; margin-top: 20px;">
-                    {itens_html}
-                </ul>
-            </div>
-            """
-        })
-        print(f"✅ E-mail de relatório enviado (Background).")
-    except Exception as e:
-        print(f"❌ Erro ao enviar e-mail: {e}")
+    if enfileirar_email({
+        "from": "Merlô Tracker <merlotracker@merlodigital.com>",
+        "to": [email_destino],
+        "subject": f"🎯 {len(lista_cliques)} Interações (Merlô Track v3)",
+        "html": html
+    }):
+        logger.info("Relatório de cliques enfileirado para envio.",
+                    extra={"cliques": len(lista_cliques), "motivo": motivo, "site_source": site_source})
+    else:
+        logger.error("Erro ao enfileirar e-mail de relatório.",
+                     extra={"cliques": len(lista_cliques), "site_source": site_source})
 
 
 def save_click_async(clique_data):
     """
-    Thread de processamento:
+    Tarefa em background (executor compartilhado):
     1. Busca GeoIP (lento)
-    2. Salva no DB com hora BR
+    2. Enfileira para gravação em lote no DB com hora BR
     3. Buffer E-mail (Respeitando configs do My Ô)
     """
-    global BUFFER_CLIQUES
-
     geo_data = get_location_data_rich(clique_data['ip_address'])
 
     clique_data['localizacao'] = geo_data['local']
     clique_data['provedor'] = geo_data['rede']
 
-    # Adiciona a fonte do site e salva
-    clique_data['site_source'] = SITE_SOURCE_NAME
-    insert_tracking_event(clique_data)
+    # site_source já vem do montar_clique; enfileira (a thread escritora grava em lote)
+    clique_data.setdefault('site_source', SITE_SOURCE_NAME)
+    enqueue_tracking_event(clique_data)
+
+    bufferizar_clique(clique_data)
 
-    BUFFER_CLIQUES.append(clique_data)
+
+def bufferizar_clique(clique_data):
+    """Coloca o clique (já com GeoIP) no balde do site e dispara o envio se encheu"""
+    site_source = clique_data.get('site_source') or SITE_SOURCE_NAME
+    tamanho_buffer = adicionar_clique(site_source, clique_data)
 
     # --- LÓGICA DINÂMICA DO MY Ô ---
-    # Busca configurações em tempo real
-    settings = get_tracking_settings(SITE_SOURCE_NAME)
-    bucket_size = int(settings.get('bucket_size', 10))
+    # Busca configurações em tempo real (cada site tem o seu bucket_size)
+    settings = get_tracking_settings(site_source)
+    bucket_size = min(int(settings.get('bucket_size', 10)), CLICK_BUFFER_MAX_POR_SITE)
 
-    if len(BUFFER_CLIQUES) >= bucket_size:
-        lote_atual = list(BUFFER_CLIQUES)
-        BUFFER_CLIQUES.clear()
-        processar_envio_background(lote_atual, "Buffer Cheio")
+    if tamanho_buffer >= bucket_size:
+        # A drenagem é atômica: se outra thread/worker chegou antes, o lote vem vazio
+        lote_atual = drenar_cliques(site_source)
+        if lote_atual:
+            processar_envio_background(lote_atual, "Buffer Cheio", site_source)
 
 
 # --- ROTAS VIEW (SEO E TEXTOS ORIGINAIS RESTAURADOS) ---
 
 @app.route('/')
+@pagina_em_cache()
 def index():
     return render_template(
         'index.html',
@@ -229,6 +195,7 @@ def index():
 
 
 @app.route('/servicos')
+@pagina_em_cache()
 def servicos():
     return render_template(
         'servicos.html',
@@ -238,6 +205,7 @@ def servicos():
 
 
 @app.route('/servicos/website')
+@pagina_em_cache()
 def servicos_website():
     return render_template(
         'servicos_website.html',
@@ -247,6 +215,7 @@ def servicos_website():
 
 
 @app.route('/servicos/sistemas')
+@pagina_em_cache()
 def servicos_sistemas():
     return render_template(
         'servicos_sistemas.html',
@@ -256,8 +225,9 @@ def servicos_sistemas():
 
 
 @app.route('/portfolio')
+@pagina_em_cache(versao=lambda: versao_portfolio(g.tenant))
 def portfolio():
-    projects = get_portfolio_data()
+    projects = get_portfolio_data(tenant=g.tenant)
     return render_template(
         'portfolio.html',
         title="Portfólio de Projetos - Merlô Digital",
@@ -284,32 +254,26 @@ def contato():
             flash('O e-mail informado é inválido. Por favor, verifique.', 'danger')
             return redirect(url_for('contato'))
 
-        email_destino = os.getenv('EMAIL_DESTINO')
-
-        try:
-            params = {
-                "from": "Merlô Digital <contato@merlodigital.com>",
-                "to": [email_destino],
-                "subject": f"🚀 Lead Site: {nome} - {empresa}",
-                "html": f"""
-                <div style="font-family: Arial, color: #333;">
-                    <h2 style="color: #16305D;">Nova Oportunidade Comercial</h2>
-                    <hr>
-                    <p><strong>👤 Nome:</strong> {nome}</p>
-                    <p><strong>🏢 Empresa:</strong> {empresa}</p>
-                    <p><strong>📧 E-mail:</strong> {email_cliente}</p>
-                    <p><strong>📱 Telefone:</strong> {telefone}</p>
-                    <hr>
-                    <p><strong>💬 Mensagem:</strong><br>{mensagem_cliente}</p>
-                    <br>
-                    <small style="color: #888;">Enviado via Site Merlô Digital (Validado)</small>
-                </div>
-                """
-            }
-            resend.Emails.send(params)
+        email_destino = g.tenant.email_destino
+
+        # O envio real acontece no sender do outbox: a requisição não espera o Resend
+        enfileirado = enfileirar_email({
+            "from": "Merlô Digital <contato@merlodigital.com>",
+            "to": [email_destino],
+            "subject": f"🚀 Lead Site: {nome} - {empresa}",
+            "html": render_email(
+                'lead_contato.html',
+                nome=nome,
+                empresa=empresa,
+                email_cliente=email_cliente,
+                telefone=telefone,
+                mensagem_cliente=mensagem_cliente
+            )
+        })
+
+        if enfileirado:
             flash('Solicitação enviada com sucesso! Em breve entraremos em contato.', 'success')
-        except Exception as e:
-            print(f"Erro ao enviar e-mail: {e}")
+        else:
             flash('Erro ao enviar mensagem. Tente novamente ou nos chame no WhatsApp.', 'danger')
 
         return redirect(url_for('contato'))
@@ -322,96 +286,300 @@ def contato():
 
 
 # --- API TRACKING CORRIGIDA ---
-@app.route('/api/track-click', methods=['POST'])
-def track_click():
-    # --- CORREÇÃO DO IP ---
-    # Pega o primeiro IP da lista se houver proxy (Render/Vercel)
-    if request.headers.getlist("X-Forwarded-For"):
-        raw_ip = request.headers.getlist("X-Forwarded-For")[0]
-        # Se vier "200.1.1.1, 10.0.0.1", pega só o primeiro e remove espaços
-        user_ip = raw_ip.split(',')[0].strip()
-    else:
-        user_ip = request.remote_addr
+# Limites de validação dos eventos vindos do navegador
+TRACK_BATCH_MAX_EVENTOS = int(os.getenv('TRACK_BATCH_MAX_EVENTOS', '50'))
+TRACK_CAMPO_MAX = 300
+# Proxies confiáveis na frente do app (Render/Vercel = 1), como o x_for do ProxyFix.
+# 0 = sem proxy: vale o endereço da conexão
+PROXY_SALTOS = int(os.getenv('PROXY_SALTOS', '1'))
+
+
+@lru_cache(maxsize=2048)
+def _analisar_user_agent(ua_string):
+    """(é_robô, é_celular, sistema, navegador) do User-Agent"""
+    # Importado no primeiro clique: o user_agents compila as regex do ua-parser
+    # na importação (~250 ms) e páginas comuns não precisam dele
+    from user_agents import parse
 
-    ua_string = request.headers.get('User-Agent')
     user_agent = parse(ua_string)
+    return (user_agent.is_bot, user_agent.is_mobile,
+            f"{user_agent.os.family} {user_agent.os.version_string}", f"{user_agent.browser.family}")
+
+
+def ip_do_cliente(forwarded_for, remote_addr):
+    """
+    IP do visitante atrás de PROXY_SALTOS proxies confiáveis. Cada proxy acrescenta
+    quem o chamou ao fim do X-Forwarded-For; o começo da lista vem do navegador e
+    pode ser qualquer coisa, então vale a entrada que o proxy mais externo gravou.
+    """
+    if PROXY_SALTOS <= 0 or not forwarded_for:
+        return remote_addr
+    saltos = [ip.strip() for ip in forwarded_for.split(',')]
+    if len(saltos) < PROXY_SALTOS or not saltos[-PROXY_SALTOS]:
+        return remote_addr
+    return saltos[-PROXY_SALTOS]
+
+
+def identificar_visitante(forwarded_for, remote_addr, ua_string, uid_cookie, tenant=TENANT_PADRAO):
+    """
+    IP, user-agent e uid do visitante (independente de framework: usado pelo
+    Flask e pelo asgi.py). tenant: site resolvido pelo Origin/Host (None =
+    desconhecido, com TENANTS_ESTRITO). Retorna (contexto, None) ou (None, motivo_para_ignorar).
+    """
+    if tenant is None:
+        return None, 'site_desconhecido'
+
+    user_ip = ip_do_cliente(forwarded_for, remote_addr)
+
+    # Poucos User-Agents distintos se repetem muito: o cache evita rodar as regex a cada clique
+    is_bot, is_mobile, dispositivo, navegador = _analisar_user_agent(ua_string or '')
 
-    if user_agent.is_bot:
-        return jsonify({'status': 'ignorado', 'motivo': 'robo'}), 200
+    if is_bot:
+        return None, 'robo'
     if user_ip in MEUS_IPS_IGNORADOS:
-        return jsonify({'status': 'ignorado', 'motivo': 'admin'}), 200
+        return None, 'admin'
 
-    usuario_id = request.cookies.get('merlo_uid')
+    usuario_id = uid_cookie
     is_new_user = False
 
     if not usuario_id:
         usuario_id = str(uuid.uuid4())
         is_new_user = True
 
-    dispositivo = f"{user_agent.os.family} {user_agent.os.version_string}"
-    navegador = f"{user_agent.browser.family}"
-    icone = "📱" if user_agent.is_mobile else "💻"
+    icone = "📱" if is_mobile else "💻"
 
-    data_req = request.get_json()
-
-    # --- CORREÇÃO DE DATA: Captura a hora BR (-3) para o Banco ---
-    hora_atual = datetime.utcnow() - timedelta(hours=3)
-
-    novo_clique = {
+    return {
+        "site_source": tenant.site_source,
         "uid": usuario_id,
         "is_new_user": is_new_user,
-        "botao": data_req.get('botao', 'Clique Genérico'),
-        "pagina_origem": data_req.get('pagina_origem', '/'),
-        "url_destino": data_req.get('url_destino', '#'),
+        "ip_address": user_ip,
+        "device_str": f"{icone} {navegador} no {dispositivo}",
+        "dispositivo": f"{icone} {navegador}",
+    }, None
+
+
+def _contexto_visitante():
+    """
+    Visitante da requisição Flask atual.
+    Retorna (contexto, None) ou (None, resposta_de_ignorado).
+    """
+    # Vários cabeçalhos X-Forwarded-For equivalem a um só, separado por vírgula
+    forwarded = request.headers.getlist("X-Forwarded-For")
+    contexto, motivo = identificar_visitante(
+        ', '.join(forwarded) or None,
+        request.remote_addr,
+        request.headers.get('User-Agent'),
+        request.cookies.get('merlo_uid'),
+        resolver_tenant(request.host, request.headers.get('Origin'), TENANTS_ESTRITO)
+    )
+    if motivo:
+        return None, (jsonify({'status': 'ignorado', 'motivo': motivo}), 200)
+    return contexto, None
+
+
+def _campo_evento(evento, chave, padrao):
+    valor = evento.get(chave)
+    if not isinstance(valor, str) or not valor.strip():
+        return padrao
+    return valor.strip()[:TRACK_CAMPO_MAX]
+
+
+def montar_clique(evento, contexto, hora_atual):
+    """Clique no formato usado pelo DB e pelo e-mail. Retorna None se o evento for inválido"""
+    if not isinstance(evento, dict):
+        return None
+    return {
+        "site_source": contexto['site_source'],
+        "uid": contexto['uid'],
+        "is_new_user": contexto['is_new_user'],
+        "botao": _campo_evento(evento, 'botao', 'Clique Genérico'),
+        "pagina_origem": _campo_evento(evento, 'pagina_origem', '/'),
+        "url_destino": _campo_evento(evento, 'url_destino', '#'),
 
         # Strings para o E-mail e Log
         "hora_fmt": hora_atual.strftime("%H:%M:%S"),
-        "device_str": f"{icone} {navegador} no {dispositivo}",
+        "device_str": contexto['device_str'],
 
         # Dados para o Banco (Incluindo created_at)
-        "ip_address": user_ip,
-        "dispositivo": f"{icone} {navegador}",
+        "ip_address": contexto['ip_address'],
+        "dispositivo": contexto['dispositivo'],
         "created_at": hora_atual
     }
 
-    t = threading.Thread(target=save_click_async, args=(novo_clique,))
-    t.start()
 
-    resp = make_response(jsonify({'status': 'processando_background'}))
-    if is_new_user:
-        resp.set_cookie('merlo_uid', usuario_id, max_age=31536000, httponly=True, samesite='Lax')
+def resposta_descartado(motivo):
+    """(corpo, status_http) de um clique barrado. Só o rate limit vira 429"""
+    return {'status': 'descartado', 'motivo': motivo}, 429 if motivo == 'limite' else 200
+
 
+def _resposta_tracking(contexto, aceito, motivo='sobrecarga', **extra):
+    # Executor saturado: os cliques são descartados (e contados) em vez de abrir mais threads
+    if aceito:
+        resp = make_response(jsonify({'status': 'processando_background', **extra}))
+    else:
+        corpo, status = resposta_descartado(motivo)
+        resp = make_response(jsonify(corpo), status)
+    if contexto['is_new_user']:
+        # Vindo do t.js de um site cliente, o cookie é de terceiro: só volta com SameSite=None; Secure
+        entre_sites = cookie_entre_sites(request.host, request.headers.get('Origin'))
+        resp.set_cookie('merlo_uid', contexto['uid'], max_age=31536000, httponly=True,
+                        samesite='None' if entre_sites else 'Lax', secure=entre_sites)
     return resp
 
 
+def save_clicks_async(cliques):
+    """Processa um lote vindo do /api/track-batch numa única tarefa em background"""
+    for clique in cliques:
+        save_click_async(clique)
+
+
+@app.route('/api/track-click', methods=['POST'])
+def track_click():
+    contexto, ignorado = _contexto_visitante()
+    if ignorado:
+        return ignorado
+
+    data_req = request.get_json(silent=True) or {}
+
+    # --- CORREÇÃO DE DATA: Captura a hora BR (-3) para o Banco ---
+    hora_atual = datetime.utcnow() - timedelta(hours=3)
+
+    novo_clique = montar_clique(data_req, contexto, hora_atual)
+    if novo_clique is None:
+        return jsonify({'status': 'invalido'}), 400
+
+    # Duplicados e excesso param aqui, antes de GeoIP/banco/e-mail
+    aceitos, motivo = filtrar_cliques([novo_clique])
+    if not aceitos:
+        return _resposta_tracking(contexto, False, motivo)
+
+    return _resposta_tracking(contexto, submit_background(save_click_async, novo_clique))
+
+
+@app.route('/api/track-batch', methods=['POST'])
+def track_batch():
+    """
+    Recebe vários cliques de uma vez (fila do t.js, inclusive via sendBeacon).
+    Aceita uma lista de eventos ou {"eventos": [...]}.
+    """
+    contexto, ignorado = _contexto_visitante()
+    if ignorado:
+        return ignorado
+
+    # sendBeacon nem sempre manda Content-Type JSON
+    data_req = request.get_json(force=True, silent=True)
+    if isinstance(data_req, dict):
+        data_req = data_req.get('eventos')
+    if not isinstance(data_req, list) or not data_req:
+        return jsonify({'status': 'invalido'}), 400
+
+    hora_atual = datetime.utcnow() - timedelta(hours=3)
+    cliques = [c for c in (montar_clique(e, contexto, hora_atual) for e in data_req[:TRACK_BATCH_MAX_EVENTOS]) if c]
+    if not cliques:
+        return jsonify({'status': 'invalido'}), 400
+
+    cliques, motivo = filtrar_cliques(cliques)
+    if not cliques:
+        return _resposta_tracking(contexto, False, motivo)
+
+    return _resposta_tracking(contexto, submit_background(save_clicks_async, cliques), recebidos=len(cliques))
+
+
+def _cron_do_site(site_source):
+    """Esvazia o balde de um site, se o intervalo dele não estiver desligado. Retorna a ação"""
+    settings = get_tracking_settings(site_source)
+
+    # Se estiver desativado no painel, não envia por tempo
+    if str(settings.get('cron_interval', '15')) == 'off':
+        return 'desativados'
+
+    lote_atual = drenar_cliques(site_source)
+    if not lote_atual:
+        return 'sem_cliques'
+    if not submit_background(processar_envio_background, lote_atual, "Cron Job (Rotina)", site_source):
+        # Sem vaga agora: devolve o lote ao buffer para o próximo cron
+        devolver_cliques(site_source, lote_atual)
+        return 'adiados'
+    return 'envios_agendados'
+
+
+def executar_cron():
+    """
+    Rotina do cron (independente de framework). Retorna (corpo_json, status_http).
+    Agora respeita a configuração de intervalo de cada site.
+    """
+    # Retentativas pendentes no outbox (inclusive de workers que já morreram)
+    acordar_sender()
+
+    # Partições futuras e retenção de tracking_events (COPY pode demorar: vai pro background)
+    submit_background(manter_particoes)
+
+    # Um balde por site: só os que têm cliques (com 100+ sites, a maioria costuma estar vazia)
+    try:
+        sites = sites_com_cliques()
+    except Exception as e:
+        logger.error("Erro ao listar baldes de cliques: %s", e)
+        sites = []
+    acoes = Counter(_cron_do_site(site_source) for site_source in sites)
+
+    # Portfólios em memória (o do site padrão sempre) renovados numa tarefa só, em background
+    renovacao = submit_background(renovar_portfolios, [TENANT_PADRAO])
+
+    return {'status': 'ok', 'sites_com_cliques': len(sites), **acoes,
+            'portfolios': 'renovacao_agendada' if renovacao else 'adiado'}, 200
+
+
 @app.route('/api/cron-job', methods=['GET'])
 def cron_job():
     """
     Rota chamada pelo Cron Job externo.
-    Agora respeita a configuração de intervalo do usuário.
     """
-    global BUFFER_CLIQUES
+    corpo, status = executar_cron()
+    return jsonify(corpo), status
 
-    # Busca configurações
-    settings = get_tracking_settings(SITE_SOURCE_NAME)
-    cron_interval_config = str(settings.get('cron_interval', '15'))
 
-    # Se estiver desativado no painel, não envia por tempo
-    if cron_interval_config == 'off':
-        # Mas ainda atualiza o portfólio
-        get_portfolio_data(force_refresh=True)
-        return jsonify({'status': 'skipped', 'reason': 'cron_disabled_by_user'}), 200
-
-    if len(BUFFER_CLIQUES) > 0:
-        lote_atual = list(BUFFER_CLIQUES)
-        BUFFER_CLIQUES.clear()
-        t = threading.Thread(target=processar_envio_background, args=(lote_atual, "Cron Job (Rotina)"))
-        t.start()
-        return jsonify({'status': 'ok', 'acao': 'thread_iniciada'}), 200
-    else:
-        # Atualiza cache do portfolio via DB
-        projetos = get_portfolio_data(force_refresh=True)
-        return jsonify({'status': 'ok', 'msg': 'Sem cliques. Cache renovado.'}), 200
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """
+    Contagens de cliques lidas dos rollups (nunca de tracking_events).
+    Parâmetros: granularidade=hora|dia, desde/ate=AAAA-MM-DD[THH:MM], dimensao=botao|pagina_origem|dispositivo|localizacao
+    """
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip() or request.args.get('token', '')
+    if not STATS_TOKEN:
+        return jsonify({'status': 'desativado'}), 404
+    if not hmac.compare_digest(token, STATS_TOKEN):
+        return jsonify({'status': 'nao_autorizado'}), 401
+
+    try:
+        granularidade = request.args.get('granularidade', 'dia')
+        desde = request.args.get('desde')
+        ate = request.args.get('ate')
+        desde = datetime.fromisoformat(desde) if desde else datetime.utcnow() - timedelta(hours=3, days=7)
+        ate = datetime.fromisoformat(ate) if ate else None
+        linhas = get_tracking_stats(g.tenant.site_source, granularidade, desde, ate, request.args.get('dimensao'))
+    except ValueError as e:
+        return jsonify({'status': 'invalido', 'erro': str(e)}), 400
+    except Exception as e:
+        logger.error("Erro ao ler rollups: %s", e)
+        return jsonify({'status': 'erro'}), 500
+
+    for linha in linhas:
+        linha['periodo'] = linha['periodo'].isoformat()
+    return jsonify({'status': 'ok', 'granularidade': granularidade, 'dados': linhas})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas deste processo no formato do Prometheus"""
+    if not METRICS_ATIVO or not METRICS_TOKEN:
+        return jsonify({'status': 'desativado'}), 404
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip() or request.args.get('token', '')
+    if not hmac.compare_digest(token, METRICS_TOKEN):
+        return jsonify({'status': 'nao_autorizado'}), 401
+
+    response = make_response(exportar())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
 
 
 @app.route('/sitemap.xml')
@@ -422,7 +590,7 @@ def sitemap():
     for page in pages:
         sitemap_xml += f"""
         <url>
-            <loc>{HOST_URL}{page}</loc>
+            <loc>{g.tenant.host_url}{page}</loc>
             <changefreq>monthly</changefreq>
             <priority>{'1.0' if page == '/' else '0.8'}</priority>
         </url>"""
@@ -434,13 +602,14 @@ def sitemap():
 
 @app.route('/robots.txt')
 def robots():
-    lines = ["User-agent: *", "Disallow: ", f"Sitemap: {HOST_URL}/sitemap.xml"]
+    lines = ["User-agent: *", "Disallow: ", f"Sitemap: {g.tenant.host_url}/sitemap.xml"]
     response = make_response("\n".join(lines))
     response.headers["Content-Type"] = "text/plain"
     return response
 
 
 @app.route('/termos&privacidade')
+@pagina_em_cache()
 def termos():
     return render_template(
         'termos&privacidade.html',
@@ -451,8 +620,60 @@ def termos():
 
 # --- ROTA DE ERRO 404 ---
 @app.errorhandler(404)
+@pagina_em_cache(por_caminho=False)
 def page_not_found(e):
-    return render_template('404.html', title="404 | Página Não Encontrada"), 404
+    # Uma entrada por site no cache: o HTML não pode citar o caminho pedido
+    return render_template('404.html', title="404 | Página Não Encontrada", caminho_canonico='/'), 404
+
+
+# --- AQUECIMENTO E PRONTIDÃO ---
+def _aquecer_modulos():
+    # Os mesmos imports que o primeiro clique/e-mail/consulta GeoIP fariam
+    for nome in ('user_agents', 'requests', 'resend'):
+        importlib.import_module(nome)
+
+
+def _aquecer_templates():
+    # get_template compila e guarda no cache do Jinja; os de email/ usam outro Environment
+    for nome in app.jinja_env.list_templates():
+        if not nome.startswith('email/'):
+            app.jinja_env.get_template(nome)
+
+
+def _aquecer_paginas():
+    # Renderiza e comprime as páginas do cache do site padrão (a chave é site +
+    # caminho; base_url=HOST_URL faz a requisição cair nele)
+    cliente = app.test_client()
+    for pagina in ('/', '/servicos', '/servicos/website', '/servicos/sistemas', '/contato'):
+        cliente.get(pagina, base_url=HOST_URL)
+
+
+def _aquecer_banco():
+    # Abre o pool (DB_POOL_MIN conexões) e enche os caches de settings e portfólio
+    with db_cursor(operacao='aquecimento') as cur:
+        cur.execute("SELECT 1")
+    get_tracking_settings(SITE_SOURCE_NAME)
+    get_portfolio_data()
+
+
+registrar_etapa('modulos', _aquecer_modulos)
+registrar_etapa('templates', _aquecer_templates)
+registrar_etapa('paginas', _aquecer_paginas)
+registrar_etapa('banco', _aquecer_banco)
+iniciar_aquecimento()
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: o processo está de pé e respondendo"""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 503 enquanto o aquecimento (AQUECIMENTO_ATIVO=1) não terminou"""
+    resumo = estado()
+    return jsonify(resumo), (200 if resumo['pronto'] else 503)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,330 @@
+"""
+Modo de deploy async (opcional).
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --workers 2
+
+/api/track-click, /api/track-batch e /api/cron-job rodam no asyncio, com pool
+asyncpg e cliente httpx; todas as outras rotas continuam no Flask (app.py),
+montado como WSGI no mesmo processo. O deploy sync (gunicorn app:app) segue igual.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncpg
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, Mount
+
+import app as flask_app
+from db_utils import (
+    TRACKING_BATCH_SIZE, TRACKING_FLUSH_SEGUNDOS, TRACKING_QUEUE_MAX, TRACKING_ROLLUPS_ATIVO,
+    _tracking_row, agregar_rollups,
+)
+from geoip import get_location_data_rich_async
+from metrics import HTTP_LATENCIA, expor_stats
+from rate_limit import filtrar_cliques
+from tenants import TENANTS_ESTRITO, cabecalhos_cors, cookie_entre_sites, resolver_tenant
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DB_POOL_MIN = int(os.getenv('ASYNC_DB_POOL_MIN', '1'))
+ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', '10'))
+# Cliques sendo processados ao mesmo tempo (GeoIP + fila); acima disso são descartados
+ASYNC_MAX_TAREFAS = int(os.getenv('ASYNC_MAX_TAREFAS', '1000'))
+# Threads para o que ainda é sync (balde do e-mail, configs, cron)
+ASYNC_THREADS_SYNC = int(os.getenv('ASYNC_THREADS_SYNC', '4'))
+
+ASYNC_STATS = {"aceitos": 0, "descartados": 0, "gravados": 0, "erros_gravacao": 0}
+expor_stats('asgi', ASYNC_STATS, 'Processamento async de cliques')
+
+_estado = {"pool": None, "http": None, "fila": None, "writer": None, "tarefas": set(), "sync": None}
+# Posto na fila no desligamento: o writer grava o lote que estava juntando e sai
+_WRITER_PARAR = object()
+
+
+# --- BANCO (asyncpg) ---
+
+async def _get_pool():
+    if _estado["pool"] is None:
+        try:
+            _estado["pool"] = await asyncpg.create_pool(
+                os.getenv('DATABASE_URL'), min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX
+            )
+        except Exception as e:
+            logger.error("Erro ao criar pool asyncpg: %s", e)
+            return None
+    return _estado["pool"]
+
+
+async def _gravar_lote(lote):
+    pool = await _get_pool()
+    if pool is None:
+        ASYNC_STATS["erros_gravacao"] += len(lote)
+        return
+
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany("""
+                    INSERT INTO tracking_events
+                    (site_source, uid, botao, pagina_origem, url_destino, ip_address, localizacao, provedor, dispositivo, created_at)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                """, [_tracking_row(e) for e in lote])
+
+                contagens = agregar_rollups(lote) if TRACKING_ROLLUPS_ATIVO else None
+                if contagens:
+                    try:
+                        # Transação aninhada = savepoint: rollup com erro não derruba os eventos
+                        async with conn.transaction():
+                            await conn.executemany("""
+                                INSERT INTO tracking_rollups
+                                (granularidade, periodo, site_source, botao, pagina_origem, dispositivo, localizacao, total)
+                                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                                ON CONFLICT (granularidade, periodo, site_source, botao, pagina_origem, dispositivo, localizacao)
+                                DO UPDATE SET total = tracking_rollups.total + EXCLUDED.total
+                            """, [chave + (total,) for chave, total in sorted(contagens.items())])
+                    except Exception as e:
+                        logger.warning("Erro ao atualizar rollups: %s", e, extra={"eventos": len(lote)})
+        ASYNC_STATS["gravados"] += len(lote)
+    except Exception as e:
+        ASYNC_STATS["erros_gravacao"] += len(lote)
+        logger.error("Erro ao salvar lote de tracking (async): %s", e, extra={"eventos": len(lote)})
+
+
+async def _loop_writer():
+    """
+    Mesma política do writer sync: grava quando enche o lote ou vence o tempo.
+    Ao tirar _WRITER_PARAR da fila, grava o lote parcial e termina.
+    """
+    fila = _estado["fila"]
+    parar = False
+    while not parar:
+        item = await fila.get()
+        if item is _WRITER_PARAR:
+            return
+        lote = [item]
+        prazo = time.monotonic() + TRACKING_FLUSH_SEGUNDOS
+        while len(lote) < TRACKING_BATCH_SIZE:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(fila.get(), restante)
+            except asyncio.TimeoutError:
+                break
+            if item is _WRITER_PARAR:
+                parar = True
+                break
+            lote.append(item)
+        await _gravar_lote(lote)
+
+
+async def _parar_writer():
+    """Pede ao writer para sair depois do que já está na fila e espera ele terminar"""
+    writer = _estado["writer"]
+    try:
+        await asyncio.wait_for(_estado["fila"].put(_WRITER_PARAR), timeout=TRACKING_FLUSH_SEGUNDOS + 5)
+        await asyncio.wait_for(writer, timeout=TRACKING_FLUSH_SEGUNDOS + 10)
+    except asyncio.TimeoutError:
+        # wait_for já cancelou o writer; o que ficou na fila vai por _esvaziar_fila
+        writer.cancel()
+        logger.warning("Writer async não terminou a tempo no desligamento.")
+
+
+async def _esvaziar_fila():
+    fila = _estado["fila"]
+    pendentes = []
+    while not fila.empty():
+        item = fila.get_nowait()
+        if item is not _WRITER_PARAR:
+            pendentes.append(item)
+    for i in range(0, len(pendentes), TRACKING_BATCH_SIZE):
+        await _gravar_lote(pendentes[i:i + TRACKING_BATCH_SIZE])
+
+
+# --- PROCESSAMENTO DO CLIQUE ---
+
+async def _rodar_sync(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_estado["sync"], fn, *args)
+
+
+async def _processar_clique(clique):
+    geo_data = await get_location_data_rich_async(clique['ip_address'], _estado["http"])
+    clique['localizacao'] = geo_data['local']
+    clique['provedor'] = geo_data['rede']
+
+    try:
+        _estado["fila"].put_nowait(clique)
+    except asyncio.QueueFull:
+        ASYNC_STATS["descartados"] += 1
+        logger.warning("Fila de tracking (async) cheia. Evento descartado.")
+
+    # Balde do e-mail e configs continuam sync (compartilhados com o Flask)
+    await _rodar_sync(flask_app.bufferizar_clique, clique)
+
+
+def _agendar(cliques):
+    """Agenda o processamento sem segurar a resposta. False se estiver saturado"""
+    if len(_estado["tarefas"]) + len(cliques) > ASYNC_MAX_TAREFAS:
+        ASYNC_STATS["descartados"] += len(cliques)
+        return False
+
+    for clique in cliques:
+        tarefa = asyncio.create_task(_processar_clique(clique))
+        _estado["tarefas"].add(tarefa)
+        tarefa.add_done_callback(_estado["tarefas"].discard)
+    ASYNC_STATS["aceitos"] += len(cliques)
+    return True
+
+
+def _visitante(request):
+    return flask_app.identificar_visitante(
+        ', '.join(request.headers.getlist('x-forwarded-for')) or None,
+        request.client.host if request.client else None,
+        request.headers.get('user-agent'),
+        request.cookies.get('merlo_uid'),
+        resolver_tenant(request.headers.get('host'), request.headers.get('origin'), TENANTS_ESTRITO)
+    )
+
+
+def _resposta(request, contexto, aceito, motivo='sobrecarga', **extra):
+    if aceito:
+        resp = JSONResponse({'status': 'processando_background', **extra})
+    else:
+        corpo, status = flask_app.resposta_descartado(motivo)
+        resp = JSONResponse(corpo, status_code=status)
+    if contexto['is_new_user']:
+        # Mesma regra do Flask: de um site cliente, cookie de terceiro com SameSite=None; Secure
+        entre_sites = cookie_entre_sites(request.headers.get('host'), request.headers.get('origin'))
+        resp.set_cookie('merlo_uid', contexto['uid'], max_age=31536000, httponly=True,
+                        samesite='none' if entre_sites else 'lax', secure=entre_sites)
+    return resp
+
+
+async def _ler_json(request):
+    try:
+        return json.loads(await request.body() or b'null')
+    except ValueError:
+        return None
+
+
+def _com_cors(handler):
+    """Preflight e cabeçalhos CORS das rotas de tracking (mesma regra de app._cors_tracking)"""
+    async def wrapper(request):
+        preflight = request.method == 'OPTIONS'
+        if preflight:
+            resposta = Response(status_code=204, headers={'Allow': 'POST, OPTIONS'})
+        else:
+            resposta = await handler(request)
+        resposta.headers.update(cabecalhos_cors(request.headers.get('origin'), preflight))
+        resposta.headers.append('Vary', 'Origin')
+        return resposta
+    return wrapper
+
+
+def _medido(rota):
+    """Mesma métrica de latência por rota do Flask, para os handlers async"""
+    def decorador(handler):
+        async def wrapper(request):
+            inicio = time.perf_counter()
+            resposta = await handler(request)
+            HTTP_LATENCIA.observe(time.perf_counter() - inicio, rota=rota, metodo=request.method,
+                                  status=resposta.status_code)
+            return resposta
+        return wrapper
+    return decorador
+
+
+@_medido('/api/track-click')
+@_com_cors
+async def track_click(request):
+    contexto, motivo = _visitante(request)
+    if motivo:
+        return JSONResponse({'status': 'ignorado', 'motivo': motivo})
+
+    # Mesmo contrato do Flask (get_json(silent=True) or {}): corpo vazio ou JSON
+    # inválido vira {}, e um JSON que não é objeto é rejeitado
+    data_req = await _ler_json(request) or {}
+    hora_atual = datetime.utcnow() - timedelta(hours=3)
+    clique = flask_app.montar_clique(data_req, contexto, hora_atual)
+    if clique is None:
+        return JSONResponse({'status': 'invalido'}, status_code=400)
+    aceitos, motivo = filtrar_cliques([clique])
+    if not aceitos:
+        return _resposta(request, contexto, False, motivo)
+    return _resposta(request, contexto, _agendar(aceitos))
+
+
+@_medido('/api/track-batch')
+@_com_cors
+async def track_batch(request):
+    contexto, motivo = _visitante(request)
+    if motivo:
+        return JSONResponse({'status': 'ignorado', 'motivo': motivo})
+
+    data_req = await _ler_json(request)
+    if isinstance(data_req, dict):
+        data_req = data_req.get('eventos')
+    if not isinstance(data_req, list) or not data_req:
+        return JSONResponse({'status': 'invalido'}, status_code=400)
+
+    hora_atual = datetime.utcnow() - timedelta(hours=3)
+    cliques = [
+        c for c in (flask_app.montar_clique(e, contexto, hora_atual)
+                    for e in data_req[:flask_app.TRACK_BATCH_MAX_EVENTOS]) if c
+    ]
+    if not cliques:
+        return JSONResponse({'status': 'invalido'}, status_code=400)
+    cliques, motivo = filtrar_cliques(cliques)
+    if not cliques:
+        return _resposta(request, contexto, False, motivo)
+    return _resposta(request, contexto, _agendar(cliques), recebidos=len(cliques))
+
+
+@_medido('/api/cron-job')
+async def cron_job(request):
+    # Rotina do cron é a mesma do Flask, fora do event loop
+    corpo, status = await _rodar_sync(flask_app.executar_cron)
+    return JSONResponse(corpo, status_code=status)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    _estado["sync"] = ThreadPoolExecutor(max_workers=ASYNC_THREADS_SYNC, thread_name_prefix="merlo-asgi-sync")
+    _estado["http"] = httpx.AsyncClient()
+    _estado["fila"] = asyncio.Queue(maxsize=TRACKING_QUEUE_MAX)
+    _estado["writer"] = asyncio.create_task(_loop_writer())
+    try:
+        yield
+    finally:
+        # Desligamento: termina os cliques em andamento, deixa o writer gravar o lote
+        # que estava juntando e grava o que ainda sobrar na fila (cliques atrasados)
+        if _estado["tarefas"]:
+            await asyncio.wait(list(_estado["tarefas"]), timeout=10)
+        await _parar_writer()
+        await _esvaziar_fila()
+        await _estado["http"].aclose()
+        if _estado["pool"] is not None:
+            await _estado["pool"].close()
+        _estado["sync"].shutdown(wait=True)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/track-click', track_click, methods=['POST', 'OPTIONS']),
+        Route('/api/track-batch', track_batch, methods=['POST', 'OPTIONS']),
+        Route('/api/cron-job', cron_job, methods=['GET']),
+        # Páginas, /contato, /api/stats, sitemap etc. continuam no Flask
+        Mount('/', app=WSGIMiddleware(flask_app.app)),
+    ],
+    lifespan=lifespan,
+)
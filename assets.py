@@ -0,0 +1,275 @@
+import os
+import re
+import io
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import mimetypes
+import tempfile
+import threading
+
+from flask import request, send_file, url_for, abort
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# --- PIPELINE DE ARQUIVOS ESTÁTICOS ---
+# No deploy, `python assets.py` junta e minifica os CSS/JS, redimensiona os ícones
+# para os tamanhos declarados no base.html e grava tudo em static/dist/ com o hash
+# do conteúdo no nome, mais as variantes .gz/.br. O manifest.json liga o nome
+# lógico ao arquivo gerado; url_for('static') consulta o manifesto, e /static/dist/
+# responde com Cache-Control immutable e o Content-Encoding que o navegador aceitar.
+# Na subida o app só lê o manifesto (brotli q11, gzip 9 e Pillow custariam centenas
+# de ms em cada worker): sem ele, ou com alguma fonte mais nova, servimos os
+# arquivos originais sem hash. Pillow e brotli são opcionais: sem eles os ícones
+# saem do tamanho original e não há variante .br.
+ASSETS_ATIVO = os.getenv('ASSETS_ATIVO', '1') == '1'
+ASSETS_MAX_AGE = int(os.getenv('ASSETS_MAX_AGE', str(365 * 24 * 3600)))
+
+_PASTA_STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+_PASTA_DIST = os.path.join(_PASTA_STATIC, 'dist')
+_MANIFESTO_PATH = os.path.join(_PASTA_DIST, 'manifest.json')
+
+# Nome lógico -> arquivos de origem, na ordem em que entram no pacote
+PACOTES = {
+    'css/site.css': ['css/style.css', 'css/mediastyle.css'],
+    'js/site.js': ['js/main.js', 'js/t.js'],
+}
+# Nome lógico -> (origem, lado em px). None mantém o tamanho e só recomprime
+IMAGENS = {
+    'icons/favicon-16.png': ('cleanlogo.png', 16),
+    'icons/favicon-32.png': ('cleanlogo.png', 32),
+    'icons/apple-touch-icon.png': ('cleanlogo.png', 180),
+    'logo.png': ('logo.png', None),
+    'cleanlogo.png': ('cleanlogo.png', None),
+}
+# Só texto compensa pré-compressão (PNG já é comprimido)
+_EXTENSOES_COMPRIMIVEIS = ('.css', '.js', '.svg', '.json', '.txt')
+
+_MANIFESTO = {}
+_LOCK = threading.Lock()
+
+_RE_STRING_CSS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+_RE_COMENTARIO_CSS = re.compile(r'/\*.*?\*/', re.S)
+
+
+def minificar_css(texto):
+    """Minificação conservadora: comentários e espaços, sem tocar em strings"""
+    texto = _RE_COMENTARIO_CSS.sub('', texto)
+    partes = _RE_STRING_CSS.split(texto)
+    for i in range(0, len(partes), 2):
+        parte = re.sub(r'\s+', ' ', partes[i])
+        parte = re.sub(r'\s*([{};,>])\s*', r'\1', parte)
+        parte = re.sub(r':\s+', ':', parte)
+        partes[i] = parte.replace(';}', '}')
+    return ''.join(partes).strip()
+
+
+def minificar_js(texto):
+    """
+    Sem parser de JS aqui, então só o que é seguro: indentação, linhas em branco
+    e linhas que são inteiras comentário //.
+    """
+    linhas = []
+    for linha in texto.splitlines():
+        linha = linha.strip()
+        if not linha or linha.startswith('//'):
+            continue
+        linhas.append(linha)
+    return '\n'.join(linhas)
+
+
+def _ler(relativo):
+    with open(os.path.join(_PASTA_STATIC, relativo), encoding='utf-8') as f:
+        return f.read()
+
+
+def _montar_pacote(nome, fontes):
+    if nome.endswith('.css'):
+        return '\n'.join(minificar_css(_ler(f)) for f in fontes).encode('utf-8')
+    # O ';' evita que um arquivo sem ponto e vírgula final "cole" no próximo
+    return ';\n'.join(minificar_js(_ler(f)) for f in fontes).encode('utf-8')
+
+
+def _pillow():
+    # Só o build (python assets.py) precisa do PIL
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def _montar_imagem(origem, lado):
+    caminho = os.path.join(_PASTA_STATIC, origem)
+    Image = _pillow()
+    if Image is None:
+        with open(caminho, 'rb') as f:
+            return f.read()
+
+    with Image.open(caminho) as img:
+        img = img.convert('RGBA')
+        if lado:
+            # Encaixa num quadrado transparente (o logo pode não ser quadrado)
+            img.thumbnail((lado, lado), Image.LANCZOS)
+            quadro = Image.new('RGBA', (lado, lado), (0, 0, 0, 0))
+            quadro.paste(img, ((lado - img.width) // 2, (lado - img.height) // 2))
+            img = quadro
+        saida = io.BytesIO()
+        img.save(saida, format='PNG', optimize=True)
+    return saida.getvalue()
+
+
+def _nome_com_hash(nome, conteudo):
+    base, ext = os.path.splitext(nome)
+    return f"{base}.{hashlib.sha256(conteudo).hexdigest()[:12]}{ext}"
+
+
+def _gravar(relativo, conteudo):
+    destino = os.path.join(_PASTA_DIST, relativo)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    # Mesmo nome = mesmo conteúdo: se já existe (outro worker gravou), não reescreve
+    if os.path.exists(destino):
+        return
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(destino), prefix='.asset-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(conteudo)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, destino)
+
+
+def _fontes():
+    fontes = {f for lista in PACOTES.values() for f in lista}
+    fontes.update(origem for origem, _ in IMAGENS.values())
+    return sorted(fontes)
+
+
+def construir_assets(limpar=False):
+    """Gera static/dist/ e o manifest.json. Retorna o manifesto"""
+    if limpar:
+        shutil.rmtree(_PASTA_DIST, ignore_errors=True)
+
+    gerados = {nome: _montar_pacote(nome, fontes) for nome, fontes in PACOTES.items()}
+    gerados.update({nome: _montar_imagem(origem, lado) for nome, (origem, lado) in IMAGENS.items()})
+
+    manifesto = {}
+    for nome, conteudo in gerados.items():
+        final = _nome_com_hash(nome, conteudo)
+        _gravar(final, conteudo)
+        if final.endswith(_EXTENSOES_COMPRIMIVEIS):
+            _gravar(final + '.gz', gzip.compress(conteudo, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _gravar(final + '.br', brotli.compress(conteudo))
+        manifesto[nome] = final
+
+    fd, tmp = tempfile.mkstemp(dir=_PASTA_DIST, prefix='.manifest-')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=2, sort_keys=True)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, _MANIFESTO_PATH)
+
+    logger.info("Assets gerados.", extra={"arquivos": len(manifesto), "brotli": brotli is not None,
+                                          "pillow": _pillow() is not None})
+    return manifesto
+
+
+def _manifesto_atualizado():
+    """Manifesto do disco, se for mais novo que todas as fontes. Retorna (manifesto, motivo)"""
+    try:
+        mtime = os.path.getmtime(_MANIFESTO_PATH)
+    except OSError:
+        return None, "manifesto ausente"
+    alteradas = [f for f in _fontes() if os.path.getmtime(os.path.join(_PASTA_STATIC, f)) > mtime]
+    if alteradas:
+        return None, f"fontes mais novas que o manifesto: {', '.join(alteradas)}"
+    try:
+        with open(_MANIFESTO_PATH, encoding='utf-8') as f:
+            manifesto = json.load(f)
+    except (OSError, ValueError) as e:
+        return None, f"manifesto ilegível: {e}"
+    faltando = [v for v in manifesto.values() if not os.path.exists(os.path.join(_PASTA_DIST, v))]
+    if faltando:
+        return None, f"arquivos gerados ausentes: {', '.join(faltando)}"
+    return manifesto, None
+
+
+def carregar_manifesto():
+    """Lê o manifesto gerado no deploy; sem ele (ou desatualizado) usa os arquivos originais"""
+    global _MANIFESTO
+    with _LOCK:
+        try:
+            manifesto, motivo = _manifesto_atualizado()
+        except OSError as e:
+            manifesto, motivo = None, str(e)
+        if manifesto is None:
+            logger.warning("Assets sem build, servindo os arquivos originais. Rode `python assets.py`.",
+                           extra={"motivo": motivo})
+            manifesto = {}
+        _MANIFESTO = manifesto
+    return manifesto
+
+
+def urls_asset(nome):
+    """URLs para incluir um pacote: o arquivo gerado, ou as fontes quando o pipeline está desligado"""
+    if nome in _MANIFESTO:
+        return [url_for('static', filename=nome)]
+    return [url_for('static', filename=f) for f in PACOTES.get(nome, [nome])]
+
+
+def _trocar_por_versao(endpoint, values):
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    nome = values['filename']
+    if nome in _MANIFESTO:
+        values['filename'] = 'dist/' + _MANIFESTO[nome]
+    elif nome in IMAGENS:
+        # Pipeline desligado: ícone lógico aponta para a imagem original
+        values['filename'] = IMAGENS[nome][0]
+
+
+def _servir_dist(filename):
+    caminho = os.path.realpath(os.path.join(_PASTA_DIST, filename))
+    if not caminho.startswith(_PASTA_DIST + os.sep) or not os.path.isfile(caminho):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    codificacao = None
+    for nome, ext in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[nome] and os.path.isfile(caminho + ext):
+            caminho, codificacao = caminho + ext, nome
+            break
+
+    resp = send_file(caminho, mimetype=mimetype, max_age=ASSETS_MAX_AGE, conditional=True)
+    if codificacao:
+        resp.headers['Content-Encoding'] = codificacao
+    if filename.endswith(_EXTENSOES_COMPRIMIVEIS):
+        resp.headers['Vary'] = 'Accept-Encoding'
+    # O nome muda quando o conteúdo muda: o navegador nunca precisa revalidar
+    resp.headers['Cache-Control'] = f'public, max-age={ASSETS_MAX_AGE}, immutable'
+    return resp
+
+
+def iniciar_assets(app):
+    """Carrega o manifesto e liga url_for('static') e /static/dist/ ao app"""
+    app.jinja_env.globals['urls_asset'] = urls_asset
+    if not ASSETS_ATIVO:
+        app.url_defaults(_trocar_por_versao)
+        return
+
+    carregar_manifesto()
+    app.url_defaults(_trocar_por_versao)
+    # Regra mais específica que /static/<path>, então o Flask escolhe esta para dist/
+    app.add_url_rule('/static/dist/<path:filename>', 'static_dist', _servir_dist)
+
+
+if __name__ == '__main__':
+    from logs import configurar_logging
+    configurar_logging()
+    for nome, final in sorted(construir_assets(limpar=True).items()):
+        print(f"{nome} -> dist/{final}")
@@ -0,0 +1,98 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import gauge, expor_stats
+
+logger = logging.getLogger(__name__)
+
+# --- EXECUTOR COMPARTILHADO PARA TRABALHO EM BACKGROUND ---
+# GeoIP, gravação no DB e envio de e-mail rodam aqui, com número fixo de threads
+# por worker. Quando o executor está saturado a tarefa é recusada (e contada)
+# em vez de abrir uma thread nova para cada clique.
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', '4'))
+# Tarefas aguardando além das que já estão rodando
+BACKGROUND_QUEUE_MAX = int(os.getenv('BACKGROUND_QUEUE_MAX', '500'))
+
+BACKGROUND_STATS = {"aceitas": 0, "recusadas": 0, "concluidas": 0, "erros": 0}
+_STATS_LOCK = threading.Lock()
+
+_EXECUTOR = None
+_EXECUTOR_PID = None
+_VAGAS = None
+_PENDENTES = 0
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _contar(chave, quantidade=1):
+    with _STATS_LOCK:
+        BACKGROUND_STATS[chave] += quantidade
+
+
+def _get_executor():
+    """Executor do processo atual (recriado após o fork do gunicorn)"""
+    global _EXECUTOR, _EXECUTOR_PID, _VAGAS, _PENDENTES
+
+    pid = os.getpid()
+    if _EXECUTOR is not None and _EXECUTOR_PID == pid:
+        return _EXECUTOR, _VAGAS
+
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None or _EXECUTOR_PID != pid:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="merlo-bg")
+            _VAGAS = threading.BoundedSemaphore(BACKGROUND_WORKERS + BACKGROUND_QUEUE_MAX)
+            _EXECUTOR_PID = pid
+            _PENDENTES = 0
+    return _EXECUTOR, _VAGAS
+
+
+def _ajustar_pendentes(delta):
+    global _PENDENTES
+    with _STATS_LOCK:
+        _PENDENTES += delta
+
+
+def background_queue_depth():
+    """Tarefas aceitas que ainda não terminaram (rodando + na fila)"""
+    return _PENDENTES
+
+
+def submit_background(fn, *args, **kwargs):
+    """
+    Agenda fn(*args, **kwargs) no executor compartilhado.
+    Retorna False (sem bloquear) se o executor estiver saturado.
+    """
+    executor, vagas = _get_executor()
+    if not vagas.acquire(blocking=False):
+        _contar("recusadas")
+        logger.warning("Executor em background saturado. Tarefa recusada.", extra={"tarefa": fn.__name__})
+        return False
+
+    def _rodar():
+        try:
+            fn(*args, **kwargs)
+            _contar("concluidas")
+        except Exception as e:
+            _contar("erros")
+            logger.exception("Erro na tarefa em background: %s", e, extra={"tarefa": fn.__name__})
+        finally:
+            _ajustar_pendentes(-1)
+            vagas.release()
+
+    _ajustar_pendentes(1)
+    try:
+        executor.submit(_rodar)
+    except RuntimeError:
+        # Executor já desligado (processo encerrando)
+        _ajustar_pendentes(-1)
+        vagas.release()
+        _contar("recusadas")
+        return False
+
+    _contar("aceitas")
+    return True
+
+
+gauge('background_fila_tamanho', 'Tarefas em background rodando ou na fila', background_queue_depth)
+expor_stats('background', BACKGROUND_STATS, 'Executor de tarefas em background')
@@ -0,0 +1,469 @@
+"""
+Cenários de banco, um por mudança da camada de dados, medindo antes x depois.
+
+    python bench/cenarios.py
+    python bench/cenarios.py --cenarios conexoes,insercao --saida bench/resultados/cenarios.json
+    python bench/cenarios.py --db-url postgresql://bench@127.0.0.1/merlo_teste --eventos 1000000
+
+Sobe o Postgres descartável do perf.py (ou usa --db-url, um banco de teste:
+as tabelas são criadas e semeadas nele), aplica bench/schema.sql e migrations/
+e roda os cenários escolhidos. O "antes" reproduz o SQL do db_utils original
+(psycopg2.connect por chamada, INSERT + commit por clique, fetchall, LIKE sem
+índice, GROUP BY nos eventos brutos); o "depois" chama o db_utils atual.
+
+    conexoes  consultas/s e p99 com concorrência: conexão nova por chamada x pool
+    insercao  eventos/s: conexão + INSERT + commit por evento x fila + writer em lote (meta: 10x)
+    leitura   pico de RSS lendo uma tabela de --linhas (1M): fetchall x iter_sheet_data
+    nomes     resolução do portfólio numa user_tables de --tabelas (100k) linhas
+    stats     série diária com --eventos (10M) eventos: GROUP BY bruto x rollups
+
+A semeadura grande (1M linhas, 10M eventos) é feita no próprio servidor com
+generate_series e só na primeira vez em cada banco.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from perf import RAIZ, SITE_SOURCE, PostgresDescartavel, _binario_pg, _commit_atual, percentil, preparar_banco
+
+sys.path.insert(0, RAIZ)
+
+TABELA_LEITURA = 'Bench Leitura'
+PREFIXO_TABELAS = 'Bench Nome'
+BOTAO_ANTES = 'bench-insercao-antes'
+BOTAO_DEPOIS = 'bench-insercao-depois'
+
+
+def _latencias(duracoes):
+    ordenadas = sorted(duracoes)
+    return {
+        "p50_ms": round(percentil(ordenadas, 50) * 1000, 2),
+        "p95_ms": round(percentil(ordenadas, 95) * 1000, 2),
+        "p99_ms": round(percentil(ordenadas, 99) * 1000, 2),
+    }
+
+
+def _em_threads(concorrencia, total, fn):
+    """Divide total chamadas de fn(i) entre as threads. Retorna (segundos, [duração de cada chamada])"""
+    duracoes = []
+    lock = threading.Lock()
+    largada = threading.Barrier(concorrencia + 1)
+
+    def trabalhador(indices):
+        locais = []
+        largada.wait()
+        for i in indices:
+            inicio = time.perf_counter()
+            fn(i)
+            locais.append(time.perf_counter() - inicio)
+        with lock:
+            duracoes.extend(locais)
+
+    threads = [threading.Thread(target=trabalhador, args=(range(n, total, concorrencia),)) for n in range(concorrencia)]
+    for t in threads:
+        t.start()
+    largada.wait()
+    inicio = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - inicio, duracoes
+
+
+def _conectar(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    return conn
+
+
+def _contar(dsn, sql, params=()):
+    conn = _conectar(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+# --- conexoes ---
+
+def cenario_conexoes(dsn, args):
+    """Mesma consulta de configs do site: psycopg2.connect + close a cada chamada x db_cursor do pool"""
+    import db_utils
+
+    sql = "SELECT tracking_config FROM users WHERE site_source = %s LIMIT 1"
+
+    def antes(_):
+        conn = psycopg2.connect(dsn)
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(sql, (SITE_SOURCE,))
+            cur.fetchone()
+        finally:
+            conn.close()
+
+    def depois(_):
+        with db_utils.db_cursor(cursor_factory=db_utils.dict_cursor(), operacao='bench') as cur:
+            cur.execute(sql, (SITE_SOURCE,))
+            cur.fetchone()
+
+    resultado = {}
+    for nome, fn in (('antes', antes), ('depois', depois)):
+        segundos, duracoes = _em_threads(args.concorrencia, args.consultas, fn)
+        resultado[nome] = {"consultas": args.consultas, "por_segundo": round(args.consultas / segundos, 1),
+                           **_latencias(duracoes)}
+    pool = db_utils.get_db_pool()
+    resultado["antes"]["conexoes_abertas"] = args.consultas
+    resultado["depois"]["conexoes_abertas"] = len(pool._pool) + len(pool._used)
+    resultado["ganho"] = round(resultado["depois"]["por_segundo"] / resultado["antes"]["por_segundo"], 1)
+    return resultado
+
+
+# --- insercao ---
+
+def _evento(botao, i):
+    return {
+        "site_source": SITE_SOURCE, "uid": f"bench-{i % 500}", "botao": botao, "pagina_origem": '/',
+        "url_destino": '/contato', "ip_address": f"10.0.{i // 250 % 250}.{i % 250}", "localizacao": 'Blumenau/SC',
+        "provedor": 'Bench', "dispositivo": '💻 Chrome', "created_at": datetime.now(),
+    }
+
+
+def cenario_insercao(dsn, args):
+    """Conexão + INSERT + commit por evento (db_utils original) x enqueue_tracking_event + writer em lote"""
+    import db_utils
+
+    def antes(i):
+        # insert_tracking_event original: psycopg2.connect, INSERT, commit e close a cada clique
+        conn = psycopg2.connect(dsn)
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO tracking_events
+                (site_source, uid, botao, pagina_origem, url_destino, ip_address, localizacao, provedor, dispositivo, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, db_utils._tracking_row(_evento(BOTAO_ANTES, i)))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def depois(i):
+        db_utils.enqueue_tracking_event(_evento(BOTAO_DEPOIS, i))
+
+    segundos_antes, duracoes = _em_threads(args.concorrencia, args.insercoes, antes)
+
+    gravados_inicio = db_utils.TRACKING_WRITER_STATS["gravados"]
+    inicio = time.perf_counter()
+    _em_threads(args.concorrencia, args.insercoes, depois)
+    # Para o writer e grava o resto da fila: o tempo vai até o último evento no banco
+    db_utils.flush_tracking_events()
+    segundos_depois = time.perf_counter() - inicio
+
+    no_banco = _contar(dsn, "SELECT count(*) FROM tracking_events WHERE botao = %s", (BOTAO_DEPOIS,))
+    resultado = {
+        "antes": {"eventos": args.insercoes, "por_segundo": round(args.insercoes / segundos_antes, 1),
+                  **_latencias(duracoes)},
+        "depois": {"eventos": args.insercoes, "por_segundo": round(args.insercoes / segundos_depois, 1),
+                   "gravados": db_utils.TRACKING_WRITER_STATS["gravados"] - gravados_inicio,
+                   "descartados": db_utils.TRACKING_WRITER_STATS["descartados"], "no_banco": no_banco},
+    }
+    resultado["ganho"] = round(resultado["depois"]["por_segundo"] / resultado["antes"]["por_segundo"], 1)
+    resultado["meta_10x"] = resultado["ganho"] >= 10
+    return resultado
+
+
+# --- leitura ---
+
+def _semear_leitura(dsn, linhas):
+    conn = _conectar(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM user_tables WHERE display_name = %s", (TABELA_LEITURA,))
+        achada = cur.fetchone()
+        if achada:
+            cur.execute("SELECT count(*) FROM table_records WHERE table_id = %s", (achada[0],))
+            if cur.fetchone()[0] >= linhas:
+                return achada[0]
+            cur.execute("DELETE FROM table_records WHERE table_id = %s", (achada[0],))
+            tab_id = achada[0]
+        else:
+            cur.execute("INSERT INTO user_tables (display_name) VALUES (%s) RETURNING id", (TABELA_LEITURA,))
+            tab_id = cur.fetchone()[0]
+        # Linhas no formato do portfólio, com uma descrição de tamanho realista
+        cur.execute("""
+            INSERT INTO table_records (table_id, data)
+            SELECT %s, jsonb_build_object(
+                'Título', 'Projeto ' || g, 'Descrição', repeat('Descrição do projeto. ', 10),
+                'Link do site', 'https://exemplo.com/' || g, 'Logo', '', 'Tipo', 'Site', 'Cliente', 'Cliente ' || g % 97)
+            FROM generate_series(1, %s) g
+        """, (tab_id, linhas))
+        cur.execute("ANALYZE table_records")
+        return tab_id
+    finally:
+        conn.close()
+
+
+def _rss_kb():
+    with open('/proc/self/status') as f:
+        for linha in f:
+            if linha.startswith('VmRSS:'):
+                return int(linha.split()[1])
+    return 0
+
+
+def _ler_em_subprocesso(modo, tab_id):
+    """Roda no processo filho (--_leitura): lê a tabela inteira e imprime o pico de RSS"""
+    from portfolio import PORTFOLIO_COLUNAS
+    import db_utils
+
+    # Imports e pool antes da medida: o que sobra é o custo da leitura
+    db_utils.get_db_pool()
+    base = _rss_kb()
+    inicio = time.perf_counter()
+    if modo == 'antes':
+        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("SELECT data FROM table_records WHERE table_id = %s ORDER BY id ASC", (tab_id,))
+            linhas = len([r['data'] for r in cur.fetchall()])
+        finally:
+            conn.close()
+    else:
+        colunas = PORTFOLIO_COLUNAS if modo == 'depois_colunas' else None
+        linhas = sum(1 for _ in db_utils.iter_sheet_data(tab_id, colunas=colunas))
+    print(json.dumps({
+        "linhas": linhas, "segundos": round(time.perf_counter() - inicio, 2), "rss_base_kb": base,
+        # ru_maxrss do Linux já vem em KB
+        "rss_pico_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+
+def cenario_leitura(dsn, args):
+    """Cada modo num processo novo, para o pico de RSS de um não contaminar o outro"""
+    tab_id = _semear_leitura(dsn, args.linhas)
+    resultado = {"linhas_na_tabela": args.linhas}
+    for modo in ('antes', 'depois', 'depois_colunas'):
+        saida = subprocess.run([sys.executable, os.path.abspath(__file__), '--_leitura', modo, '--_tab-id', str(tab_id)],
+                               cwd=RAIZ, env=dict(os.environ, DATABASE_URL=dsn), capture_output=True, text=True,
+                               check=True).stdout
+        medida = json.loads(saida.strip().splitlines()[-1])
+        medida["rss_acrescimo_kb"] = medida["rss_pico_kb"] - medida["rss_base_kb"]
+        resultado[modo] = medida
+    return resultado
+
+
+# --- nomes ---
+
+def _semear_tabelas(dsn, quantidade):
+    conn = _conectar(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM user_tables WHERE display_name LIKE %s", (PREFIXO_TABELAS + '%',))
+        existentes = cur.fetchone()[0]
+        if existentes < quantidade:
+            cur.execute("""
+                INSERT INTO user_tables (display_name)
+                SELECT %s || ' ' || g || ' ' || md5(g::text) FROM generate_series(%s, %s) g
+            """, (PREFIXO_TABELAS, existentes + 1, quantidade))
+            cur.execute("ANALYZE user_tables")
+    finally:
+        conn.close()
+
+
+def cenario_nomes(dsn, args):
+    """
+    Refresh do portfólio: antes, uma conexão e um LIKE sem índice para 'Portfolio' e
+    outra para 'Portfólio'; depois, resolve_table_ids numa consulta (mapa em memória
+    vazio a cada rodada) e com o mapa já preenchido.
+    """
+    import db_utils
+
+    _semear_tabelas(dsn, args.tabelas)
+    nomes = ('Portfolio', 'Portfólio')
+
+    def antes(_):
+        for nome in nomes:
+            conn = psycopg2.connect(dsn)
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT id FROM user_tables WHERE LOWER(display_name) LIKE LOWER(%s) LIMIT 1",
+                            (f"%{nome}%",))
+                cur.fetchone()
+            finally:
+                conn.close()
+
+    def depois_frio(_):
+        db_utils.invalidate_table_ids()
+        db_utils.resolve_table_ids(nomes)
+
+    def depois_memoria(_):
+        db_utils.resolve_table_ids(nomes)
+
+    resultado = {"linhas_user_tables": _contar(dsn, "SELECT count(*) FROM user_tables")}
+    for nome, fn in (('antes', antes), ('depois_frio', depois_frio), ('depois_memoria', depois_memoria)):
+        segundos, duracoes = _em_threads(1, args.resolucoes, fn)
+        resultado[nome] = {"resolucoes": args.resolucoes, "por_segundo": round(args.resolucoes / segundos, 1),
+                           **_latencias(duracoes)}
+    return resultado
+
+
+# --- stats ---
+
+def _semear_eventos(dsn, quantidade):
+    """quantidade eventos espalhados por 90 dias, e os rollups deles (carga inicial da migração 005)"""
+    conn = _conectar(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM tracking_events WHERE site_source = %s", (SITE_SOURCE,))
+        if cur.fetchone()[0] >= quantidade:
+            return
+        cur.execute("TRUNCATE tracking_events")
+        cur.execute("TRUNCATE tracking_rollups")
+        cur.execute("""
+            INSERT INTO tracking_events
+            (site_source, uid, botao, pagina_origem, url_destino, ip_address, localizacao, provedor, dispositivo, created_at)
+            SELECT %s, 'uid-' || g % 50000, 'Botão ' || g % 20, '/pagina-' || g % 10, '/contato',
+                   '10.0.0.' || g % 250, 'Cidade ' || g % 30, 'Bench', 'Dispositivo ' || g % 5,
+                   now() - interval '90 days' * random()
+            FROM generate_series(1, %s) g
+        """, (SITE_SOURCE, quantidade))
+        cur.execute("""
+            INSERT INTO tracking_rollups (granularidade, periodo, site_source, botao, pagina_origem, dispositivo, localizacao, total)
+            SELECT g.granularidade,
+                   date_trunc(CASE g.granularidade WHEN 'hora' THEN 'hour' ELSE 'day' END, e.created_at),
+                   COALESCE(e.site_source, ''), COALESCE(e.botao, ''), COALESCE(e.pagina_origem, ''),
+                   COALESCE(e.dispositivo, ''), COALESCE(e.localizacao, ''), count(*)
+            FROM tracking_events e
+            CROSS JOIN (VALUES ('hora'), ('dia')) AS g(granularidade)
+            GROUP BY 1, 2, 3, 4, 5, 6, 7
+        """)
+        cur.execute("ANALYZE tracking_events")
+        cur.execute("ANALYZE tracking_rollups")
+    finally:
+        conn.close()
+
+
+def cenario_stats(dsn, args):
+    """/api/stats dos últimos 30 dias, total por dia e por botão: eventos brutos x get_tracking_stats"""
+    import db_utils
+
+    _semear_eventos(dsn, args.eventos)
+    desde = datetime.now() - timedelta(days=30)
+
+    def antes(dimensao):
+        conn = psycopg2.connect(dsn)
+        try:
+            cur = conn.cursor()
+            coluna = f", {dimensao}" if dimensao else ""
+            cur.execute(f"""
+                SELECT date_trunc('day', created_at) AS periodo{coluna}, count(*)
+                FROM tracking_events
+                WHERE site_source = %s AND created_at >= %s
+                GROUP BY 1{coluna} ORDER BY 1{coluna}
+            """, (SITE_SOURCE, desde))
+            cur.fetchall()
+        finally:
+            conn.close()
+
+    def depois(dimensao):
+        db_utils.get_tracking_stats(SITE_SOURCE, 'dia', desde=desde, dimensao=dimensao)
+
+    resultado = {"eventos": _contar(dsn, "SELECT count(*) FROM tracking_events")}
+    for dimensao in (None, 'botao'):
+        rotulo = dimensao or 'total'
+        for nome, fn in (('antes', antes), ('depois', depois)):
+            _, duracoes = _em_threads(1, args.consultas_stats, lambda _: fn(dimensao))
+            resultado[f"{nome}_{rotulo}"] = {"consultas": args.consultas_stats, **_latencias(duracoes)}
+        resultado[f"ganho_{rotulo}_p50"] = round(
+            resultado[f"antes_{rotulo}"]["p50_ms"] / max(resultado[f"depois_{rotulo}"]["p50_ms"], 0.01), 1)
+    return resultado
+
+
+CENARIOS = {
+    'conexoes': cenario_conexoes,
+    'insercao': cenario_insercao,
+    'leitura': cenario_leitura,
+    'nomes': cenario_nomes,
+    'stats': cenario_stats,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cenarios', default=','.join(CENARIOS), help='lista separada por vírgula')
+    parser.add_argument('--db-url', help='banco de teste já existente (as tabelas são criadas e semeadas)')
+    parser.add_argument('--concorrencia', type=int, default=16)
+    parser.add_argument('--consultas', type=int, default=2000, help='conexoes: consultas por modo')
+    parser.add_argument('--insercoes', type=int, default=20000, help='insercao: eventos por modo')
+    parser.add_argument('--linhas', type=int, default=1_000_000, help='leitura: linhas da tabela')
+    parser.add_argument('--tabelas', type=int, default=100_000, help='nomes: linhas de user_tables')
+    parser.add_argument('--resolucoes', type=int, default=200, help='nomes: resoluções por modo')
+    parser.add_argument('--eventos', type=int, default=10_000_000, help='stats: eventos em tracking_events')
+    parser.add_argument('--consultas-stats', type=int, default=20, help='stats: consultas por modo')
+    parser.add_argument('--saida', default=os.path.join(RAIZ, 'bench', 'resultados', 'cenarios_ultimo.json'))
+    parser.add_argument('--_leitura', help=argparse.SUPPRESS)
+    parser.add_argument('--_tab-id', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._leitura:
+        _ler_em_subprocesso(args._leitura, args._tab_id)
+        return 0
+
+    postgres = None
+    if args.db_url:
+        dsn, banco = args.db_url, 'externo'
+    elif _binario_pg('initdb'):
+        postgres = PostgresDescartavel()
+        dsn, banco = postgres.iniciar(), 'descartavel'
+    else:
+        print("❌ Sem Postgres: instale os binários (initdb/pg_ctl) ou passe --db-url.")
+        return 2
+
+    try:
+        migracoes = preparar_banco(dsn)
+        # O db_utils lê DATABASE_URL ao criar o pool, no primeiro uso
+        os.environ['DATABASE_URL'] = dsn
+        resultados = {}
+        for nome in [c.strip() for c in args.cenarios.split(',') if c.strip()]:
+            inicio = time.perf_counter()
+            resultados[nome] = CENARIOS[nome](dsn, args)
+            print(f"{nome} ({time.perf_counter() - inicio:.1f} s): {json.dumps(resultados[nome], ensure_ascii=False)}")
+
+        relatorio = {
+            "meta": {
+                "data": datetime.now().isoformat(timespec='seconds'),
+                "commit": _commit_atual(),
+                "python": platform.python_version(),
+                "banco": banco,
+                "migracoes": migracoes,
+                "concorrencia": args.concorrencia,
+            },
+            "cenarios": resultados,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False, default=str)
+        print(f"Resultado em {args.saida}")
+
+        if 'insercao' in resultados and not resultados['insercao']['meta_10x']:
+            print(f"\nInserção em lote ficou em {resultados['insercao']['ganho']}x (meta: 10x)")
+            return 1
+        return 0
+    finally:
+        if postgres is not None:
+            postgres.parar()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
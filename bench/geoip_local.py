@@ -0,0 +1,232 @@
+"""
+Benchmark da base GeoIP local (GEOIP_BACKEND=local).
+
+    python bench/geoip_local.py --faixas 300000 --consultas 200000
+    python bench/geoip_local.py --comparar bench/resultados/geoip_local_base.json
+
+Gera um CSV de faixas no formato do GEOIP_LOCAL_CSV (IPv4 em texto e em inteiro,
+mais algumas faixas IPv6, com locais repetidos como numa base real), e mede:
+quanto o geoip.carregar_base_local leva para ler o arquivo e quanta memória
+Python a base ocupa no fim, e quantas consultas por segundo o
+geoip.consultar_base_local e o get_location_data_rich (o caminho do clique)
+respondem, com IPs sorteados dentro e fora das faixas. Não usa rede nem banco.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tempfile
+import tracemalloc
+import subprocess
+import ipaddress
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault('LOG_NIVEL', 'ERROR')
+
+import geoip  # noqa: E402
+
+CIDADES = [
+    ("BR", "São Paulo", "São Paulo"), ("BR", "São Paulo", "Campinas"), ("BR", "Rio de Janeiro", "Rio de Janeiro"),
+    ("BR", "Minas Gerais", "Belo Horizonte"), ("BR", "Paraná", "Curitiba"), ("US", "California", "San Jose"),
+    ("PT", "Lisboa", "Lisboa"), ("AR", "Buenos Aires", "Buenos Aires"),
+]
+PROVEDORES = ["Provedor A", "Provedor B", "Operadora Móvel", "Fibra Regional", ""]
+
+
+def gerar_csv(caminho, faixas, semente=42):
+    """
+    Faixas IPv4 contíguas de tamanho variável, com buracos (IPs sem faixa), e 1%
+    de faixas IPv6. Retorna as listas de (inicio, fim) geradas, para sortear IPs.
+    """
+    aleatorio = random.Random(semente)
+    ipv4, ipv6 = [], []
+    atual = int(ipaddress.IPv4Address('1.0.0.0'))
+    atual6 = int(ipaddress.IPv6Address('2001:db8::'))
+    with open(caminho, 'w', encoding='utf-8', newline='') as arquivo:
+        arquivo.write("ip_inicio,ip_fim,pais,regiao,cidade,provedor,cep\n")
+        for i in range(faixas):
+            pais, regiao, cidade = aleatorio.choice(CIDADES)
+            provedor = aleatorio.choice(PROVEDORES)
+            cep = f"{aleatorio.randrange(10000, 99999)}-000" if pais == "BR" else ""
+            if i % 100 == 99:
+                inicio, fim = atual6, atual6 + (1 << 80) - 1
+                atual6 = fim + 1
+                ipv6.append((inicio, fim))
+                texto_inicio, texto_fim = str(ipaddress.IPv6Address(inicio)), str(ipaddress.IPv6Address(fim))
+            else:
+                inicio = atual + aleatorio.choice((0, 0, 0, 256))
+                fim = inicio + aleatorio.choice((255, 1023, 4095))
+                atual = fim + 1
+                ipv4.append((inicio, fim))
+                if i % 2:
+                    texto_inicio, texto_fim = str(inicio), str(fim)
+                else:
+                    texto_inicio, texto_fim = str(ipaddress.IPv4Address(inicio)), str(ipaddress.IPv4Address(fim))
+            arquivo.write(f"{texto_inicio},{texto_fim},{pais},{regiao},{cidade},{provedor},{cep}\n")
+    return ipv4, ipv6
+
+
+def sortear_ips(ipv4, ipv6, quantidade, fracao_fora=0.1, semente=7):
+    """IPs de faixas sorteadas; uma fração cai depois da última faixa (sem resultado)"""
+    aleatorio = random.Random(semente)
+    fim_ipv4 = ipv4[-1][1]
+    ips = []
+    for _ in range(quantidade):
+        sorteio = aleatorio.random()
+        if sorteio < fracao_fora:
+            ips.append(str(ipaddress.IPv4Address(aleatorio.randrange(fim_ipv4 + 1, fim_ipv4 + 1 + (1 << 24)))))
+        elif ipv6 and sorteio < fracao_fora + 0.01:
+            inicio, fim = aleatorio.choice(ipv6)
+            ips.append(str(ipaddress.IPv6Address(aleatorio.randrange(inicio, fim + 1))))
+        else:
+            inicio, fim = aleatorio.choice(ipv4)
+            ips.append(str(ipaddress.IPv4Address(aleatorio.randrange(inicio, fim + 1))))
+    return ips
+
+
+def medir_carga(caminho, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        base = geoip.carregar_base_local(caminho)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+
+    # Memória numa carga à parte: o tracemalloc deixa a leitura bem mais lenta
+    tracemalloc.start()
+    base = geoip.carregar_base_local(caminho)
+    memoria_atual, memoria_pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return base, {
+        "carga_ms": round(statistics.median(tempos), 1),
+        "carga_ms_min": round(min(tempos), 1),
+        "memoria_base_mb": round(memoria_atual / 1024 / 1024, 2),
+        "memoria_pico_carga_mb": round(memoria_pico / 1024 / 1024, 2),
+        "faixas_ipv4": len(base["tabelas"][4]["inicios"]),
+        "faixas_ipv6": len(base["tabelas"][6]["inicios"]),
+        "locais": len(base["registros"]),
+    }
+
+
+def medir_consultas(funcao, ips):
+    inicio = time.perf_counter()
+    encontrados = 0
+    for ip in ips:
+        if funcao(ip) is not None:
+            encontrados += 1
+    duracao = time.perf_counter() - inicio
+    return {
+        "consultas_por_segundo": round(len(ips) / duracao),
+        "us_por_consulta": round(duracao / len(ips) * 1_000_000, 2),
+        "encontrados": encontrados,
+    }
+
+
+def _valor(relatorio, chave):
+    """'grupo.medida' ou 'medida'"""
+    for parte in chave.split('.'):
+        relatorio = relatorio.get(parte) if isinstance(relatorio, dict) else None
+    return relatorio
+
+
+def comparar(atual, base, tolerancia):
+    """Imprime a diferença. Retorna as medidas que pioraram além da tolerância"""
+    # Para a vazão, maior é melhor; para o resto, menor é melhor
+    medidas = [("carga_ms", False), ("memoria_base_mb", False),
+               ("consultar_base_local.consultas_por_segundo", True),
+               ("get_location_data_rich.consultas_por_segundo", True)]
+    regressoes = []
+    print(f"\n{'medida':<46} {'base':>10} {'atual':>10} {'Δ%':>7}")
+    for chave, maior_melhor in medidas:
+        valor, anterior = _valor(atual, chave), _valor(base, chave)
+        if not anterior or valor is None:
+            print(f"{chave:<46} (sem base)")
+            continue
+        delta = (valor - anterior) / anterior * 100
+        pior = -delta > tolerancia if maior_melhor else delta > tolerancia
+        if pior:
+            regressoes.append(chave)
+        print(f"{chave:<46} {anterior:>10} {valor:>10} {delta:>+7.1f}" + ("   <-- piorou" if pior else ""))
+    return regressoes
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faixas', type=int, default=300000)
+    parser.add_argument('--consultas', type=int, default=200000)
+    parser.add_argument('--repeticoes', type=int, default=3, help='cargas do CSV (vale a mediana)')
+    parser.add_argument('--csv', help='usa um CSV existente em vez de gerar um (mede só a carga)')
+    parser.add_argument('--saida', default=os.path.join(RAIZ, 'bench', 'resultados', 'geoip_local_ultimo.json'))
+    parser.add_argument('--comparar', help='JSON de um resultado anterior')
+    parser.add_argument('--tolerancia', type=float, default=15.0, help='%% de piora aceita')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='geoip_bench_') as pasta:
+        caminho = args.csv or os.path.join(pasta, 'faixas.csv')
+        ips = []
+        if not args.csv:
+            ipv4, ipv6 = gerar_csv(caminho, args.faixas)
+            ips = sortear_ips(ipv4, ipv6, args.consultas)
+        tamanho_mb = os.path.getsize(caminho) / 1024 / 1024
+
+        base, carga = medir_carga(caminho, args.repeticoes)
+        print(f"CSV {tamanho_mb:.1f} MB, {carga['faixas_ipv4']} faixas IPv4, {carga['faixas_ipv6']} IPv6, "
+              f"{carga['locais']} locais")
+        print(f"carga: {carga['carga_ms']} ms (mín. {carga['carga_ms_min']})  "
+              f"memória: {carga['memoria_base_mb']} MB (pico {carga['memoria_pico_carga_mb']} MB)")
+
+        relatorio = {
+            "meta": {
+                "data": datetime.now().isoformat(timespec='seconds'),
+                "commit": _commit_atual(),
+                "python": platform.python_version(),
+                "faixas": args.faixas if not args.csv else None,
+                "consultas": len(ips),
+                "csv_mb": round(tamanho_mb, 1),
+            },
+            **carga,
+        }
+
+        if ips:
+            relatorio["consultar_base_local"] = medir_consultas(lambda ip: geoip.consultar_base_local(ip, base), ips)
+
+            # O caminho do clique: backend local com fallback remoto. Os IPs de fora
+            # das faixas iriam para a ip-api, então aqui só entram os que a base resolve.
+            geoip.GEOIP_BACKEND, geoip.GEOIP_LOCAL_CSV, geoip._BASE_LOCAL = 'local', caminho, base
+            dentro = [ip for ip in ips if geoip.consultar_base_local(ip, base) is not None]
+            relatorio["get_location_data_rich"] = medir_consultas(geoip.get_location_data_rich, dentro)
+
+            for nome in ("consultar_base_local", "get_location_data_rich"):
+                medida = relatorio[nome]
+                print(f"{nome:<24} {medida['consultas_por_segundo']:>9} consultas/s  "
+                      f"{medida['us_por_consulta']:>6} µs/consulta  ({medida['encontrados']} encontrados)")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    print(f"Resultado em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            regressoes = comparar(relatorio, json.load(f), args.tolerancia)
+        if regressoes:
+            print(f"\nPiorou além de {args.tolerancia}%: {', '.join(regressoes)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
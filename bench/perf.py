@@ -0,0 +1,698 @@
+"""
+Suíte de performance offline.
+
+    python bench/perf.py --concorrencia 16 --saida bench/resultados/atual.json
+    python bench/perf.py --comparar bench/resultados/base.json --tolerancia 10
+
+Sobe uma ip-api e um Resend falsos (bench/stubs.py), um Postgres descartável
+(initdb num diretório temporário, se os binários existirem; ou --db-url apontando
+para um banco de teste) e o site num subprocesso (bench/servidor.py). Depois
+dispara cada rota com concorrência fixa e grava em JSON: vazão, latência
+p50/p95/p99, conexões de banco abertas, threads e RSS do processo do site.
+Por rota, e numa rodada final com --em-voo clientes simultâneos no track_click,
+mede também a memória por requisição em voo e o pico de conexões (clientes HTTP
+e Postgres) de cada worker, para comparar --modo wsgi/gunicorn/asgi.
+Com --comparar, mostra a diferença para um resultado anterior e sai com código 1
+se alguma rota piorou além da tolerância. Com --tenants N, o site sobe com N
+sites extras (TENANTS_JSON), cada um com o seu bucket_size e a sua tabela de
+portfólio, e as requisições se revezam entre os hosts deles.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubs import stub_ip_api, stub_resend
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SITE_SOURCE = "Merlô Digital - Site"
+TABELA_ARMADILHA = 'Portfolio Cliente Antigo'
+PREFIXO_ARMADILHA = 'Projeto do Cliente Antigo'
+# O /metrics só responde com METRICS_TOKEN definido
+METRICS_TOKEN = 'bench'
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+# nome -> (método, caminho, corpo, requisições por padrão)
+ROTAS = {
+    'home': ('GET', '/', None, None),
+    'portfolio': ('GET', '/portfolio', None, None),
+    'contato': ('GET', '/contato', None, None),
+    'contato_post': ('POST', '/contato', {
+        'nome': 'Bench', 'email': 'bench@exemplo.com', 'empresa': 'Bench Ltda',
+        'telefone': '11999999999', 'mensagem': 'Mensagem da suíte de performance'
+    }, None),
+    'track_click': ('POST', '/api/track-click', {
+        'botao': 'Fale Conosco', 'pagina_origem': '/', 'url_destino': '/contato'
+    }, None),
+    'cron': ('GET', '/api/cron-job', None, 50),
+    'sitemap': ('GET', '/sitemap.xml', None, None),
+}
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# --- BANCO ---
+
+def _binario_pg(nome):
+    encontrado = shutil.which(nome)
+    if encontrado:
+        return encontrado
+    candidatos = sorted(glob.glob(f'/usr/lib/postgresql/*/bin/{nome}'))
+    return candidatos[-1] if candidatos else None
+
+
+class PostgresDescartavel:
+    """Cluster temporário (initdb + pg_ctl), apagado no fim"""
+
+    def __init__(self):
+        self.pasta = tempfile.mkdtemp(prefix='merlo-bench-pg-')
+        self.porta = _porta_livre()
+
+    def iniciar(self):
+        dados = os.path.join(self.pasta, 'dados')
+        subprocess.run([_binario_pg('initdb'), '-D', dados, '-U', 'postgres', '-A', 'trust'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([
+            _binario_pg('pg_ctl'), '-D', dados, '-w', '-l', os.path.join(self.pasta, 'pg.log'),
+            '-o', f"-p {self.porta} -k {self.pasta} -c listen_addresses=127.0.0.1 -c max_connections=200",
+            'start'
+        ], check=True, stdout=subprocess.DEVNULL)
+        conn = psycopg2.connect(self.dsn('postgres'))
+        conn.autocommit = True
+        conn.cursor().execute("CREATE DATABASE merlo_bench")
+        conn.close()
+        return self.dsn('merlo_bench')
+
+    def dsn(self, banco):
+        return f"postgresql://postgres@127.0.0.1:{self.porta}/{banco}"
+
+    def parar(self):
+        subprocess.run([_binario_pg('pg_ctl'), '-D', os.path.join(self.pasta, 'dados'), '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+
+def sites_bench(n):
+    """Configuração (formato do TENANTS_JSON) de n sites extras"""
+    return [{
+        "site_source": f"Bench Site {i:03d}",
+        "hosts": [f"site{i:03d}.bench"],
+        "email_destino": "bench@exemplo.com",
+        "portfolio_tabelas": [f"Portfolio Bench {i:03d}"],
+    } for i in range(n)]
+
+
+def _semear_portfolio(cur, nome, projetos, prefixo='Projeto'):
+    cur.execute("SELECT id FROM user_tables WHERE display_name = %s", (nome,))
+    if cur.fetchone():
+        return
+    cur.execute("INSERT INTO user_tables (display_name) VALUES (%s) RETURNING id", (nome,))
+    tab_id = cur.fetchone()[0]
+    cur.executemany("INSERT INTO table_records (table_id, data) VALUES (%s, %s)", [
+        (tab_id, json.dumps({
+            'Título': f"{prefixo} {i}", 'Descrição': f"Descrição do projeto {i}",
+            'Link do site': f"https://exemplo.com/{i}", 'Logo': '', 'Tipo': 'Site'
+        }))
+        for i in range(projetos)
+    ])
+
+
+def preparar_banco(dsn, projetos=40, sites=()):
+    """Cria as tabelas base, aplica migrations/ e semeia portfólio e configs. Retorna o status de cada arquivo"""
+    status = {}
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    arquivos = [os.path.join(RAIZ, 'bench', 'schema.sql')] + sorted(glob.glob(os.path.join(RAIZ, 'migrations', '*.sql')))
+    for caminho in arquivos:
+        with open(caminho, encoding='utf-8') as f:
+            sql = f.read()
+        try:
+            cur.execute(sql)
+            status[os.path.basename(caminho)] = 'ok'
+        except psycopg2.Error as e:
+            # Ex.: unaccent não instalado; o código tem fallback
+            status[os.path.basename(caminho)] = f"erro: {(e.pgerror or str(e)).strip()}"
+
+    # Cada site extra com um bucket_size diferente (5 a 24) e um portfólio menor
+    configs = [(SITE_SOURCE, 10)] + [(s["site_source"], 5 + i % 20) for i, s in enumerate(sites)]
+    for site_source, bucket_size in configs:
+        cur.execute("SELECT 1 FROM users WHERE site_source = %s", (site_source,))
+        if not cur.fetchone():
+            cur.execute("INSERT INTO users (site_source, tracking_config) VALUES (%s, %s)", (
+                site_source, json.dumps({"email_enabled": True, "bucket_size": bucket_size, "cron_interval": 15})
+            ))
+    # Tabela de cliente com id menor e nome que contém 'Portfolio': o site padrão não
+    # pode mostrar os projetos dela (verificar_portfolio)
+    _semear_portfolio(cur, TABELA_ARMADILHA, 3, prefixo=PREFIXO_ARMADILHA)
+    _semear_portfolio(cur, 'Portfólio', projetos)
+    for site in sites:
+        _semear_portfolio(cur, site["portfolio_tabelas"][0], max(1, projetos // 4))
+    conn.close()
+    return status
+
+
+def verificar_portfolio(base_url):
+    """True se o /portfolio do site padrão lista só a tabela 'Portfólio' (e não a do cliente)"""
+    html = requests.get(base_url + '/portfolio', timeout=10).text
+    return 'Projeto 0' in html and PREFIXO_ARMADILHA not in html
+
+
+def conexoes_no_banco(dsn):
+    try:
+        conn = psycopg2.connect(dsn)
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()")
+            return cur.fetchone()[0]
+        finally:
+            conn.close()
+    except psycopg2.Error:
+        return None
+
+
+# --- PROCESSO DO SITE ---
+
+def _arvore(pid):
+    """pid e todos os descendentes (gunicorn/uvicorn com workers)"""
+    pids = [pid]
+    for tarefa in glob.glob(f'/proc/{pid}/task/*/children'):
+        try:
+            with open(tarefa) as f:
+                for filho in f.read().split():
+                    pids.extend(_arvore(int(filho)))
+        except OSError:
+            pass
+    return pids
+
+
+def amostra_processo(pid):
+    """RSS (KB) e threads somados da árvore de processos (Linux: /proc)"""
+    rss = threads = 0
+    for p in _arvore(pid):
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for linha in f:
+                    if linha.startswith('VmRSS:'):
+                        rss += int(linha.split()[1])
+                    elif linha.startswith('Threads:'):
+                        threads += int(linha.split()[1])
+        except OSError:
+            pass
+    return rss, threads
+
+
+def _inodes_socket(pid):
+    inodes = set()
+    for fd in glob.glob(f'/proc/{pid}/fd/*'):
+        try:
+            alvo = os.readlink(fd)
+        except OSError:
+            continue
+        if alvo.startswith('socket:['):
+            inodes.add(alvo[8:-1])
+    return inodes
+
+
+def _conexoes_tcp(pid):
+    """inode -> (porta local, porta remota) das conexões TCP estabelecidas"""
+    conexoes = {}
+    for arquivo in ('tcp', 'tcp6'):
+        try:
+            with open(f'/proc/{pid}/net/{arquivo}') as f:
+                next(f, None)
+                for linha in f:
+                    campos = linha.split()
+                    # 01 = ESTABLISHED
+                    if len(campos) > 9 and campos[3] == '01':
+                        conexoes[campos[9]] = (int(campos[1].rsplit(':', 1)[1], 16),
+                                               int(campos[2].rsplit(':', 1)[1], 16))
+        except OSError:
+            pass
+    return conexoes
+
+
+def conexoes_por_worker(pid, porta_site, porta_banco):
+    """
+    {pid: {"clientes": n, "banco": n}} para cada processo da árvore com conexões
+    abertas: clientes HTTP aceitos na porta do site e conexões com o Postgres.
+    """
+    tabela = _conexoes_tcp(pid)
+    resultado = {}
+    for p in _arvore(pid):
+        clientes = banco = 0
+        for inode in _inodes_socket(p):
+            portas = tabela.get(inode)
+            if portas is None:
+                continue
+            if portas[0] == porta_site:
+                clientes += 1
+            elif porta_banco and portas[1] == porta_banco:
+                banco += 1
+        if clientes or banco:
+            resultado[p] = {"clientes": clientes, "banco": banco}
+    return resultado
+
+
+class Amostrador(threading.Thread):
+    """
+    Picos de RSS, threads e conexões do site, no total e por fase (cada rota).
+    A memória por requisição em voo de uma fase é o quanto o RSS subiu sobre o
+    início dela dividido pelo pico de conexões de clientes abertas ao mesmo tempo.
+    """
+    def __init__(self, pid, dsn, porta_site=None, intervalo=0.05):
+        super().__init__(daemon=True)
+        self.pid, self.dsn, self.intervalo = pid, dsn, intervalo
+        self.porta_site = porta_site
+        self.porta_banco = (urlsplit(dsn).port or 5432) if dsn else None
+        self.rss_pico = self.threads_pico = 0
+        self.conexoes_pico = None
+        self.workers = {}
+        self._lock = threading.Lock()
+        self._fase = None
+        self._parar = threading.Event()
+        self._ultima_consulta_banco = 0.0
+
+    def nova_fase(self):
+        """Fecha a fase atual (retorna o resumo dela) e começa outra"""
+        rss, threads = amostra_processo(self.pid)
+        with self._lock:
+            anterior, self._fase = self._fase, {
+                "rss_inicial_kb": rss, "rss_pico_kb": rss, "threads_iniciais": threads, "threads_pico": threads,
+                "clientes_pico": 0, "workers": {},
+            }
+        return self._resumo_fase(anterior)
+
+    @staticmethod
+    def _resumo_fase(fase):
+        if fase is None:
+            return None
+        delta = fase["rss_pico_kb"] - fase["rss_inicial_kb"]
+        return {
+            "rss_delta_kb": delta,
+            "threads_delta": fase["threads_pico"] - fase["threads_iniciais"],
+            "requisicoes_em_voo_pico": fase["clientes_pico"],
+            "kb_por_requisicao_em_voo": round(delta / fase["clientes_pico"], 1) if fase["clientes_pico"] else None,
+            "conexoes_por_worker": {
+                "workers": len(fase["workers"]),
+                "clientes_pico": max((w["clientes"] for w in fase["workers"].values()), default=0),
+                "banco_pico": max((w["banco"] for w in fase["workers"].values()), default=0),
+            },
+        }
+
+    def run(self):
+        while not self._parar.is_set():
+            rss, threads = amostra_processo(self.pid)
+            por_worker = conexoes_por_worker(self.pid, self.porta_site, self.porta_banco) if self.porta_site else {}
+            clientes = sum(w["clientes"] for w in por_worker.values())
+            with self._lock:
+                self.rss_pico = max(self.rss_pico, rss)
+                self.threads_pico = max(self.threads_pico, threads)
+                for picos in (self.workers, (self._fase or {}).get("workers")):
+                    if picos is None:
+                        continue
+                    for pid, contagem in por_worker.items():
+                        pico = picos.setdefault(pid, {"clientes": 0, "banco": 0})
+                        pico["clientes"] = max(pico["clientes"], contagem["clientes"])
+                        pico["banco"] = max(pico["banco"], contagem["banco"])
+                if self._fase is not None:
+                    self._fase["rss_pico_kb"] = max(self._fase["rss_pico_kb"], rss)
+                    self._fase["threads_pico"] = max(self._fase["threads_pico"], threads)
+                    self._fase["clientes_pico"] = max(self._fase["clientes_pico"], clientes)
+            # pg_stat_activity abre uma conexão: mais espaçado que o resto
+            if self.dsn and time.monotonic() - self._ultima_consulta_banco >= 0.2:
+                self._ultima_consulta_banco = time.monotonic()
+                conexoes = conexoes_no_banco(self.dsn)
+                if conexoes is not None:
+                    self.conexoes_pico = max(self.conexoes_pico or 0, conexoes)
+            self._parar.wait(self.intervalo)
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+        with self._lock:
+            fase, self._fase = self._fase, None
+        return self._resumo_fase(fase)
+
+
+def ler_metricas(base_url):
+    """/metrics do site como {nome_da_série_com_labels: valor}"""
+    try:
+        texto = requests.get(f"{base_url}/metrics", timeout=5,
+                             headers={'Authorization': f"Bearer {METRICS_TOKEN}"}).text
+    except requests.RequestException:
+        return {}
+    valores = {}
+    for linha in texto.splitlines():
+        if linha and not linha.startswith('#'):
+            nome, _, valor = linha.rpartition(' ')
+            try:
+                valores[nome] = float(valor)
+            except ValueError:
+                pass
+    return valores
+
+
+def _soma(metricas, prefixo):
+    return sum(v for k, v in metricas.items() if k == prefixo or k.startswith(prefixo + '{'))
+
+
+def esperar_site(base_url, processo, timeout=30):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError("o servidor do site terminou durante a subida")
+        try:
+            requests.get(f"{base_url}/robots.txt", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError("o site não respondeu a tempo")
+
+
+def esperar_background(base_url, timeout=30):
+    """Espera as filas do site esvaziarem (GeoIP, gravação, e-mail)"""
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        m = ler_metricas(base_url)
+        if _soma(m, 'merlo_background_fila_tamanho') == 0 and _soma(m, 'merlo_tracking_fila_tamanho') == 0:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+# --- CARGA ---
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+def disparar(base_url, metodo, caminho, corpo, requisicoes, concorrencia, hosts=None):
+    """hosts: lista de Host/Origin para revezar entre as requisições (vários sites)"""
+    latencias = []
+    erros = 0
+    status = {}
+    lock = threading.Lock()
+    restantes = [requisicoes]
+
+    def trabalhador():
+        nonlocal erros
+        sessao = requests.Session()
+        sessao.headers['User-Agent'] = USER_AGENT
+        while True:
+            with lock:
+                if restantes[0] <= 0:
+                    return
+                restantes[0] -= 1
+                host = hosts[restantes[0] % len(hosts)] if hosts else None
+            cabecalhos = {'Host': host, 'Origin': f"http://{host}"} if host else None
+            inicio = time.perf_counter()
+            try:
+                if metodo == 'GET':
+                    resp = sessao.get(base_url + caminho, headers=cabecalhos, allow_redirects=False, timeout=30)
+                elif caminho.startswith('/api/'):
+                    resp = sessao.post(base_url + caminho, json=corpo, headers=cabecalhos, allow_redirects=False,
+                                       timeout=30)
+                else:
+                    resp = sessao.post(base_url + caminho, data=corpo, headers=cabecalhos, allow_redirects=False,
+                                       timeout=30)
+                codigo = resp.status_code
+            except requests.RequestException:
+                codigo = 'excecao'
+            duracao = time.perf_counter() - inicio
+            with lock:
+                latencias.append(duracao)
+                status[str(codigo)] = status.get(str(codigo), 0) + 1
+                if codigo == 'excecao' or codigo >= 500:
+                    erros += 1
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=trabalhador) for _ in range(concorrencia)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - inicio
+
+    ordenados = sorted(latencias)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "requisicoes": len(latencias),
+        "erros": erros,
+        "status": status,
+        "duracao_s": round(total, 3),
+        "rps": round(len(latencias) / total, 1) if total else None,
+        "p50_ms": ms(percentil(ordenados, 50)),
+        "p95_ms": ms(percentil(ordenados, 95)),
+        "p99_ms": ms(percentil(ordenados, 99)),
+        "max_ms": ms(ordenados[-1] if ordenados else None),
+        "media_ms": ms(statistics.fmean(ordenados) if ordenados else None),
+    }
+
+
+# --- COMPARAÇÃO ---
+
+def comparar(atual, base, tolerancia):
+    """Imprime a diferença por rota. Retorna a lista de regressões"""
+    regressoes = []
+    print(f"\n{'rota':<14} {'rps base':>10} {'rps':>10} {'Δ%':>7}   {'p95 base':>9} {'p95':>9} {'Δ%':>7}")
+    for nome, r in atual["rotas"].items():
+        b = base.get("rotas", {}).get(nome)
+        if not b or not b.get("rps") or not b.get("p95_ms"):
+            print(f"{nome:<14} (sem base)")
+            continue
+        d_rps = (r["rps"] - b["rps"]) / b["rps"] * 100
+        d_p95 = (r["p95_ms"] - b["p95_ms"]) / b["p95_ms"] * 100
+        pior = d_rps < -tolerancia or d_p95 > tolerancia
+        if pior:
+            regressoes.append(nome)
+        print(f"{nome:<14} {b['rps']:>10} {r['rps']:>10} {d_rps:>+7.1f}   {b['p95_ms']:>9} {r['p95_ms']:>9} {d_p95:>+7.1f}"
+              + ("   <-- piorou" if pior else ""))
+    return regressoes
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concorrencia', type=int, default=16)
+    parser.add_argument('--requisicoes', type=int, default=500, help='por rota (o cron usa menos)')
+    parser.add_argument('--rotas', default=','.join(ROTAS), help='lista separada por vírgula')
+    parser.add_argument('--modo', choices=['wsgi', 'gunicorn', 'asgi'], default='wsgi')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--db-url', help='banco de teste já existente (as tabelas são criadas e semeadas)')
+    parser.add_argument('--sem-banco', action='store_true', help='roda sem Postgres (mede os caminhos de falha)')
+    parser.add_argument('--com-filtros', action='store_true',
+                        help='mantém dedup/rate limit do track-click (a carga vem toda de um IP e repete o corpo)')
+    parser.add_argument('--tenants', type=int, default=0,
+                        help='sites extras (hosts siteNNN.bench) além do padrão; as requisições se revezam entre eles')
+    parser.add_argument('--em-voo', type=int, default=200,
+                        help='clientes simultâneos na medida de memória por requisição em voo (0 desliga)')
+    parser.add_argument('--atraso-geoip', type=float, default=0.02)
+    parser.add_argument('--atraso-resend', type=float, default=0.05)
+    parser.add_argument('--saida', default=os.path.join(RAIZ, 'bench', 'resultados', 'ultimo.json'))
+    parser.add_argument('--comparar', help='JSON de um resultado anterior')
+    parser.add_argument('--tolerancia', type=float, default=10.0, help='%% de piora aceita em rps/p95')
+    args = parser.parse_args()
+
+    geoip = stub_ip_api(args.atraso_geoip)
+    resend = stub_resend(args.atraso_resend)
+    postgres = None
+    banco = 'indisponivel'
+    migracoes = {}
+
+    if args.db_url:
+        dsn, banco = args.db_url, 'externo'
+    elif not args.sem_banco and _binario_pg('initdb'):
+        postgres = PostgresDescartavel()
+        dsn, banco = postgres.iniciar(), 'descartavel'
+    else:
+        # Porta fechada: as conexões falham na hora, sem esperar timeout
+        dsn = f"postgresql://bench@127.0.0.1:{_porta_livre()}/nada?connect_timeout=1"
+        print("⚠️ Sem Postgres (initdb não encontrado ou --sem-banco): medindo com o banco fora do ar.")
+
+    sites = sites_bench(args.tenants)
+    processo = None
+    pasta_snapshot = tempfile.mkdtemp(prefix='merlo-bench-')
+    try:
+        if banco != 'indisponivel':
+            migracoes = preparar_banco(dsn, sites=sites)
+
+        porta = _porta_livre()
+        base_url = f"http://127.0.0.1:{porta}"
+        env = dict(os.environ,
+                   DATABASE_URL=dsn,
+                   GEOIP_API_URL=geoip.url + '/json/',
+                   RESEND_API_URL=resend.url,
+                   RESEND_API_KEY='re_bench',
+                   EMAIL_DESTINO='bench@exemplo.com',
+                   EMAIL_POLL_SEGUNDOS='1',
+                   PORTFOLIO_SNAPSHOT_PATH=os.path.join(pasta_snapshot, 'portfolio.json'),
+                   METRICS_ATIVO='1',
+                   METRICS_TOKEN=METRICS_TOKEN,
+                   LOG_NIVEL=os.getenv('LOG_NIVEL', 'WARNING'))
+        if not args.com_filtros:
+            env.update(TRACK_DEDUP_SEGUNDOS='0', TRACK_RATE_POR_SEGUNDO='1e9', TRACK_RATE_RAJADA='1e9')
+        if sites:
+            env.update(TENANTS_JSON=json.dumps(sites))
+        # Como no deploy: o app só lê o manifesto dos estáticos, não gera
+        subprocess.run([sys.executable, os.path.join(RAIZ, 'assets.py')], cwd=RAIZ, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        processo = subprocess.Popen([
+            sys.executable, os.path.join(RAIZ, 'bench', 'servidor.py'),
+            '--modo', args.modo, '--porta', str(porta), '--workers', str(args.workers)
+        ], cwd=RAIZ, env=env)
+        esperar_site(base_url, processo)
+
+        portfolio_ok = verificar_portfolio(base_url) if banco != 'indisponivel' else None
+        if portfolio_ok is False:
+            print(f"❌ /portfolio do site padrão não mostra a tabela 'Portfólio' (ou mostra '{TABELA_ARMADILHA}')")
+
+        rss_inicial, threads_iniciais = amostra_processo(processo.pid)
+        metricas_iniciais = ler_metricas(base_url)
+        amostrador = Amostrador(processo.pid, dsn if banco != 'indisponivel' else None, porta)
+        amostrador.start()
+
+        hosts = [s["hosts"][0] for s in sites] or None
+        resultados = {}
+        for nome in [r.strip() for r in args.rotas.split(',') if r.strip()]:
+            metodo, caminho, corpo, padrao = ROTAS[nome]
+            n = min(args.requisicoes, padrao) if padrao else args.requisicoes
+            amostrador.nova_fase()
+            resultados[nome] = disparar(base_url, metodo, caminho, corpo, n, args.concorrencia, hosts)
+            resultados[nome]["processo"] = amostrador.nova_fase()
+            r = resultados[nome]
+            print(f"{nome:<14} {r['requisicoes']:>6} req  {r['rps']:>8} rps  p50 {r['p50_ms']:>8} ms  "
+                  f"p95 {r['p95_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  erros {r['erros']}")
+
+        em_voo = None
+        if args.em_voo:
+            # Muitas requisições abertas ao mesmo tempo: no WSGI cada uma segura uma
+            # thread do worker, no ASGI uma corrotina. Mede o custo de cada uma.
+            metodo, caminho, corpo, _ = ROTAS['track_click']
+            amostrador.nova_fase()
+            em_voo = disparar(base_url, metodo, caminho, corpo, args.em_voo * 4, args.em_voo, hosts)
+            em_voo.update(concorrencia=args.em_voo, processo=amostrador.nova_fase())
+            medida = em_voo["processo"]
+            print(f"em voo ({args.em_voo} clientes): pico {medida['requisicoes_em_voo_pico']} requisições abertas, "
+                  f"{medida['kb_por_requisicao_em_voo']} KB e {medida['threads_delta']} threads a mais; "
+                  f"por worker: {medida['conexoes_por_worker']['clientes_pico']} clientes, "
+                  f"{medida['conexoes_por_worker']['banco_pico']} conexões de banco "
+                  f"({medida['conexoes_por_worker']['workers']} workers)  "
+                  f"p95 {em_voo['p95_ms']} ms  erros {em_voo['erros']}")
+
+        drenado = esperar_background(base_url)
+        amostrador.parar()
+        por_worker = {str(pid): picos for pid, picos in amostrador.workers.items()}
+        rss_final, threads_finais = amostra_processo(processo.pid)
+        metricas = ler_metricas(base_url)
+
+        relatorio = {
+            "meta": {
+                "data": datetime.now().isoformat(timespec='seconds'),
+                "commit": _commit_atual(),
+                "python": platform.python_version(),
+                "modo": args.modo,
+                "workers": args.workers,
+                "tenants": args.tenants,
+                "concorrencia": args.concorrencia,
+                "banco": banco,
+                "migracoes": migracoes,
+                "atraso_geoip_s": args.atraso_geoip,
+                "atraso_resend_s": args.atraso_resend,
+            },
+            "rotas": resultados,
+            "processo": {
+                "rss_inicial_kb": rss_inicial, "rss_pico_kb": amostrador.rss_pico, "rss_final_kb": rss_final,
+                "threads_iniciais": threads_iniciais, "threads_pico": amostrador.threads_pico,
+                "threads_finais": threads_finais,
+                # Pico de conexões de cada processo: clientes HTTP e Postgres
+                "conexoes_por_worker": por_worker,
+            },
+            "em_voo": em_voo,
+            "banco": {
+                # Contador do próprio site (com vários workers, é o do worker que respondeu o /metrics)
+                "conexoes_abertas": _soma(metricas, 'merlo_db_conexoes_abertas_total')
+                - _soma(metricas_iniciais, 'merlo_db_conexoes_abertas_total'),
+                "conexoes_pico_pg_stat_activity": amostrador.conexoes_pico,
+                "erros": _soma(metricas, 'merlo_db_erros_total'),
+            },
+            "background": {
+                "filas_drenadas": drenado,
+                "tarefas_recusadas": _soma(metricas, 'merlo_background_recusadas_total'),
+                "eventos_gravados": _soma(metricas, 'merlo_tracking_writer_gravados_total'),
+                "eventos_descartados": _soma(metricas, 'merlo_tracking_writer_descartados_total'),
+                "emails_enviados": _soma(metricas, 'merlo_email_enviados_total')
+                + _soma(metricas, 'merlo_email_envios_diretos_total'),
+            },
+            "verificacoes": {"portfolio_tabela_exata": portfolio_ok},
+            "stubs": {"ip_api_chamadas": geoip.chamadas, "resend_chamadas": resend.chamadas},
+            "sites": {
+                # Memória dos caches por site no worker que respondeu o /metrics
+                "portfolio_cache_sites": _soma(metricas, 'merlo_portfolio_cache_sites'),
+                "portfolio_cache_bytes": _soma(metricas, 'merlo_portfolio_cache_bytes'),
+                "portfolio_despejos": _soma(metricas, 'merlo_portfolio_despejos_total'),
+                "baldes_com_cliques": sum(1 for k, v in metricas.items()
+                                          if k.startswith('merlo_click_buffer_tamanho{') and v),
+                "cliques_nos_baldes": _soma(metricas, 'merlo_click_buffer_tamanho'),
+            },
+        }
+
+        os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+        print(f"\nProcesso: RSS pico {amostrador.rss_pico} KB, threads pico {amostrador.threads_pico}. "
+              f"Conexões abertas: {relatorio['banco']['conexoes_abertas']:.0f}. Resultado em {args.saida}")
+
+        if args.comparar:
+            with open(args.comparar, encoding='utf-8') as f:
+                regressoes = comparar(relatorio, json.load(f), args.tolerancia)
+            if regressoes:
+                print(f"\nPiorou além de {args.tolerancia}%: {', '.join(regressoes)}")
+                return 1
+        return 1 if portfolio_ok is False else 0
+    finally:
+        if processo is not None:
+            processo.terminate()
+            try:
+                processo.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+        geoip.parar()
+        resend.parar()
+        if postgres is not None:
+            postgres.parar()
+        shutil.rmtree(pasta_snapshot, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
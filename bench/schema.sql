@@ -0,0 +1,36 @@
+-- Tabelas base do My Ô usadas pelo site, só para o banco descartável da suíte
+-- de performance (bench/perf.py). Em produção elas já existem; as migrações de
+-- migrations/ são aplicadas por cima, na ordem.
+
+CREATE TABLE IF NOT EXISTS users (
+    id              SERIAL PRIMARY KEY,
+    site_source     TEXT,
+    tracking_config JSONB
+);
+
+CREATE TABLE IF NOT EXISTS user_tables (
+    id           SERIAL PRIMARY KEY,
+    display_name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS table_records (
+    id       BIGSERIAL PRIMARY KEY,
+    table_id INTEGER NOT NULL REFERENCES user_tables (id),
+    data     JSONB   NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_table_records_table ON table_records (table_id, id);
+
+CREATE TABLE IF NOT EXISTS tracking_events (
+    id            BIGSERIAL,
+    site_source   TEXT,
+    uid           TEXT,
+    botao         TEXT,
+    pagina_origem TEXT,
+    url_destino   TEXT,
+    ip_address    TEXT,
+    localizacao   TEXT,
+    provedor      TEXT,
+    dispositivo   TEXT,
+    created_at    TIMESTAMP DEFAULT now()
+);
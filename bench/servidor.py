@@ -0,0 +1,50 @@
+"""
+Sobe o site para a suíte de performance (chamado pelo bench/perf.py como subprocesso).
+
+    python bench/servidor.py --modo wsgi --porta 8001
+
+wsgi = servidor threaded do werkzeug (um processo); gunicorn e asgi (uvicorn)
+usam o mesmo comando de produção.
+"""
+import os
+import sys
+import argparse
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modo', choices=['wsgi', 'gunicorn', 'asgi'], default='wsgi')
+    parser.add_argument('--porta', type=int, required=True)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    os.chdir(RAIZ)
+    sys.path.insert(0, RAIZ)
+    endereco = f"127.0.0.1:{args.porta}"
+
+    if args.modo == 'gunicorn':
+        os.execvp(sys.executable, [
+            sys.executable, '-m', 'gunicorn', 'app:app', '-b', endereco,
+            '-w', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning'
+        ])
+    if args.modo == 'asgi':
+        os.execvp(sys.executable, [
+            sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(args.porta),
+            '--workers', str(args.workers), '--log-level', 'warning'
+        ])
+
+    import logging
+    from werkzeug.serving import make_server
+    import app
+
+    # Uma linha de log por requisição distorceria a medição
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    make_server('127.0.0.1', args.porta, app.app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
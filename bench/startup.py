@@ -0,0 +1,219 @@
+"""
+Benchmark de subida (cold start).
+
+    python bench/startup.py --repeticoes 5
+    python bench/startup.py --aquecimento --comparar bench/resultados/startup_base.json
+
+Para cada repetição sobe o site num processo novo (bench/servidor.py) e mede,
+a partir do spawn: quando a porta aceita conexão, quando o primeiro GET /
+responde 200 (time-to-first-response) e quanto levaram essa primeira
+requisição e a seguinte (com os estáticos já gerados por `python assets.py`,
+como no deploy). Com --aquecimento (AQUECIMENTO_ATIVO=1) mede também
+quando o /readyz passa a responder 200. Antes, roda `python -X importtime -c
+"import app"` e lista os módulos mais caros da importação. Sem banco: o
+DATABASE_URL aponta para uma porta fechada, como no perf.py --sem-banco.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import statistics
+import subprocess
+import http.client
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_RE_IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _ambiente(aquecimento):
+    return dict(os.environ,
+                DATABASE_URL=f"postgresql://bench@127.0.0.1:{_porta_livre()}/nada?connect_timeout=1",
+                AQUECIMENTO_ATIVO='1' if aquecimento else '0',
+                LOG_NIVEL=os.getenv('LOG_NIVEL', 'ERROR'))
+
+
+# --- PERFIL DE IMPORTAÇÃO ---
+
+def perfil_importacao(env, top=15):
+    """Tempo de `import app` e os módulos mais caros (self e acumulado, em ms)"""
+    saida = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=RAIZ, env=env,
+                           capture_output=True, text=True, check=True).stderr
+    linhas = []
+    for linha in saida.splitlines():
+        m = _RE_IMPORTTIME.match(linha)
+        if m:
+            linhas.append({"modulo": m.group(4), "nivel": len(m.group(3)) // 2,
+                           "self_ms": int(m.group(1)) / 1000, "acumulado_ms": int(m.group(2)) / 1000})
+
+    app = next((l for l in linhas if l["modulo"] == 'app' and l["nivel"] == 0), None)
+    # Filhos diretos do app: o que cada import de app.py custa, com tudo que ele puxa
+    diretos = [l for l in linhas if l["nivel"] == 1]
+    return {
+        "import_app_ms": app["acumulado_ms"] if app else None,
+        "por_import_de_app": [
+            {"modulo": l["modulo"], "acumulado_ms": round(l["acumulado_ms"], 1)}
+            for l in sorted(diretos, key=lambda l: -l["acumulado_ms"])[:top]
+        ],
+        "mais_caros_self": [
+            {"modulo": l["modulo"], "self_ms": round(l["self_ms"], 1)}
+            for l in sorted(linhas, key=lambda l: -l["self_ms"])[:top]
+        ],
+    }
+
+
+# --- SUBIDA ---
+
+def _get(porta, caminho, timeout=5):
+    """(status, segundos) ou (None, None) se a conexão foi recusada"""
+    conn = http.client.HTTPConnection('127.0.0.1', porta, timeout=timeout)
+    inicio = time.perf_counter()
+    try:
+        conn.request('GET', caminho)
+        resposta = conn.getresponse()
+        resposta.read()
+        return resposta.status, time.perf_counter() - inicio
+    except (ConnectionRefusedError, ConnectionResetError, http.client.RemoteDisconnected):
+        return None, None
+    finally:
+        conn.close()
+
+
+def _esperar(porta, caminho, processo, inicio, timeout):
+    """Tenta GET até vir 200. Retorna (ms desde o spawn, ms da requisição que deu certo, ms da porta aberta)"""
+    porta_aberta = None
+    while time.perf_counter() - inicio < timeout:
+        if processo.poll() is not None:
+            raise RuntimeError("o servidor do site terminou durante a subida")
+        status, duracao = _get(porta, caminho)
+        if status is not None and porta_aberta is None:
+            porta_aberta = (time.perf_counter() - duracao - inicio) * 1000
+        if status == 200:
+            return (time.perf_counter() - inicio) * 1000, duracao * 1000, porta_aberta
+        time.sleep(0.005)
+    raise RuntimeError(f"{caminho} não respondeu 200 a tempo")
+
+
+def medir_subida(modo, env, aquecimento, timeout=60):
+    porta = _porta_livre()
+    inicio = time.perf_counter()
+    processo = subprocess.Popen([
+        sys.executable, os.path.join(RAIZ, 'bench', 'servidor.py'), '--modo', modo, '--porta', str(porta)
+    ], cwd=RAIZ, env=env, stdout=subprocess.DEVNULL)
+    try:
+        medida = {}
+        if aquecimento:
+            pronto_ms, _, porta_ms = _esperar(porta, '/readyz', processo, inicio, timeout)
+            medida.update(porta_aberta_ms=porta_ms, pronto_ms=pronto_ms)
+        primeira_ms, req_ms, porta_ms = _esperar(porta, '/', processo, inicio, timeout)
+        medida.setdefault('porta_aberta_ms', porta_ms)
+        _, segunda = _get(porta, '/')
+        medida.update(primeira_resposta_ms=primeira_ms, primeira_requisicao_ms=req_ms,
+                      segunda_requisicao_ms=segunda * 1000)
+        return {k: round(v, 1) for k, v in medida.items()}
+    finally:
+        processo.terminate()
+        try:
+            processo.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            processo.kill()
+
+
+def _resumo(medidas):
+    return {chave: round(statistics.median(m[chave] for m in medidas), 1) for chave in medidas[0]}
+
+
+def comparar(atual, base, tolerancia):
+    """Imprime a diferença das medianas. Retorna as medidas que pioraram além da tolerância"""
+    regressoes = []
+    print(f"\n{'medida':<24} {'base':>9} {'atual':>9} {'Δ%':>7}")
+    for chave, valor in atual["mediana"].items():
+        anterior = base.get("mediana", {}).get(chave)
+        if not anterior:
+            print(f"{chave:<24} (sem base)")
+            continue
+        delta = (valor - anterior) / anterior * 100
+        pior = delta > tolerancia
+        if pior:
+            regressoes.append(chave)
+        print(f"{chave:<24} {anterior:>9} {valor:>9} {delta:>+7.1f}" + ("   <-- piorou" if pior else ""))
+    return regressoes
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--modo', choices=['wsgi', 'gunicorn', 'asgi'], default='wsgi')
+    parser.add_argument('--aquecimento', action='store_true', help='sobe com AQUECIMENTO_ATIVO=1 e espera o /readyz')
+    parser.add_argument('--top', type=int, default=15, help='módulos listados no perfil de importação')
+    parser.add_argument('--saida', default=os.path.join(RAIZ, 'bench', 'resultados', 'startup_ultimo.json'))
+    parser.add_argument('--comparar', help='JSON de um resultado anterior')
+    parser.add_argument('--tolerancia', type=float, default=15.0, help='%% de piora aceita nas medianas')
+    args = parser.parse_args()
+
+    env = _ambiente(args.aquecimento)
+    # Como no deploy: os estáticos são gerados antes, a subida só lê o manifesto
+    subprocess.run([sys.executable, os.path.join(RAIZ, 'assets.py')], cwd=RAIZ, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    # Sem a thread de aquecimento: os imports dela bagunçariam o aninhamento do -X importtime
+    perfil = perfil_importacao(dict(env, AQUECIMENTO_ATIVO='0'), args.top)
+    print(f"import app: {perfil['import_app_ms']:.1f} ms")
+    for item in perfil["por_import_de_app"]:
+        print(f"  {item['modulo']:<28} {item['acumulado_ms']:>8.1f} ms")
+
+    medidas = []
+    for i in range(args.repeticoes):
+        medida = medir_subida(args.modo, env, args.aquecimento)
+        medidas.append(medida)
+        print(f"#{i + 1}: " + "  ".join(f"{k} {v}" for k, v in medida.items()))
+
+    relatorio = {
+        "meta": {
+            "data": datetime.now().isoformat(timespec='seconds'),
+            "commit": _commit_atual(),
+            "python": platform.python_version(),
+            "modo": args.modo,
+            "aquecimento": args.aquecimento,
+            "repeticoes": args.repeticoes,
+        },
+        "importacao": perfil,
+        "mediana": _resumo(medidas),
+        "medidas": medidas,
+    }
+    print("\nMediana: " + "  ".join(f"{k} {v}" for k, v in relatorio["mediana"].items()))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    print(f"Resultado em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            regressoes = comparar(relatorio, json.load(f), args.tolerancia)
+        if regressoes:
+            print(f"\nPiorou além de {args.tolerancia}%: {', '.join(regressoes)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Servidores falsos da ip-api e do Resend para rodar a suíte sem internet.
+Cada um sobe numa porta livre, numa thread, e conta as chamadas recebidas.
+"""
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class _Servidor:
+    def __init__(self, handler, atraso_segundos=0.0):
+        self.chamadas = 0
+        self.atraso_segundos = atraso_segundos
+        self._lock = threading.Lock()
+        handler.stub = self
+        self._http = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._http.daemon_threads = True
+        self._thread = threading.Thread(target=self._http.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._http.server_address[1]}"
+
+    def contar(self):
+        with self._lock:
+            self.chamadas += 1
+        if self.atraso_segundos:
+            time.sleep(self.atraso_segundos)
+
+    def iniciar(self):
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stub = None
+
+    def _json(self, status, corpo):
+        dados = json.dumps(corpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def log_message(self, *args):
+        pass
+
+
+class _IpApiHandler(_Handler):
+    def do_GET(self):
+        self.stub.contar()
+        self._json(200, {
+            "status": "success", "countryCode": "BR", "regionName": "São Paulo", "city": "Campinas",
+            "isp": "Provedor Bench", "org": "Provedor Bench", "zip": "13000-000"
+        })
+
+
+class _ResendHandler(_Handler):
+    def do_POST(self):
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(tamanho)
+        self.stub.contar()
+        self._json(200, {"id": f"bench-{self.stub.chamadas}"})
+
+
+def stub_ip_api(atraso_segundos=0.02):
+    """ip-api falsa: responde sempre o mesmo local, com um atraso parecido com o real"""
+    return _Servidor(_IpApiHandler, atraso_segundos).iniciar()
+
+
+def stub_resend(atraso_segundos=0.05):
+    """Resend falso: aceita qualquer POST (/emails) e devolve um id"""
+    return _Servidor(_ResendHandler, atraso_segundos).iniciar()
@@ -0,0 +1,134 @@
+import os
+import json
+import threading
+
+from db_utils import db_cursor
+from metrics import gauge
+
+# --- BUFFER DE CLIQUES PARA O E-MAIL ---
+# Acumula os cliques até atingir o bucket_size do My Ô (ou até o cron).
+# 'memoria'  = lista por processo, protegida por lock (cada worker tem o seu balde)
+# 'postgres' = tabela pending_notifications compartilhada por todos os workers e
+#              que sobrevive a restart (ver migrations/002_pending_notifications.sql)
+# Com banco configurado o padrão é 'postgres': com vários workers, baldes em memória
+# somam o bucket_size por processo e perdem os cliques em cada deploy
+CLICK_BUFFER_BACKEND = os.getenv('CLICK_BUFFER_BACKEND') or ('postgres' if os.getenv('DATABASE_URL') else 'memoria')
+# Cada site (site_source) tem o seu balde e o seu bucket_size; este teto vale para
+# todos e segura a memória quando um site configura um balde enorme
+CLICK_BUFFER_MAX_POR_SITE = int(os.getenv('CLICK_BUFFER_MAX_POR_SITE', '500'))
+
+_BUFFERS = {}
+_BUFFER_LOCK = threading.Lock()
+
+
+# --- Backend em memória ---
+
+def _memoria_adicionar(site_source, cliques):
+    with _BUFFER_LOCK:
+        buffer = _BUFFERS.setdefault(site_source, [])
+        buffer.extend(cliques)
+        return len(buffer)
+
+
+def _memoria_drenar(site_source):
+    # Troca a lista inteira sob o lock: quem drena leva tudo, ninguém mais vê esses cliques
+    with _BUFFER_LOCK:
+        return _BUFFERS.pop(site_source, [])
+
+
+def _memoria_tamanho(site_source):
+    with _BUFFER_LOCK:
+        return len(_BUFFERS.get(site_source, []))
+
+
+def _memoria_sites():
+    with _BUFFER_LOCK:
+        return [site for site, cliques in _BUFFERS.items() if cliques]
+
+
+def _memoria_tamanhos():
+    with _BUFFER_LOCK:
+        return {(('site_source', site),): len(cliques) for site, cliques in _BUFFERS.items()}
+
+
+# --- Backend Postgres ---
+
+def _postgres_adicionar(site_source, cliques):
+    with db_cursor(commit=True, operacao='click_buffer') as cur:
+        cur.executemany(
+            "INSERT INTO pending_notifications (site_source, payload) VALUES (%s, %s)",
+            [(site_source, json.dumps(c, default=str)) for c in cliques]
+        )
+        cur.execute("SELECT count(*) FROM pending_notifications WHERE site_source = %s", (site_source,))
+        return cur.fetchone()[0]
+
+
+def _postgres_drenar(site_source):
+    # DELETE ... RETURNING com SKIP LOCKED: dois workers drenando ao mesmo tempo
+    # nunca recebem o mesmo clique
+    with db_cursor(commit=True, operacao='click_buffer') as cur:
+        cur.execute("""
+            DELETE FROM pending_notifications
+            WHERE id IN (
+                SELECT id FROM pending_notifications
+                WHERE site_source = %s
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, payload
+        """, (site_source,))
+        linhas = sorted(cur.fetchall(), key=lambda r: r[0])
+    return [p if isinstance(p, dict) else json.loads(p) for _, p in linhas]
+
+
+def _postgres_tamanho(site_source):
+    with db_cursor(operacao='click_buffer') as cur:
+        cur.execute("SELECT count(*) FROM pending_notifications WHERE site_source = %s", (site_source,))
+        return cur.fetchone()[0]
+
+
+def _postgres_sites():
+    with db_cursor(operacao='click_buffer') as cur:
+        # Índice (site_source, id): o DISTINCT não precisa ler a tabela toda
+        cur.execute("SELECT DISTINCT site_source FROM pending_notifications")
+        return [linha[0] for linha in cur.fetchall()]
+
+
+_BACKENDS = {
+    'memoria': (_memoria_adicionar, _memoria_drenar, _memoria_tamanho, _memoria_sites),
+    'postgres': (_postgres_adicionar, _postgres_drenar, _postgres_tamanho, _postgres_sites),
+}
+
+
+def _backend():
+    return _BACKENDS.get(CLICK_BUFFER_BACKEND, _BACKENDS['memoria'])
+
+
+def adicionar_clique(site_source, clique):
+    """Adiciona o clique ao balde do site. Retorna o tamanho do balde depois disso"""
+    return _backend()[0](site_source, [clique])
+
+
+def devolver_cliques(site_source, cliques):
+    """Recoloca no balde um lote drenado que não pôde ser enviado"""
+    if cliques:
+        _backend()[0](site_source, cliques)
+
+
+def drenar_cliques(site_source):
+    """Retira (de forma atômica) todos os cliques do balde do site"""
+    return _backend()[1](site_source)
+
+
+def tamanho_buffer(site_source):
+    return _backend()[2](site_source)
+
+
+def sites_com_cliques():
+    """site_source de todos os baldes com algum clique (o cron esvazia cada um)"""
+    return _backend()[3]()
+
+
+# No backend postgres o balde é compartilhado e contá-lo custaria uma consulta por coleta
+if CLICK_BUFFER_BACKEND == 'memoria':
+    gauge('click_buffer_tamanho', 'Cliques no balde do e-mail deste processo', _memoria_tamanhos)
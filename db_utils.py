@@ -1,93 +1,649 @@
 import os
 import json
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import time
+import queue
+import select
+import atexit
+import signal
+import threading
+import logging
+import unicodedata
+from datetime import datetime
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 
+import importlib
 
-def get_db_connection():
-    """Conecta ao banco de dados Neon"""
-    try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        return conn
-    except Exception as e:
-        print(f"❌ Erro ao conectar no Banco: {e}")
-        return None
+from background import submit_background
+from metrics import DB_CONEXAO, DB_ESPERA_POOL, DB_ERROS, DB_CONEXOES_ABERTAS, gauge, expor_stats
 
+logger = logging.getLogger(__name__)
+
+# --- POOL DE CONEXÕES ---
+# Um pool por processo (cada worker do gunicorn cria o seu após o fork).
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+# Conexões ociosas há mais tempo que isso são testadas com SELECT 1 antes do uso
+DB_POOL_HEALTHCHECK_SEGUNDOS = int(os.getenv('DB_POOL_HEALTHCHECK_SEGUNDOS', '30'))
+# Tempo máximo esperando uma conexão livre quando o pool está todo emprestado
+DB_POOL_TIMEOUT_SEGUNDOS = float(os.getenv('DB_POOL_TIMEOUT_SEGUNDOS', '10'))
+
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+# O ThreadedConnectionPool estoura PoolError quando esgota; o semáforo faz as threads esperarem a vez
+_POOL_SEMAFORO = threading.BoundedSemaphore(DB_POOL_MAX)
+_ULTIMO_USO = {}
+
+
+# psycopg2 é carregado no primeiro acesso ao banco (get_db_pool/listener), não
+# na importação: páginas que só renderizam template sobem sem ele
+psycopg2 = None
+_Pool = None
+_PSYCOPG2_LOCK = threading.Lock()
+
+
+def _carregar_psycopg2():
+    global psycopg2, _Pool
+    if psycopg2 is not None:
+        return psycopg2
+
+    with _PSYCOPG2_LOCK:
+        if psycopg2 is None:
+            modulo = importlib.import_module('psycopg2')
+            for sub in ('errors', 'extensions', 'extras', 'pool'):
+                importlib.import_module('psycopg2.' + sub)
+
+            class Pool(modulo.pool.ThreadedConnectionPool):
+                def _connect(self, key=None):
+                    conn = super()._connect(key)
+                    DB_CONEXOES_ABERTAS.inc(origem='pool')
+                    return conn
+
+            _Pool = Pool
+            # Por último: quem vê psycopg2 preenchido já encontra o _Pool
+            psycopg2 = modulo
+    return psycopg2
+
+
+def dict_cursor():
+    """cursor_factory que devolve linhas como dict (RealDictCursor)"""
+    return _carregar_psycopg2().extras.RealDictCursor
+
+
+def get_db_pool():
+    """Retorna o pool do processo atual, criando-o se necessário"""
+    global _POOL, _POOL_PID, _POOL_SEMAFORO
+
+    pid = os.getpid()
+    if _POOL is not None and _POOL_PID == pid:
+        return _POOL
+
+    _carregar_psycopg2()
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_PID != pid:
+            # Pool herdado do processo pai (fork do gunicorn) não pode ser reutilizado:
+            # os sockets são compartilhados. Descarta sem fechar e cria um novo.
+            _POOL = _Pool(DB_POOL_MIN, DB_POOL_MAX, os.getenv('DATABASE_URL'))
+            _POOL_PID = pid
+            _POOL_SEMAFORO = threading.BoundedSemaphore(DB_POOL_MAX)
+            _ULTIMO_USO.clear()
+    return _POOL
+
+
+def _conexao_saudavel(conn):
+    """Verifica se a conexão ainda responde (Neon derruba conexões ociosas)"""
+    if conn.closed:
+        return False
+
+    ultimo_uso = _ULTIMO_USO.get(id(conn))
+    if ultimo_uso and time.monotonic() - ultimo_uso < DB_POOL_HEALTHCHECK_SEGUNDOS:
+        return True
 
-def get_table_id_by_name(keyword):
-    """Procura ID da tabela pelo nome"""
-    conn = get_db_connection()
-    if not conn: return None
     try:
         cur = conn.cursor()
-        query = "SELECT id FROM user_tables WHERE LOWER(display_name) LIKE LOWER(%s) LIMIT 1"
-        cur.execute(query, (f"%{keyword}%",))
-        result = cur.fetchone()
-        return result[0] if result else None
-    except Exception as e:
-        print(f"Erro ao buscar ID da tabela: {e}")
-        return None
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def conexoes_em_uso():
+    """Conexões do pool deste processo emprestadas agora"""
+    if _POOL is None or _POOL_PID != os.getpid():
+        return 0
+    return len(_POOL._used)
+
+
+def _checkout():
+    """Pega uma conexão saudável do pool, descartando as quebradas"""
+    pool = get_db_pool()
+    semaforo = _POOL_SEMAFORO
+    with DB_ESPERA_POOL.tempo():
+        livre = semaforo.acquire(timeout=DB_POOL_TIMEOUT_SEGUNDOS)
+    if not livre:
+        DB_ERROS.inc(operacao='checkout')
+        raise psycopg2.OperationalError("Tempo esgotado esperando conexão livre no pool")
+
+    try:
+        for _ in range(DB_POOL_MAX + 1):
+            conn = pool.getconn()
+            if _conexao_saudavel(conn):
+                return pool, semaforo, conn
+            _ULTIMO_USO.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+    except Exception:
+        semaforo.release()
+        raise
+
+    semaforo.release()
+    raise psycopg2.OperationalError("Nenhuma conexão saudável disponível no pool")
+
+
+@contextmanager
+def db_connection(operacao='outros'):
+    """
+    Empresta uma conexão do pool.
+    Faz rollback em caso de erro e devolve a conexão ao pool no final.
+    operacao só rotula as métricas de tempo/erro.
+    """
+    pool, semaforo, conn = _checkout()
+    quebrada = False
+    inicio = time.perf_counter()
+    try:
+        yield conn
+    except Exception:
+        DB_ERROS.inc(operacao=operacao)
+        try:
+            conn.rollback()
+        except Exception:
+            quebrada = True
+        raise
     finally:
-        if conn: conn.close()
+        DB_CONEXAO.observe(time.perf_counter() - inicio, operacao=operacao)
+        quebrada = quebrada or bool(conn.closed)
+        if quebrada:
+            _ULTIMO_USO.pop(id(conn), None)
+        else:
+            _ULTIMO_USO[id(conn)] = time.monotonic()
+        pool.putconn(conn, close=quebrada)
+        semaforo.release()
+
+
+@contextmanager
+def db_cursor(cursor_factory=None, commit=False, operacao='outros'):
+    """Atalho: conexão do pool + cursor, com commit opcional"""
+    with db_connection(operacao) as conn:
+        cur = conn.cursor(cursor_factory=cursor_factory)
+        try:
+            yield cur
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        finally:
+            cur.close()
+
+
+# --- RESOLUÇÃO DE NOME DE TABELA ---
+# Nomes são comparados normalizados (sem acento, casefold, sem espaços nas pontas),
+# então 'Portfolio' e 'Portfólio' viram a mesma busca. A comparação é exata: com
+# vários sites, 'Portfolio' não pode casar com 'Portfolio Cliente X'. No banco, o
+# índice B-tree sobre lower(f_unaccent(btrim(display_name))) atende o = ANY
+# (migrations/004 e 008).
+TABLE_ID_CACHE_SEGUNDOS = float(os.getenv('TABLE_ID_CACHE_SEGUNDOS', '3600'))
+
+_TABLE_IDS = {}
+_TABLE_IDS_LOCK = threading.Lock()
+
+
+def normalizar_nome(nome):
+    """'Portfólio ' -> 'portfolio'"""
+    sem_acento = unicodedata.normalize('NFKD', nome or '')
+    sem_acento = ''.join(c for c in sem_acento if not unicodedata.combining(c))
+    return sem_acento.casefold().strip()
+
+
+def _buscar_tabelas(chaves, nomes_originais):
+    """Uma única consulta para todas as chaves normalizadas. Retorna [(id, display_name)]"""
+    with db_cursor(operacao='tabelas') as cur:
+        try:
+            cur.execute(
+                "SELECT id, display_name FROM user_tables "
+                "WHERE lower(f_unaccent(btrim(display_name))) = ANY(%s) ORDER BY id",
+                (list(chaves),)
+            )
+            return cur.fetchall()
+        except psycopg2.errors.UndefinedFunction:
+            # Migração 004 ainda não aplicada: sem f_unaccent, cai no LOWER simples
+            # (procurando também as grafias originais, com acento)
+            cur.connection.rollback()
+            logger.warning("f_unaccent não existe (migrations/004). Usando busca sem índice.")
+            termos = set(chaves) | {n.strip().lower() for n in nomes_originais}
+            cur.execute(
+                "SELECT id, display_name FROM user_tables "
+                "WHERE lower(btrim(display_name)) = ANY(%s) ORDER BY id",
+                (sorted(termos),)
+            )
+            return cur.fetchall()
+
+
+def resolve_table_ids(nomes):
+    """
+    Resolve vários nomes de tabela de uma vez. Retorna {nome: id} só com os encontrados.
+    Usa o mapa em memória e vai ao banco (uma consulta) apenas pelo que faltar.
+    """
+    agora = time.monotonic()
+    chaves = {nome: normalizar_nome(nome) for nome in nomes}
+    encontrados = {}
+    faltando = set()
+
+    with _TABLE_IDS_LOCK:
+        for nome, chave in chaves.items():
+            em_cache = _TABLE_IDS.get(chave)
+            if em_cache and agora - em_cache[1] < TABLE_ID_CACHE_SEGUNDOS:
+                encontrados[nome] = em_cache[0]
+            else:
+                faltando.add(chave)
+
+    if faltando:
+        linhas = _buscar_tabelas(sorted(faltando), [n for n, c in chaves.items() if c in faltando])
+        with _TABLE_IDS_LOCK:
+            for chave in faltando:
+                # Primeira tabela (menor id) com o nome normalizado igual à chave
+                for tab_id, display_name in linhas:
+                    if normalizar_nome(display_name) == chave:
+                        _TABLE_IDS[chave] = (tab_id, agora)
+                        break
+            for nome, chave in chaves.items():
+                if nome not in encontrados and chave in _TABLE_IDS:
+                    encontrados[nome] = _TABLE_IDS[chave][0]
+
+    return encontrados
+
+
+def invalidate_table_ids():
+    with _TABLE_IDS_LOCK:
+        _TABLE_IDS.clear()
+
+
+def find_table_id(*nomes):
+    """
+    Primeiro ID encontrado entre os nomes candidatos (em ordem de preferência).
+    None só quando nenhuma tabela tem esses nomes: erros do banco sobem para quem
+    chamou, que não pode confundi-los com tabela ausente.
+    """
+    encontrados = resolve_table_ids(nomes)
+    for nome in nomes:
+        if nome in encontrados:
+            return encontrados[nome]
+    return None
+
+
+def get_table_id_by_name(keyword):
+    """Procura ID da tabela pelo nome"""
+    return find_table_id(keyword)
+
+
+# Linhas por página (keyset) e por ida ao servidor dentro da página (itersize)
+SHEET_PAGE_SIZE = int(os.getenv('SHEET_PAGE_SIZE', '5000'))
+SHEET_ITERSIZE = int(os.getenv('SHEET_ITERSIZE', '500'))
+
+
+def iter_sheet_data(tab_id, colunas=None, tamanho_pagina=None):
+    """
+    Gera os dados JSON da tabela em streaming, sem materializar tudo na memória.
+    Pagina por id (keyset) e lê cada página com cursor nomeado (server-side).
+    colunas: lista opcional de chaves do JSON; só elas saem do banco.
+    Erros são propagados para quem consome.
+    """
+    tamanho_pagina = tamanho_pagina or SHEET_PAGE_SIZE
+
+    if colunas:
+        # Projeção feita no SQL: json_build_object('Título', data->'Título', ...)
+        projecao = "json_build_object(" + ", ".join(["%s, data->%s"] * len(colunas)) + ")"
+        params_projecao = [p for c in colunas for p in (c, c)]
+    else:
+        projecao = "data"
+        params_projecao = []
+
+    ultimo_id = None
+    while True:
+        filtro_id = "" if ultimo_id is None else "AND id > %s"
+        params = params_projecao + [tab_id] + ([] if ultimo_id is None else [ultimo_id]) + [tamanho_pagina]
+
+        # Uma conexão por página: o pool não fica preso enquanto o chamador processa
+        with db_connection('sheet') as conn:
+            cur = conn.cursor(name=f"sheet_{tab_id}_{threading.get_ident()}")
+            cur.itersize = SHEET_ITERSIZE
+            try:
+                cur.execute(f"""
+                    SELECT id, {projecao} FROM table_records
+                    WHERE table_id = %s {filtro_id}
+                    ORDER BY id ASC
+                    LIMIT %s
+                """, params)
+                pagina = []
+                for linha_id, dados in cur:
+                    ultimo_id = linha_id
+                    pagina.append(dados)
+            finally:
+                cur.close()
+                conn.rollback()
+
+        yield from pagina
+        if len(pagina) < tamanho_pagina:
+            return
 
 
 def get_sheet_data(tab_id):
     """Busca os dados JSON da tabela"""
-    conn = get_db_connection()
-    if not conn: return []
     try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT data FROM table_records WHERE table_id = %s ORDER BY id ASC", (tab_id,))
-        rows = cur.fetchall()
-        return [r['data'] for r in rows]
+        return list(iter_sheet_data(tab_id))
     except Exception as e:
-        print(f"Erro ao ler dados da tabela {tab_id}: {e}")
+        logger.error("Erro ao ler dados da tabela: %s", e, extra={"tab_id": tab_id})
         return []
-    finally:
-        if conn: conn.close()
+
+
+def _tracking_row(data):
+    return (
+        data.get('site_source', 'Merlô'),
+        data['uid'],
+        data['botao'],
+        data['pagina_origem'],
+        data['url_destino'],
+        data['ip_address'],
+        data['localizacao'],
+        data['provedor'],
+        data['dispositivo'],
+        data['created_at']
+    )
 
 
 def insert_tracking_event(data):
     """Salva o clique no banco"""
-    conn = get_db_connection()
-    if not conn: return
-
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO tracking_events 
+        insert_tracking_events([data])
+    except Exception as e:
+        logger.error("Erro ao salvar tracking: %s", e)
+
+
+def insert_tracking_events(eventos):
+    """
+    Salva vários cliques com um único INSERT multi-linha e um único commit.
+    Os rollups são atualizados na mesma transação.
+    Propaga a exceção para quem chamou decidir se tenta de novo.
+    """
+    if not eventos:
+        return
+    with db_cursor(commit=True, operacao='tracking_insert') as cur:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO tracking_events
             (site_source, uid, botao, pagina_origem, url_destino, ip_address, localizacao, provedor, dispositivo, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            data.get('site_source', 'Merlô'),
-            data['uid'],
-            data['botao'],
-            data['pagina_origem'],
-            data['url_destino'],
-            data['ip_address'],
-            data['localizacao'],
-            data['provedor'],
-            data['dispositivo'],
-            data['created_at']
-        ))
-        conn.commit()
+            VALUES %s
+        """, [_tracking_row(e) for e in eventos], page_size=len(eventos))
+        if TRACKING_ROLLUPS_ATIVO:
+            _atualizar_rollups(cur, eventos)
+
+
+# --- ROLLUPS (tracking_rollups) ---
+# Contagens por hora e por dia para cada combinação de site/botão/página/dispositivo/local,
+# incrementadas a cada lote gravado. Dashboards e /api/stats leem só daqui.
+# Ver migrations/005_tracking_rollups.sql.
+TRACKING_ROLLUPS_ATIVO = os.getenv('TRACKING_ROLLUPS_ATIVO', '1') == '1'
+ROLLUP_GRANULARIDADES = ('hora', 'dia')
+ROLLUP_DIMENSOES = ('botao', 'pagina_origem', 'dispositivo', 'localizacao')
+
+
+def _inicio_periodo(momento, granularidade):
+    if granularidade == 'hora':
+        return momento.replace(minute=0, second=0, microsecond=0)
+    return momento.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def agregar_rollups(eventos):
+    """Agrupa o lote em memória: {(granularidade, periodo, site, botao, pagina, dispositivo, local): total}"""
+    contagens = Counter()
+    for e in eventos:
+        momento = e.get('created_at')
+        if not isinstance(momento, datetime):
+            continue
+        dimensoes = tuple((e.get(d) or '') for d in ROLLUP_DIMENSOES)
+        for granularidade in ROLLUP_GRANULARIDADES:
+            chave = (granularidade, _inicio_periodo(momento, granularidade), e.get('site_source', 'Merlô')) + dimensoes
+            contagens[chave] += 1
+    return contagens
+
+
+def _atualizar_rollups(cur, eventos):
+    contagens = agregar_rollups(eventos)
+    if not contagens:
+        return
+    # Savepoint: se a tabela de rollups falhar (ex.: migração pendente), os eventos ainda são gravados
+    cur.execute("SAVEPOINT rollups")
+    try:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO tracking_rollups
+            (granularidade, periodo, site_source, botao, pagina_origem, dispositivo, localizacao, total)
+            VALUES %s
+            ON CONFLICT (granularidade, periodo, site_source, botao, pagina_origem, dispositivo, localizacao)
+            DO UPDATE SET total = tracking_rollups.total + EXCLUDED.total
+        """, [chave + (total,) for chave, total in sorted(contagens.items())], page_size=len(contagens))
+        cur.execute("RELEASE SAVEPOINT rollups")
     except Exception as e:
-        print(f"❌ Erro ao salvar tracking: {e}")
-    finally:
-        if conn: conn.close()
+        cur.execute("ROLLBACK TO SAVEPOINT rollups")
+        logger.warning("Erro ao atualizar rollups: %s", e, extra={"eventos": len(eventos)})
 
 
-# --- NOVA FUNÇÃO: Busca Configurações do My Ô ---
-def get_tracking_settings(site_source):
+def get_tracking_stats(site_source, granularidade='dia', desde=None, ate=None, dimensao=None):
     """
-    Busca as configurações de tracking (Email, Balde, Intervalo)
-    do usuário dono deste site na tabela 'users'.
+    Série de contagens lida só dos rollups.
+    dimensao: None (total por período) ou uma de ROLLUP_DIMENSOES.
     """
-    conn = get_db_connection()
-    if not conn: return None
+    if granularidade not in ROLLUP_GRANULARIDADES:
+        raise ValueError(f"granularidade inválida: {granularidade}")
+    if dimensao is not None and dimensao not in ROLLUP_DIMENSOES:
+        raise ValueError(f"dimensão inválida: {dimensao}")
+
+    # dimensao vem de uma lista fixa, então pode ir direto no SQL
+    coluna = f", {dimensao}" if dimensao else ""
+    filtros = ["site_source = %s", "granularidade = %s"]
+    params = [site_source, granularidade]
+    if desde:
+        filtros.append("periodo >= %s")
+        params.append(desde)
+    if ate:
+        filtros.append("periodo < %s")
+        params.append(ate)
+
+    with db_cursor(cursor_factory=dict_cursor(), operacao='stats') as cur:
+        cur.execute(f"""
+            SELECT periodo{coluna}, SUM(total) AS total
+            FROM tracking_rollups
+            WHERE {' AND '.join(filtros)}
+            GROUP BY periodo{coluna}
+            ORDER BY periodo{coluna}
+        """, params)
+        return [dict(r, total=int(r['total'])) for r in cur.fetchall()]
+
+
+# --- FILA DE ESCRITA EM LOTE (tracking_events) ---
+# As threads de clique só enfileiram; uma única thread escritora por processo
+# esvazia a fila e grava em lote quando enche o lote ou quando vence o tempo.
+TRACKING_QUEUE_MAX = int(os.getenv('TRACKING_QUEUE_MAX', '5000'))
+TRACKING_BATCH_SIZE = int(os.getenv('TRACKING_BATCH_SIZE', '200'))
+TRACKING_FLUSH_SEGUNDOS = float(os.getenv('TRACKING_FLUSH_SEGUNDOS', '2'))
+# Quanto tempo um produtor espera por espaço na fila cheia antes de descartar o evento
+TRACKING_QUEUE_TIMEOUT_SEGUNDOS = float(os.getenv('TRACKING_QUEUE_TIMEOUT_SEGUNDOS', '0.5'))
+TRACKING_MAX_TENTATIVAS = int(os.getenv('TRACKING_MAX_TENTATIVAS', '3'))
+
+TRACKING_WRITER_STATS = {"enfileirados": 0, "gravados": 0, "descartados": 0, "retentativas": 0, "lotes": 0}
+_STATS_LOCK = threading.Lock()
+
+_FILA_TRACKING = None
+_WRITER_THREAD = None
+_WRITER_PID = None
+_WRITER_LOCK = threading.Lock()
+_WRITER_PARAR = threading.Event()
+
+
+def _contar(chave, quantidade=1):
+    with _STATS_LOCK:
+        TRACKING_WRITER_STATS[chave] += quantidade
+
+
+def _garantir_writer():
+    """Sobe a fila e a thread escritora do processo atual (uma vez por worker)"""
+    global _FILA_TRACKING, _WRITER_THREAD, _WRITER_PID
+
+    pid = os.getpid()
+    if _WRITER_PID == pid and _WRITER_THREAD is not None and _WRITER_THREAD.is_alive():
+        return _FILA_TRACKING
 
+    with _WRITER_LOCK:
+        if _WRITER_PID != pid:
+            # Após o fork a fila herdada não tem mais thread consumidora
+            _FILA_TRACKING = queue.Queue(maxsize=TRACKING_QUEUE_MAX)
+            _WRITER_PID = pid
+            _WRITER_THREAD = None
+        if _WRITER_THREAD is None or not _WRITER_THREAD.is_alive():
+            _WRITER_PARAR.clear()
+            _WRITER_THREAD = threading.Thread(target=_loop_writer, name="tracking-writer", daemon=True)
+            _WRITER_THREAD.start()
+    return _FILA_TRACKING
+
+
+def enqueue_tracking_event(data):
+    """
+    Coloca o clique na fila de gravação.
+    Com a fila cheia, espera um pouco (backpressure) e depois descarta.
+    Retorna True se o evento foi aceito.
+    """
+    fila = _garantir_writer()
     try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        fila.put(data, timeout=TRACKING_QUEUE_TIMEOUT_SEGUNDOS)
+    except queue.Full:
+        _contar("descartados")
+        logger.warning("Fila de tracking cheia. Evento descartado.")
+        return False
+    _contar("enfileirados")
+    return True
+
+
+def _gravar_lote(lote):
+    """Grava o lote com retentativas e backoff curto"""
+    for tentativa in range(1, TRACKING_MAX_TENTATIVAS + 1):
+        try:
+            insert_tracking_events(lote)
+            _contar("gravados", len(lote))
+            _contar("lotes")
+            return True
+        except Exception as e:
+            logger.error("Erro ao salvar lote de tracking: %s", e, extra={"eventos": len(lote), "tentativa": tentativa})
+            if tentativa < TRACKING_MAX_TENTATIVAS:
+                _contar("retentativas")
+                time.sleep(min(0.2 * 2 ** (tentativa - 1), 2))
+
+    _contar("descartados", len(lote))
+    return False
+
+
+def _coletar_lote(fila, espera_inicial):
+    """Espera o primeiro evento e junta o que chegar até encher o lote ou vencer o prazo"""
+    try:
+        primeiro = fila.get(timeout=espera_inicial)
+    except queue.Empty:
+        return []
+
+    lote = [primeiro]
+    prazo = time.monotonic() + TRACKING_FLUSH_SEGUNDOS
+    while len(lote) < TRACKING_BATCH_SIZE:
+        restante = prazo - time.monotonic()
+        if restante <= 0 or _WRITER_PARAR.is_set():
+            break
+        try:
+            lote.append(fila.get(timeout=restante))
+        except queue.Empty:
+            break
+    return lote
+
+
+def _loop_writer():
+    fila = _FILA_TRACKING
+    while not _WRITER_PARAR.is_set():
+        lote = _coletar_lote(fila, TRACKING_FLUSH_SEGUNDOS)
+        if lote:
+            _gravar_lote(lote)
+
+
+def flush_tracking_events():
+    """
+    Para a thread escritora e grava tudo que ainda está na fila.
+    Chamado no desligamento do processo (atexit / SIGTERM).
+    """
+    if _FILA_TRACKING is None or _WRITER_PID != os.getpid():
+        return
+
+    _WRITER_PARAR.set()
+    if _WRITER_THREAD is not None and _WRITER_THREAD.is_alive():
+        _WRITER_THREAD.join(timeout=TRACKING_FLUSH_SEGUNDOS + 5)
+
+    pendentes = []
+    while True:
+        try:
+            pendentes.append(_FILA_TRACKING.get_nowait())
+        except queue.Empty:
+            break
+
+    for i in range(0, len(pendentes), TRACKING_BATCH_SIZE):
+        _gravar_lote(pendentes[i:i + TRACKING_BATCH_SIZE])
+
+    if pendentes:
+        logger.info("Fila de tracking esvaziada no desligamento.", extra={"eventos": len(pendentes)})
+
+
+def _sigterm_handler(signum, frame):
+    # SystemExit faz o atexit rodar (e com ele o flush da fila)
+    raise SystemExit(0)
+
+
+atexit.register(flush_tracking_events)
+
+# O gunicorn instala o próprio tratamento de SIGTERM (que já termina chamando o atexit);
+# só assumimos o sinal quando ninguém mais cuidou dele (ex.: python app.py).
+if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+    signal.signal(signal.SIGTERM, _sigterm_handler)
+
+gauge('db_conexoes_em_uso', 'Conexões do pool emprestadas', conexoes_em_uso)
+gauge('tracking_fila_tamanho', 'Eventos aguardando a thread escritora',
+      lambda: _FILA_TRACKING.qsize() if _FILA_TRACKING is not None and _WRITER_PID == os.getpid() else 0)
+expor_stats('tracking_writer', TRACKING_WRITER_STATS, 'Fila de escrita de tracking_events')
+
+
+# --- NOVA FUNÇÃO: Busca Configurações do My Ô ---
+TRACKING_SETTINGS_PADRAO = {"email_enabled": True, "bucket_size": 10, "cron_interval": 15}
+
+# Cache por processo: dentro do TTL responde da memória; até o limite de "stale"
+# responde o valor antigo e recarrega em background; depois disso busca na hora.
+SETTINGS_CACHE_TTL_SEGUNDOS = float(os.getenv('SETTINGS_CACHE_TTL_SEGUNDOS', '30'))
+SETTINGS_CACHE_STALE_SEGUNDOS = float(os.getenv('SETTINGS_CACHE_STALE_SEGUNDOS', '600'))
+# Canal do LISTEN/NOTIFY disparado quando o My Ô altera users.tracking_config
+# (ver migrations/001_tracking_config_notify.sql). Vazio desliga o listener.
+SETTINGS_NOTIFY_CHANNEL = os.getenv('SETTINGS_NOTIFY_CHANNEL', 'tracking_config_changed')
+# Sites guardados (um por site_source, LRU): com muitos tenants o menos usado sai primeiro
+SETTINGS_CACHE_MAX_SITES = int(os.getenv('SETTINGS_CACHE_MAX_SITES', '1000'))
+
+_SETTINGS_CACHE = OrderedDict()
+_SETTINGS_RECARREGANDO = set()
+_SETTINGS_LOCK = threading.Lock()
+_LISTENER_PID = None
+
+
+def _buscar_tracking_settings(site_source):
+    """Consulta direta no banco (propaga erros)"""
+    with db_cursor(cursor_factory=dict_cursor(), operacao='settings') as cur:
         # Busca o usuário que tem este site_source
         cur.execute("SELECT tracking_config FROM users WHERE site_source = %s LIMIT 1", (site_source,))
         result = cur.fetchone()
@@ -96,10 +652,125 @@ def get_tracking_settings(site_source):
             return result['tracking_config']
 
         # Padrão se não achar
-        return {"email_enabled": True, "bucket_size": 10, "cron_interval": 15}
+        return dict(TRACKING_SETTINGS_PADRAO)
 
-    except Exception as e:
-        print(f"Erro ao buscar configs: {e}")
-        return {"email_enabled": True, "bucket_size": 10, "cron_interval": 15}
+
+def _recarregar_settings(site_source):
+    try:
+        valor = _buscar_tracking_settings(site_source)
+        with _SETTINGS_LOCK:
+            _SETTINGS_CACHE[site_source] = (time.monotonic(), valor)
+            _SETTINGS_CACHE.move_to_end(site_source)
+            if len(_SETTINGS_CACHE) > SETTINGS_CACHE_MAX_SITES:
+                _SETTINGS_CACHE.popitem(last=False)
+        return valor
     finally:
-        if conn: conn.close()
\ No newline at end of file
+        with _SETTINGS_LOCK:
+            _SETTINGS_RECARREGANDO.discard(site_source)
+
+
+def _recarregar_settings_background(site_source):
+    try:
+        _recarregar_settings(site_source)
+    except Exception as e:
+        logger.error("Erro ao recarregar configs em background: %s", e, extra={"site_source": site_source})
+
+
+def get_tracking_settings(site_source):
+    """
+    Busca as configurações de tracking (Email, Balde, Intervalo)
+    do usuário dono deste site na tabela 'users'.
+    """
+    _garantir_listener_settings()
+    agora = time.monotonic()
+
+    with _SETTINGS_LOCK:
+        em_cache = _SETTINGS_CACHE.get(site_source)
+        velho = False
+        if em_cache:
+            _SETTINGS_CACHE.move_to_end(site_source)
+            idade = agora - em_cache[0]
+            if idade < SETTINGS_CACHE_TTL_SEGUNDOS:
+                return em_cache[1]
+            velho = idade < SETTINGS_CACHE_STALE_SEGUNDOS
+        recarregar = site_source not in _SETTINGS_RECARREGANDO
+        _SETTINGS_RECARREGANDO.add(site_source)
+
+    if velho:
+        # Serve o valor antigo e deixa uma única tarefa recarregar, no executor
+        # compartilhado. Saturado: a próxima requisição tenta de novo
+        if recarregar and not submit_background(_recarregar_settings_background, site_source):
+            with _SETTINGS_LOCK:
+                _SETTINGS_RECARREGANDO.discard(site_source)
+        return em_cache[1]
+
+    try:
+        return _recarregar_settings(site_source)
+    except Exception as e:
+        logger.error("Erro ao buscar configs: %s", e, extra={"site_source": site_source})
+        # Banco fora: melhor o último valor conhecido (mesmo velho) do que o padrão
+        if em_cache:
+            return em_cache[1]
+        return dict(TRACKING_SETTINGS_PADRAO)
+
+
+def invalidate_tracking_settings(site_source=None):
+    """Remove do cache as configs de um site (ou de todos)"""
+    with _SETTINGS_LOCK:
+        if site_source:
+            _SETTINGS_CACHE.pop(site_source, None)
+        else:
+            _SETTINGS_CACHE.clear()
+
+
+def _garantir_listener_settings():
+    """Sobe (uma vez por processo) a thread que escuta o NOTIFY de configs"""
+    global _LISTENER_PID
+    pid = os.getpid()
+    if not SETTINGS_NOTIFY_CHANNEL or _LISTENER_PID == pid:
+        return
+    with _SETTINGS_LOCK:
+        if _LISTENER_PID == pid:
+            return
+        _LISTENER_PID = pid
+    threading.Thread(target=_loop_listener_settings, name="settings-listener", daemon=True).start()
+
+
+def _loop_listener_settings():
+    """
+    Conexão dedicada (fora do pool) em LISTEN. O payload do NOTIFY é o
+    site_source alterado; payload vazio invalida tudo.
+    """
+    espera = 1
+    while True:
+        conn = None
+        try:
+            conn = _carregar_psycopg2().connect(os.getenv('DATABASE_URL'))
+            DB_CONEXOES_ABERTAS.inc(origem='listener')
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {SETTINGS_NOTIFY_CHANNEL}")
+            espera = 1
+            # Reconectou: o que mudou enquanto estava fora não foi notificado
+            invalidate_tracking_settings()
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    # Sem notificações: um ping mantém a conexão viva no Neon
+                    cur.execute("SELECT 1")
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    aviso = conn.notifies.pop(0)
+                    invalidate_tracking_settings(aviso.payload or None)
+                    logger.info("Configs de tracking invalidadas via NOTIFY.", extra={"site_source": aviso.payload or 'todas'})
+        except Exception as e:
+            logger.warning("Listener de configs desconectado: %s. Tentando de novo em %ss.", e, espera)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(espera)
+        espera = min(espera * 2, 60)
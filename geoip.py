@@ -0,0 +1,349 @@
+import os
+import csv
+import time
+import bisect
+import ipaddress
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+
+from metrics import GEOIP_CONSULTA, expor_stats
+
+logger = logging.getLogger(__name__)
+
+# --- GEOIP COM CACHE ---
+# Cache LRU + TTL por IP (ou por rede /24 e /48), com cache negativo para falhas
+# e coalescência: lookups simultâneos do mesmo IP compartilham uma só requisição.
+GEOIP_API_URL = os.getenv('GEOIP_API_URL', 'http://ip-api.com/json/')
+GEOIP_TIMEOUT_SEGUNDOS = float(os.getenv('GEOIP_TIMEOUT_SEGUNDOS', '3'))
+GEOIP_CACHE_MAX = int(os.getenv('GEOIP_CACHE_MAX', '10000'))
+GEOIP_CACHE_TTL_SEGUNDOS = int(os.getenv('GEOIP_CACHE_TTL_SEGUNDOS', str(6 * 3600)))
+# Falhas (timeout, API fora) ficam pouco tempo no cache para não travar cada clique
+GEOIP_CACHE_NEGATIVO_SEGUNDOS = int(os.getenv('GEOIP_CACHE_NEGATIVO_SEGUNDOS', '60'))
+# 'ip' = chave pelo IP exato | 'rede' = chave por /24 (IPv4) ou /48 (IPv6)
+GEOIP_CACHE_CHAVE = os.getenv('GEOIP_CACHE_CHAVE', 'ip')
+
+GEOIP_CAMPOS = 'status,message,countryCode,regionName,city,isp,org,zip'
+
+# 'remoto' = só ip-api | 'local' = base de faixas de IP local, com a ip-api como fallback
+GEOIP_BACKEND = os.getenv('GEOIP_BACKEND', 'remoto')
+# CSV com: ip_inicio,ip_fim,pais,regiao,cidade,provedor[,cep] (IPs em texto ou inteiro)
+GEOIP_LOCAL_CSV = os.getenv('GEOIP_LOCAL_CSV', '')
+
+GEOIP_STATS = {
+    "hits": 0, "misses": 0, "hits_negativos": 0, "coalescidos": 0,
+    "consultas_remotas": 0, "erros": 0, "latencia_remota_ms_total": 0.0,
+    "hits_locais": 0, "faltas_locais": 0
+}
+
+RESULTADO_ERRO = {"local": "N/A", "rede": "N/A", "zip": ""}
+RESULTADO_DESCONHECIDO = {"local": "Local Desconhecido", "rede": "N/A", "zip": ""}
+
+_CACHE = OrderedDict()
+_EM_ANDAMENTO = {}
+_LOCK = threading.Lock()
+_SESSAO = None
+_SESSAO_PID = None
+
+
+def _contar(chave, quantidade=1):
+    with _LOCK:
+        GEOIP_STATS[chave] += quantidade
+
+
+def _get_sessao():
+    """Sessão HTTP reaproveitada (keep-alive) por processo"""
+    global _SESSAO, _SESSAO_PID
+    pid = os.getpid()
+    if _SESSAO is None or _SESSAO_PID != pid:
+        # requests só é importado na primeira consulta remota (~100 ms a menos na subida)
+        import requests
+        _SESSAO = requests.Session()
+        _SESSAO_PID = pid
+    return _SESSAO
+
+
+def _chave_cache(ip_address):
+    if GEOIP_CACHE_CHAVE != 'rede':
+        return ip_address
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return ip_address
+    prefixo = 24 if ip.version == 4 else 48
+    return str(ipaddress.ip_network(f"{ip}/{prefixo}", strict=False))
+
+
+def _ler_cache(chave):
+    with _LOCK:
+        entrada = _CACHE.get(chave)
+        if entrada is None:
+            return None
+        expira_em, valor, negativo = entrada
+        if expira_em < time.monotonic():
+            del _CACHE[chave]
+            return None
+        _CACHE.move_to_end(chave)
+        return valor, negativo
+
+
+def _gravar_cache(chave, valor, negativo):
+    ttl = GEOIP_CACHE_NEGATIVO_SEGUNDOS if negativo else GEOIP_CACHE_TTL_SEGUNDOS
+    with _LOCK:
+        _CACHE[chave] = (time.monotonic() + ttl, valor, negativo)
+        _CACHE.move_to_end(chave)
+        while len(_CACHE) > GEOIP_CACHE_MAX:
+            _CACHE.popitem(last=False)
+
+
+def _url_api(ip_address):
+    return f'{GEOIP_API_URL}{ip_address}?fields={GEOIP_CAMPOS}'
+
+
+def _interpretar_resposta(data):
+    if data['status'] == 'success':
+        local_base = f"{data['city']}/{data['regionName']} ({data['countryCode']})"
+        detalhe_rede = data['org'] if data['org'] else data['isp']
+        if data['isp'] and data['isp'] != data['org']:
+            detalhe_rede = f"{data['isp']} ({data['org']})"
+
+        return {
+            "local": local_base,
+            "rede": detalhe_rede,
+            "zip": data['zip']
+        }
+    return dict(RESULTADO_DESCONHECIDO)
+
+
+def _consultar_api(ip_address):
+    """Consulta a ip-api. Retorna (resultado, falhou)"""
+    inicio = time.perf_counter()
+    _contar("consultas_remotas")
+    try:
+        response = _get_sessao().get(_url_api(ip_address), timeout=GEOIP_TIMEOUT_SEGUNDOS)
+        return _interpretar_resposta(response.json()), False
+    except Exception as e:
+        _contar("erros")
+        logger.warning("Erro no GeoIP: %s", e, extra={"ip": ip_address})
+        return dict(RESULTADO_ERRO), True
+    finally:
+        duracao = time.perf_counter() - inicio
+        _contar("latencia_remota_ms_total", duracao * 1000)
+        GEOIP_CONSULTA.observe(duracao, modo='sync')
+
+
+# --- BACKEND LOCAL (faixas de IP ordenadas + bisect) ---
+# Inícios/fins das faixas ficam em arrays de inteiros compactos; cada faixa aponta
+# para um registro de texto deduplicado (muitas faixas compartilham cidade/provedor).
+_BASE_LOCAL = None
+_BASE_LOCAL_LOCK = threading.Lock()
+
+
+def _ip_para_int(valor):
+    valor = valor.strip()
+    if valor.isdigit():
+        return int(valor), None
+    ip = ipaddress.ip_address(valor)
+    return int(ip), ip.version
+
+
+def carregar_base_local(caminho):
+    """
+    Lê o CSV de faixas linha a linha (sem carregar o arquivo inteiro) e monta
+    as tabelas ordenadas de IPv4 e IPv6.
+    """
+    registros = []
+    indice_registros = {}
+    tabelas = {
+        4: {"inicios": array('L'), "fins": array('L'), "registros": array('L')},
+        # IPv6 não cabe em 64 bits: usa listas de int
+        6: {"inicios": [], "fins": [], "registros": array('L')},
+    }
+
+    with open(caminho, newline='', encoding='utf-8') as arquivo:
+        for linha in csv.reader(arquivo):
+            if not linha or linha[0].startswith('#'):
+                continue
+            try:
+                inicio, versao = _ip_para_int(linha[0])
+                fim, _ = _ip_para_int(linha[1])
+            except ValueError:
+                # Cabeçalho ou linha inválida
+                continue
+            if versao is None:
+                versao = 4 if fim <= 0xFFFFFFFF else 6
+
+            campos = tuple(c.strip() for c in linha[2:7])
+            campos += ('',) * (5 - len(campos))
+            posicao = indice_registros.get(campos)
+            if posicao is None:
+                posicao = len(registros)
+                indice_registros[campos] = posicao
+                registros.append(campos)
+
+            tabela = tabelas[versao]
+            tabela["inicios"].append(inicio)
+            tabela["fins"].append(fim)
+            tabela["registros"].append(posicao)
+
+    for tabela in tabelas.values():
+        inicios = tabela["inicios"]
+        if any(inicios[i] > inicios[i + 1] for i in range(len(inicios) - 1)):
+            ordem = sorted(range(len(inicios)), key=inicios.__getitem__)
+            for nome in ("inicios", "fins", "registros"):
+                coluna = tabela[nome]
+                ordenada = [coluna[i] for i in ordem]
+                tabela[nome] = array(coluna.typecode, ordenada) if isinstance(coluna, array) else ordenada
+
+    logger.info("Base GeoIP local carregada.", extra={
+        "faixas_ipv4": len(tabelas[4]['inicios']), "faixas_ipv6": len(tabelas[6]['inicios']), "locais": len(registros)
+    })
+    return {"tabelas": tabelas, "registros": registros}
+
+
+def _get_base_local():
+    global _BASE_LOCAL
+    if _BASE_LOCAL is None:
+        with _BASE_LOCAL_LOCK:
+            if _BASE_LOCAL is None:
+                try:
+                    _BASE_LOCAL = carregar_base_local(GEOIP_LOCAL_CSV)
+                except Exception as e:
+                    logger.error("Erro ao carregar base GeoIP local: %s", e, extra={"arquivo": GEOIP_LOCAL_CSV})
+                    _BASE_LOCAL = {"tabelas": {}, "registros": []}
+    return _BASE_LOCAL
+
+
+def consultar_base_local(ip_address, base=None):
+    """Resolve o IP na base local. Retorna None se não houver faixa que o contenha"""
+    base = base or _get_base_local()
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+
+    tabela = base["tabelas"].get(ip.version)
+    if not tabela:
+        return None
+
+    numero = int(ip)
+    posicao = bisect.bisect_right(tabela["inicios"], numero) - 1
+    if posicao < 0 or numero > tabela["fins"][posicao]:
+        return None
+
+    pais, regiao, cidade, provedor, cep = base["registros"][tabela["registros"][posicao]]
+    return {
+        "local": f"{cidade}/{regiao} ({pais})",
+        "rede": provedor or "N/A",
+        "zip": cep
+    }
+
+
+def get_location_data_rich(ip_address):
+    """
+    Busca dados enriquecidos de GeoIP.
+    """
+    if GEOIP_BACKEND == 'local' and GEOIP_LOCAL_CSV:
+        resultado = consultar_base_local(ip_address)
+        if resultado is not None:
+            _contar("hits_locais")
+            return resultado
+        _contar("faltas_locais")
+
+    chave = _chave_cache(ip_address)
+
+    em_cache = _ler_cache(chave)
+    if em_cache is not None:
+        valor, negativo = em_cache
+        _contar("hits_negativos" if negativo else "hits")
+        return dict(valor)
+
+    with _LOCK:
+        pendente = _EM_ANDAMENTO.get(chave)
+        dono = pendente is None
+        if dono:
+            pendente = {"pronto": threading.Event(), "valor": None}
+            _EM_ANDAMENTO[chave] = pendente
+
+    if not dono:
+        # Outra thread já está consultando este IP: espera o resultado dela
+        _contar("coalescidos")
+        if pendente["pronto"].wait(GEOIP_TIMEOUT_SEGUNDOS + 1) and pendente["valor"] is not None:
+            return dict(pendente["valor"])
+        return dict(RESULTADO_ERRO)
+
+    _contar("misses")
+    try:
+        valor, falhou = _consultar_api(ip_address)
+        _gravar_cache(chave, valor, falhou)
+        pendente["valor"] = valor
+        return dict(valor)
+    finally:
+        with _LOCK:
+            _EM_ANDAMENTO.pop(chave, None)
+        pendente["pronto"].set()
+
+
+# --- VERSÃO ASYNC (asgi.py) ---
+# Mesmo cache e mesma base local; a consulta remota usa um cliente httpx async e
+# a coalescência é feita com futures do event loop.
+_EM_ANDAMENTO_ASYNC = {}
+
+
+async def _consultar_api_async(ip_address, cliente):
+    inicio = time.perf_counter()
+    _contar("consultas_remotas")
+    try:
+        response = await cliente.get(_url_api(ip_address), timeout=GEOIP_TIMEOUT_SEGUNDOS)
+        return _interpretar_resposta(response.json()), False
+    except Exception as e:
+        _contar("erros")
+        logger.warning("Erro no GeoIP: %s", e, extra={"ip": ip_address})
+        return dict(RESULTADO_ERRO), True
+    finally:
+        duracao = time.perf_counter() - inicio
+        _contar("latencia_remota_ms_total", duracao * 1000)
+        GEOIP_CONSULTA.observe(duracao, modo='async')
+
+
+async def get_location_data_rich_async(ip_address, cliente):
+    """Equivalente async de get_location_data_rich (cliente: httpx.AsyncClient)"""
+    # Só o asgi.py chama esta função; o app WSGI não paga a importação do asyncio
+    import asyncio
+
+    if GEOIP_BACKEND == 'local' and GEOIP_LOCAL_CSV:
+        resultado = consultar_base_local(ip_address)
+        if resultado is not None:
+            _contar("hits_locais")
+            return resultado
+        _contar("faltas_locais")
+
+    chave = _chave_cache(ip_address)
+    em_cache = _ler_cache(chave)
+    if em_cache is not None:
+        valor, negativo = em_cache
+        _contar("hits_negativos" if negativo else "hits")
+        return dict(valor)
+
+    pendente = _EM_ANDAMENTO_ASYNC.get(chave)
+    if pendente is not None:
+        _contar("coalescidos")
+        return dict(await asyncio.shield(pendente))
+
+    _contar("misses")
+    pendente = asyncio.get_running_loop().create_future()
+    _EM_ANDAMENTO_ASYNC[chave] = pendente
+    try:
+        valor, falhou = await _consultar_api_async(ip_address, cliente)
+        _gravar_cache(chave, valor, falhou)
+        pendente.set_result(valor)
+        return dict(valor)
+    except BaseException:
+        pendente.set_result(dict(RESULTADO_ERRO))
+        raise
+    finally:
+        _EM_ANDAMENTO_ASYNC.pop(chave, None)
+
+
+expor_stats('geoip', GEOIP_STATS, 'Cache e consultas GeoIP')
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timezone
+
+# --- LOGGING ESTRUTURADO ---
+# Os módulos usam logging.getLogger(__name__) e passam os dados do evento em
+# extra={...}. LOG_FORMATO=json emite uma linha JSON por evento (com os extras
+# como campos); 'texto' é o formato legível para desenvolvimento.
+LOG_NIVEL = os.getenv('LOG_NIVEL', 'INFO').upper()
+LOG_FORMATO = os.getenv('LOG_FORMATO', 'texto')
+
+# Atributos padrão do LogRecord; o que sobra veio de extra={...}
+_CAMPOS_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _extras(record):
+    return {k: v for k, v in vars(record).items() if k not in _CAMPOS_PADRAO}
+
+
+class FormatoJson(logging.Formatter):
+    def format(self, record):
+        evento = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "nivel": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        evento.update(_extras(record))
+        if record.exc_info:
+            evento["exc"] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+class FormatoTexto(logging.Formatter):
+    def format(self, record):
+        texto = super().format(record)
+        extras = _extras(record)
+        if extras:
+            texto += ' ' + ' '.join(f"{k}={v}" for k, v in extras.items())
+        return texto
+
+
+def configurar_logging():
+    """Configura o logger raiz uma vez por processo (chamado no início do app.py)"""
+    raiz = logging.getLogger()
+    if any(getattr(h, '_merlo', False) for h in raiz.handlers):
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler._merlo = True
+    if LOG_FORMATO == 'json':
+        handler.setFormatter(FormatoJson())
+    else:
+        handler.setFormatter(FormatoTexto('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    raiz.addHandler(handler)
+    raiz.setLevel(LOG_NIVEL)
@@ -0,0 +1,217 @@
+import os
+import time
+import bisect
+import threading
+
+# --- MÉTRICAS (FORMATO PROMETHEUS) ---
+# Contadores e histogramas em memória, por processo, expostos em /metrics.
+# Com METRICS_ATIVO=0 as funções abaixo devolvem objetos nulos: o código
+# instrumentado continua igual e o custo vira uma chamada de método vazia.
+# Os *_STATS que os módulos já mantêm entram como contadores na hora da coleta,
+# sem custo extra no caminho quente.
+METRICS_ATIVO = os.getenv('METRICS_ATIVO', '1') == '1'
+METRICS_PREFIXO = 'merlo_'
+
+# Limites (segundos) dos baldes de latência
+BUCKETS_PADRAO = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_METRICAS = {}
+_COLETORES = []
+_LOCK = threading.Lock()
+
+
+def _chave(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _formatar_labels(chave, extra=()):
+    pares = list(chave) + list(extra)
+    if not pares:
+        return ''
+    texto = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pares
+    )
+    return '{' + texto + '}'
+
+
+def _formatar_numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Cronometro:
+    __slots__ = ('_histograma', '_labels', '_inicio')
+
+    def __init__(self, histograma, labels):
+        self._histograma = histograma
+        self._labels = labels
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histograma.observe(time.perf_counter() - self._inicio, **self._labels)
+        return False
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda):
+        self.nome = nome
+        self.ajuda = ajuda
+        self._valores = {}
+
+    def inc(self, valor=1, **labels):
+        chave = _chave(labels)
+        with _LOCK:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def amostras(self):
+        with _LOCK:
+            itens = list(self._valores.items())
+        for chave, valor in itens:
+            yield self.nome, chave, valor
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, buckets=BUCKETS_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.buckets = tuple(sorted(buckets))
+        # chave -> [contagem por balde (não cumulativa, +1 para o +Inf), soma, total]
+        self._series = {}
+
+    def observe(self, valor, **labels):
+        chave = _chave(labels)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with _LOCK:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def tempo(self, **labels):
+        """with histograma.tempo(rota='/'): ... observa a duração do bloco"""
+        return _Cronometro(self, labels)
+
+    def amostras(self):
+        with _LOCK:
+            series = [(chave, list(s[0]), s[1], s[2]) for chave, s in self._series.items()]
+        for chave, contagens, soma, total in series:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float('inf'),), contagens):
+                acumulado += contagem
+                yield self.nome + '_bucket', chave + (('le', _formatar_numero(float(limite))),), acumulado
+            yield self.nome + '_sum', chave, soma
+            yield self.nome + '_count', chave, total
+
+
+class _CronometroNulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _MetricaNula:
+    __slots__ = ()
+    _cronometro = _CronometroNulo()
+
+    def inc(self, valor=1, **labels):
+        pass
+
+    def observe(self, valor, **labels):
+        pass
+
+    def tempo(self, **labels):
+        return self._cronometro
+
+
+_NULA = _MetricaNula()
+
+
+def _registrar(classe, nome, *args):
+    if not METRICS_ATIVO:
+        return _NULA
+    nome = METRICS_PREFIXO + nome
+    with _LOCK:
+        if nome not in _METRICAS:
+            _METRICAS[nome] = classe(nome, *args)
+        return _METRICAS[nome]
+
+
+def contador(nome, ajuda):
+    """Contador monotônico (registrado uma vez, reaproveitado se o nome repetir)"""
+    return _registrar(Contador, nome, ajuda)
+
+
+def histograma(nome, ajuda, buckets=BUCKETS_PADRAO):
+    return _registrar(Histograma, nome, ajuda, buckets)
+
+
+def gauge(nome, ajuda, fn):
+    """Valor lido só na coleta: fn() devolve um número ou {labels(dict como tupla): valor}"""
+    if METRICS_ATIVO:
+        _COLETORES.append(('gauge', METRICS_PREFIXO + nome, ajuda, fn))
+
+
+def expor_stats(prefixo, stats, ajuda):
+    """Publica um dicionário *_STATS existente como contadores <prefixo>_<chave>_total"""
+    if METRICS_ATIVO:
+        _COLETORES.append(('stats', METRICS_PREFIXO + prefixo, ajuda, lambda: stats))
+
+
+def _coletar_externos():
+    for tipo, nome, ajuda, fn in list(_COLETORES):
+        try:
+            valor = fn()
+        except Exception:
+            continue
+        if tipo == 'gauge':
+            yield nome, 'gauge', ajuda, [
+                (nome, chave, v) for chave, v in (valor.items() if isinstance(valor, dict) else [((), valor)])
+            ]
+        else:
+            for chave, v in list(valor.items()):
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    serie = f"{nome}_{chave}" if chave.endswith('_total') else f"{nome}_{chave}_total"
+                    yield serie, 'counter', f"{ajuda} ({chave})", [(serie, (), v)]
+
+
+def exportar():
+    """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4)"""
+    linhas = []
+    with _LOCK:
+        metricas = list(_METRICAS.values())
+
+    familias = [(m.nome, m.tipo, m.ajuda, m.amostras()) for m in metricas]
+    familias.extend(_coletar_externos())
+
+    for nome, tipo, ajuda, amostras in familias:
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} {tipo}")
+        for nome_amostra, chave, valor in amostras:
+            linhas.append(f"{nome_amostra}{_formatar_labels(chave)} {_formatar_numero(valor)}")
+    return '\n'.join(linhas) + '\n'
+
+
+# Métricas compartilhadas entre os módulos
+HTTP_LATENCIA = histograma('http_requisicao_segundos', 'Latência por rota')
+DB_CONEXAO = histograma('db_conexao_segundos', 'Tempo com a conexão emprestada, por operação')
+DB_ESPERA_POOL = histograma('db_espera_pool_segundos', 'Espera por uma conexão livre no pool')
+DB_ERROS = contador('db_erros_total', 'Operações de banco que terminaram em erro')
+DB_CONEXOES_ABERTAS = contador('db_conexoes_abertas_total', 'Conexões novas abertas com o Postgres')
+GEOIP_CONSULTA = histograma('geoip_consulta_segundos', 'Consultas GeoIP remotas')
+EMAIL_ENVIO = histograma('email_envio_segundos', 'Chamadas ao Resend, por resultado')
+TEMPLATE_RENDER = histograma('template_render_segundos', 'Renderização de templates Jinja')
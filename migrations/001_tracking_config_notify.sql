@@ -0,0 +1,19 @@
+-- Avisa os workers do tracker (LISTEN tracking_config_changed) sempre que o
+-- My Ô altera as configurações de tracking de um site.
+-- O payload é o site_source alterado; ver db_utils._loop_listener_settings.
+
+CREATE OR REPLACE FUNCTION notify_tracking_config_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('tracking_config_changed', COALESCE(NEW.site_source, ''));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tracking_config_changed ON users;
+
+CREATE TRIGGER trg_tracking_config_changed
+    AFTER UPDATE OF tracking_config, site_source ON users
+    FOR EACH ROW
+    WHEN (OLD.tracking_config IS DISTINCT FROM NEW.tracking_config
+          OR OLD.site_source IS DISTINCT FROM NEW.site_source)
+    EXECUTE FUNCTION notify_tracking_config_changed();
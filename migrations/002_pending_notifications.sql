@@ -0,0 +1,12 @@
+-- Balde de cliques compartilhado entre os workers (CLICK_BUFFER_BACKEND=postgres).
+-- Os cliques ficam aqui até o envio do e-mail; ver click_buffer.py.
+
+CREATE TABLE IF NOT EXISTS pending_notifications (
+    id          BIGSERIAL PRIMARY KEY,
+    site_source TEXT        NOT NULL,
+    payload     JSONB       NOT NULL,
+    created_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_pending_notifications_site
+    ON pending_notifications (site_source, id);
@@ -0,0 +1,17 @@
+-- Outbox de e-mails: o site só grava aqui e a thread de envio (notifications.py)
+-- manda pelo Resend, com retentativa e backoff exponencial.
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id                   BIGSERIAL PRIMARY KEY,
+    payload              JSONB       NOT NULL,
+    status               TEXT        NOT NULL DEFAULT 'pendente',  -- pendente | enviado | falhou
+    tentativas           INTEGER     NOT NULL DEFAULT 0,
+    proxima_tentativa_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    ultimo_erro          TEXT,
+    created_at           TIMESTAMPTZ NOT NULL DEFAULT now(),
+    enviado_em           TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_pendentes
+    ON email_outbox (proxima_tentativa_em, id)
+    WHERE status = 'pendente';
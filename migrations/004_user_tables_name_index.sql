@@ -0,0 +1,13 @@
+-- Busca de tabela por nome exato, sem acento e sem diferenciar maiúsculas
+-- (db_utils.resolve_table_ids). O = ANY usa o índice B-tree de expressão.
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() não é IMMUTABLE (depende do search_path), então não pode ir num
+-- índice de expressão. O wrapper fixa o dicionário e pode.
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS $$
+    SELECT public.unaccent('public.unaccent', $1)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+CREATE INDEX IF NOT EXISTS idx_user_tables_display_name_norm
+    ON user_tables (lower(f_unaccent(btrim(display_name))));
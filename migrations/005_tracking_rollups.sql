@@ -0,0 +1,29 @@
+-- Contagens agregadas de tracking_events por hora e por dia.
+-- Incrementadas na mesma transação que grava cada lote de eventos
+-- (db_utils._atualizar_rollups); /api/stats lê só desta tabela.
+
+CREATE TABLE IF NOT EXISTS tracking_rollups (
+    granularidade TEXT      NOT NULL,  -- hora | dia
+    periodo       TIMESTAMP NOT NULL,  -- início da hora/dia (mesmo fuso de tracking_events.created_at)
+    site_source   TEXT      NOT NULL,
+    botao         TEXT      NOT NULL DEFAULT '',
+    pagina_origem TEXT      NOT NULL DEFAULT '',
+    dispositivo   TEXT      NOT NULL DEFAULT '',
+    localizacao   TEXT      NOT NULL DEFAULT '',
+    total         BIGINT    NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularidade, periodo, site_source, botao, pagina_origem, dispositivo, localizacao)
+);
+
+CREATE INDEX IF NOT EXISTS idx_tracking_rollups_consulta
+    ON tracking_rollups (site_source, granularidade, periodo);
+
+-- Carga inicial a partir do histórico (rodar uma vez, antes de subir o código novo)
+INSERT INTO tracking_rollups (granularidade, periodo, site_source, botao, pagina_origem, dispositivo, localizacao, total)
+SELECT g.granularidade,
+       date_trunc(CASE g.granularidade WHEN 'hora' THEN 'hour' ELSE 'day' END, e.created_at),
+       COALESCE(e.site_source, ''), COALESCE(e.botao, ''), COALESCE(e.pagina_origem, ''),
+       COALESCE(e.dispositivo, ''), COALESCE(e.localizacao, ''), count(*)
+FROM tracking_events e
+CROSS JOIN (VALUES ('hora'), ('dia')) AS g(granularidade)
+GROUP BY 1, 2, 3, 4, 5, 6, 7
+ON CONFLICT DO NOTHING;
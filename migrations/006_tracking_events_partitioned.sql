@@ -0,0 +1,47 @@
+-- Converte tracking_events numa tabela particionada por mês (RANGE em created_at).
+-- A tabela atual vira a partição "legada", cobrindo tudo até o fim do mês corrente;
+-- partitions.py cria as próximas partições e aplica a retenção pelo /api/cron-job.
+-- Rodar numa janela tranquila: o ATTACH valida todas as linhas da tabela antiga.
+
+BEGIN;
+
+-- Chave de partição não aceita NULL
+UPDATE tracking_events SET created_at = now() WHERE created_at IS NULL;
+ALTER TABLE tracking_events ALTER COLUMN created_at SET NOT NULL;
+
+ALTER TABLE tracking_events RENAME TO tracking_events_legacy;
+
+CREATE TABLE tracking_events (LIKE tracking_events_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (created_at);
+
+-- O LIKE copia o DEFAULT nextval(...), mas a sequência continua pertencendo à
+-- coluna da tabela antiga: sem isso, o DROP da partição legada (retenção) falha
+-- porque o DEFAULT da tabela nova depende da sequência que iria junto
+DO $$
+DECLARE
+    sequencia text := pg_get_serial_sequence('tracking_events_legacy', 'id');
+BEGIN
+    IF sequencia IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY tracking_events.id', sequencia);
+    END IF;
+END
+$$;
+
+DO $$
+DECLARE
+    fim_legado timestamp := date_trunc('month', now()) + interval '1 month';
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE tracking_events ATTACH PARTITION tracking_events_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+        fim_legado
+    );
+END
+$$;
+
+-- Rede de segurança para linhas fora de qualquer partição (ex.: relógio adiantado)
+CREATE TABLE IF NOT EXISTS tracking_events_default PARTITION OF tracking_events DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_tracking_events_site_created
+    ON tracking_events (site_source, created_at);
+
+COMMIT;
@@ -0,0 +1,18 @@
+-- Bancos que já aplicaram a 006 antes da correção: a sequência do id ainda
+-- pertence a tracking_events_legacy.id e o DROP dessa partição pela retenção
+-- (partitions.py) falha. Passa a sequência para a tabela particionada.
+-- Idempotente; sem a partição legada (006 não aplicada ou já removida), não faz nada.
+
+DO $$
+DECLARE
+    sequencia text;
+BEGIN
+    IF to_regclass('tracking_events_legacy') IS NULL THEN
+        RETURN;
+    END IF;
+    sequencia := pg_get_serial_sequence('tracking_events_legacy', 'id');
+    IF sequencia IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY tracking_events.id', sequencia);
+    END IF;
+END
+$$;
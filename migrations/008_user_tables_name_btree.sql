@@ -0,0 +1,8 @@
+-- Bancos que aplicaram a 004 quando a busca era por substring (LIKE '%nome%'
+-- com índice trigram): a busca agora é pelo nome exato normalizado, atendida
+-- por um B-tree de expressão. Idempotente.
+
+CREATE INDEX IF NOT EXISTS idx_user_tables_display_name_norm
+    ON user_tables (lower(f_unaccent(btrim(display_name))));
+
+DROP INDEX IF EXISTS idx_user_tables_display_name_norm_trgm;
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from db_utils import db_cursor
+from background import submit_background
+from metrics import EMAIL_ENVIO, TEMPLATE_RENDER, expor_stats
+
+logger = logging.getLogger(__name__)
+
+# --- ENVIO DE E-MAIL (OUTBOX) ---
+# Quem precisa mandar e-mail só grava na tabela email_outbox (rápido) e acorda o
+# sender. Uma thread por worker retira os pendentes com SKIP LOCKED, chama o
+# Resend e, se falhar, reagenda com backoff exponencial.
+# Ver migrations/003_email_outbox.sql. Para testes, RESEND_API_URL aponta o
+# SDK do Resend para um servidor fake local.
+EMAIL_MAX_TENTATIVAS = int(os.getenv('EMAIL_MAX_TENTATIVAS', '8'))
+EMAIL_BACKOFF_BASE_SEGUNDOS = float(os.getenv('EMAIL_BACKOFF_BASE_SEGUNDOS', '30'))
+EMAIL_BACKOFF_MAX_SEGUNDOS = float(os.getenv('EMAIL_BACKOFF_MAX_SEGUNDOS', '3600'))
+# Mesmo sem aviso de novo e-mail, o sender olha a tabela nesse intervalo (retentativas, outros workers)
+EMAIL_POLL_SEGUNDOS = float(os.getenv('EMAIL_POLL_SEGUNDOS', '30'))
+
+EMAIL_STATS = {"enfileirados": 0, "enviados": 0, "falhas": 0, "desistencias": 0, "envios_diretos": 0}
+_STATS_LOCK = threading.Lock()
+
+# Templates compilados uma vez por processo (o Environment guarda o código gerado)
+_JINJA_EMAIL = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False,
+)
+
+# SDK do Resend (e o httpx que ele puxa) carregado no primeiro envio, não na subida
+_RESEND = None
+
+_ACORDAR_SENDER = threading.Event()
+_SENDER_PID = None
+_SENDER_LOCK = threading.Lock()
+
+
+def _contar(chave, quantidade=1):
+    with _STATS_LOCK:
+        EMAIL_STATS[chave] += quantidade
+
+
+def render_email(template, **contexto):
+    """Renderiza um template de templates/email"""
+    with TEMPLATE_RENDER.tempo(template=f"email/{template}"):
+        return _JINJA_EMAIL.get_template(template).render(**contexto)
+
+
+def _get_resend():
+    global _RESEND
+    if _RESEND is None:
+        import resend
+        resend.api_key = os.getenv('RESEND_API_KEY')
+        _RESEND = resend
+    return _RESEND
+
+
+def _enviar_resend(params):
+    inicio = time.perf_counter()
+    resultado = 'erro'
+    try:
+        _get_resend().Emails.send(params)
+        resultado = 'ok'
+    finally:
+        EMAIL_ENVIO.observe(time.perf_counter() - inicio, resultado=resultado)
+
+
+def _enviar_direto(params):
+    # Fallback quando o banco está fora: tenta uma vez, fora da requisição
+    _enviar_resend(params)
+    _contar("envios_diretos")
+    logger.info("E-mail enviado sem outbox (banco indisponível).")
+
+
+def enfileirar_email(params):
+    """
+    Grava o e-mail (params do resend.Emails.send) no outbox e acorda o sender.
+    Se o banco estiver fora, agenda um envio direto em background.
+    Retorna True se o e-mail foi aceito por algum dos caminhos.
+    """
+    try:
+        with db_cursor(commit=True, operacao='email_outbox') as cur:
+            cur.execute("INSERT INTO email_outbox (payload) VALUES (%s)", (json.dumps(params),))
+    except Exception as e:
+        logger.warning("Outbox indisponível (%s). Enviando e-mail direto em background.", e)
+        return submit_background(_enviar_direto, params)
+
+    _contar("enfileirados")
+    _garantir_sender()
+    _ACORDAR_SENDER.set()
+    return True
+
+
+def _backoff(tentativas):
+    return min(EMAIL_BACKOFF_BASE_SEGUNDOS * 2 ** (tentativas - 1), EMAIL_BACKOFF_MAX_SEGUNDOS)
+
+
+def _processar_um():
+    """
+    Envia o próximo e-mail pendente. A linha fica travada (FOR UPDATE SKIP LOCKED)
+    durante o envio, então dois workers nunca mandam o mesmo e-mail.
+    Retorna False quando não há nada pendente.
+    """
+    with db_cursor(commit=True, operacao='email_outbox') as cur:
+        cur.execute("""
+            SELECT id, payload, tentativas FROM email_outbox
+            WHERE status = 'pendente' AND proxima_tentativa_em <= now()
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        linha = cur.fetchone()
+        if not linha:
+            return False
+
+        email_id, payload, tentativas = linha
+        params = payload if isinstance(payload, dict) else json.loads(payload)
+        tentativas += 1
+
+        try:
+            _enviar_resend(params)
+        except Exception as e:
+            _contar("falhas")
+            if tentativas >= EMAIL_MAX_TENTATIVAS:
+                _contar("desistencias")
+                logger.error("E-mail desistido: %s", e, extra={"email_id": email_id, "tentativas": tentativas})
+                cur.execute("""
+                    UPDATE email_outbox SET status = 'falhou', tentativas = %s, ultimo_erro = %s
+                    WHERE id = %s
+                """, (tentativas, str(e)[:500], email_id))
+            else:
+                espera = _backoff(tentativas)
+                logger.warning("Falha ao enviar e-mail. Nova tentativa em %.0fs: %s", espera, e,
+                               extra={"email_id": email_id, "tentativas": tentativas})
+                cur.execute("""
+                    UPDATE email_outbox
+                    SET tentativas = %s, ultimo_erro = %s,
+                        proxima_tentativa_em = now() + make_interval(secs => %s)
+                    WHERE id = %s
+                """, (tentativas, str(e)[:500], espera, email_id))
+            return True
+
+        cur.execute("""
+            UPDATE email_outbox SET status = 'enviado', tentativas = %s, enviado_em = now(), ultimo_erro = NULL
+            WHERE id = %s
+        """, (tentativas, email_id))
+        _contar("enviados")
+        logger.info("E-mail enviado (outbox).", extra={"email_id": email_id})
+        return True
+
+
+def _loop_sender():
+    while True:
+        _ACORDAR_SENDER.wait(EMAIL_POLL_SEGUNDOS)
+        _ACORDAR_SENDER.clear()
+        try:
+            while _processar_um():
+                pass
+        except Exception as e:
+            logger.error("Erro no sender de e-mail: %s", e)
+            time.sleep(min(EMAIL_POLL_SEGUNDOS, 5))
+
+
+def _garantir_sender():
+    """Sobe a thread de envio do processo atual (uma vez por worker)"""
+    global _SENDER_PID
+    pid = os.getpid()
+    if _SENDER_PID == pid:
+        return
+    with _SENDER_LOCK:
+        if _SENDER_PID == pid:
+            return
+        _SENDER_PID = pid
+    threading.Thread(target=_loop_sender, name="email-sender", daemon=True).start()
+
+
+def acordar_sender():
+    """Garante o sender deste worker e pede uma varredura do outbox (chamado pelo cron)"""
+    _garantir_sender()
+    _ACORDAR_SENDER.set()
+
+
+expor_stats('email', EMAIL_STATS, 'Outbox de e-mail')
@@ -0,0 +1,161 @@
+import os
+import gzip
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask import g, request, session, make_response, current_app
+
+from metrics import expor_stats
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# --- CACHE DE PÁGINAS RENDERIZADAS ---
+# As páginas de marketing são renderizadas com argumentos fixos: guardamos o HTML
+# pronto (e as versões gzip/brotli) com ETag forte, e respondemos 304 quando o
+# navegador já tem a mesma versão. A chave inclui o mtime dos templates, então
+# editar um .html invalida tudo sem reiniciar. A chave é (site, caminho): a query
+# string (utm_*, fbclid) e o Host exato não mudam o HTML, e o template não lê
+# request.url para que isso continue verdade.
+PAGE_CACHE_ATIVO = os.getenv('PAGE_CACHE_ATIVO', '1') == '1'
+PAGE_CACHE_MAX = int(os.getenv('PAGE_CACHE_MAX', '200'))
+PAGE_CACHE_MAX_AGE = int(os.getenv('PAGE_CACHE_MAX_AGE', '300'))
+# Intervalo mínimo entre verificações de mtime dos templates
+PAGE_CACHE_CHECK_SEGUNDOS = float(os.getenv('PAGE_CACHE_CHECK_SEGUNDOS', '2'))
+# Corpos menores que isso não compensam compressão
+PAGE_CACHE_MIN_COMPRESSAO = 512
+# A compressão roda no miss, dentro da requisição: brotli q11/gzip 9 custam dezenas
+# de ms por página para poucos % de ganho sobre os níveis médios
+PAGE_CACHE_BROTLI_QUALIDADE = int(os.getenv('PAGE_CACHE_BROTLI_QUALIDADE', '5'))
+PAGE_CACHE_GZIP_NIVEL = int(os.getenv('PAGE_CACHE_GZIP_NIVEL', '6'))
+
+PAGE_CACHE_STATS = {"hits": 0, "misses": 0, "nao_modificados": 0}
+
+_PAGINAS = OrderedDict()
+_LOCK = threading.Lock()
+_VERSAO_TEMPLATES = {"valor": None, "checado_em": 0.0}
+_PASTA_TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def _versao_templates():
+    """Maior mtime da pasta de templates (base.html é herdado por todas as páginas)"""
+    agora = time.monotonic()
+    if agora - _VERSAO_TEMPLATES["checado_em"] < PAGE_CACHE_CHECK_SEGUNDOS:
+        return _VERSAO_TEMPLATES["valor"]
+
+    maior = 0.0
+    for raiz, _, arquivos in os.walk(_PASTA_TEMPLATES):
+        for nome in arquivos:
+            try:
+                maior = max(maior, os.path.getmtime(os.path.join(raiz, nome)))
+            except OSError:
+                pass
+    _VERSAO_TEMPLATES["valor"] = maior
+    _VERSAO_TEMPLATES["checado_em"] = agora
+    return maior
+
+
+def _montar_entrada(corpo, status, mimetype):
+    etag = hashlib.sha256(corpo).hexdigest()[:32]
+    variantes = {None: corpo}
+    if len(corpo) >= PAGE_CACHE_MIN_COMPRESSAO:
+        variantes['gzip'] = gzip.compress(corpo, compresslevel=PAGE_CACHE_GZIP_NIVEL)
+        if brotli is not None:
+            variantes['br'] = brotli.compress(corpo, quality=PAGE_CACHE_BROTLI_QUALIDADE)
+    return {"etag": etag, "variantes": variantes, "status": status, "mimetype": mimetype}
+
+
+def _escolher_encoding(entrada):
+    aceitos = request.headers.get('Accept-Encoding', '')
+    if 'br' in entrada["variantes"] and 'br' in aceitos:
+        return 'br'
+    if 'gzip' in entrada["variantes"] and 'gzip' in aceitos:
+        return 'gzip'
+    return None
+
+
+def _etag_variante(entrada, encoding):
+    # ETag forte precisa mudar junto com o Content-Encoding
+    return entrada["etag"] if encoding is None else f"{entrada['etag']}-{encoding}"
+
+
+def _responder(entrada):
+    encoding = _escolher_encoding(entrada)
+    etag = _etag_variante(entrada, encoding)
+    max_age = PAGE_CACHE_MAX_AGE if entrada["status"] == 200 else 60
+
+    if etag in request.if_none_match:
+        PAGE_CACHE_STATS["nao_modificados"] += 1
+        resp = make_response('', 304)
+    else:
+        resp = make_response(entrada["variantes"][encoding], entrada["status"])
+        resp.mimetype = entrada["mimetype"]
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f"public, max-age={max_age}"
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+
+def _tem_flash_pendente():
+    # Sem cookie de sessão não há flash. Só abrimos a sessão quando ele existe:
+    # ler session marca a resposta com Vary: Cookie e quebra o cache compartilhado
+    if current_app.config['SESSION_COOKIE_NAME'] not in request.cookies:
+        return False
+    return bool(session.get('_flashes'))
+
+
+def _escopo():
+    """Site da requisição (g.tenant) ou, fora do app multi-site, o host"""
+    tenant = getattr(g, 'tenant', None)
+    return tenant.site_source if tenant is not None else request.host
+
+
+def pagina_em_cache(versao=None, por_caminho=True):
+    """
+    Decorator para rotas (e errorhandlers) cujo HTML só depende do site e do caminho.
+    versao: função opcional cujo retorno entra na chave (ex.: data do último
+    refresh do portfólio), invalidando a página quando os dados mudam.
+    por_caminho=False: uma entrada por site, qualquer que seja o caminho (404:
+    caminhos aleatórios não podem encher o cache nem expulsar as páginas reais).
+    """
+    def decorador(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Mensagens flash pendentes entram no HTML: essa renderização não pode ir pro cache
+            if not PAGE_CACHE_ATIVO or request.method != 'GET' or _tem_flash_pendente():
+                return view(*args, **kwargs)
+
+            chave = (view.__name__, _escopo(), request.path if por_caminho else None,
+                     _versao_templates(), versao() if versao else None)
+            with _LOCK:
+                entrada = _PAGINAS.get(chave)
+                if entrada is not None:
+                    _PAGINAS.move_to_end(chave)
+
+            if entrada is None:
+                PAGE_CACHE_STATS["misses"] += 1
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code not in (200, 404) or resp.direct_passthrough:
+                    return resp
+                entrada = _montar_entrada(resp.get_data(), resp.status_code, resp.mimetype)
+                with _LOCK:
+                    _PAGINAS[chave] = entrada
+                    while len(_PAGINAS) > PAGE_CACHE_MAX:
+                        _PAGINAS.popitem(last=False)
+            else:
+                PAGE_CACHE_STATS["hits"] += 1
+
+            return _responder(entrada)
+        return wrapper
+    return decorador
+
+
+expor_stats('page_cache', PAGE_CACHE_STATS, 'Cache de páginas renderizadas')
@@ -0,0 +1,200 @@
+import os
+import re
+import gzip
+import logging
+from datetime import datetime
+
+from db_utils import db_connection
+
+logger = logging.getLogger(__name__)
+
+# --- PARTIÇÕES MENSAIS DE tracking_events ---
+# Com a tabela particionada por created_at (migrations/006), o cron:
+# 1. cria as partições dos próximos meses antes de precisar delas;
+# 2. exporta para CSV gzip (COPY TO em streaming) as partições mais velhas que a
+#    retenção e depois as remove. Uma partição que falha (ex.: DROP bloqueado) não
+#    impede as outras, e o CSV já exportado é reaproveitado na próxima tentativa.
+# O diretório do arquivo precisa ser configurado (disco persistente ou um volume
+# montado do object storage): sem TRACKING_ARQUIVO_DIR nenhuma partição é removida,
+# porque o disco local de um container some no próximo deploy junto com os dados.
+TRACKING_PARTICOES_A_FRENTE = int(os.getenv('TRACKING_PARTICOES_A_FRENTE', '3'))
+# Meses mantidos no banco (contando o atual). 0 desliga a retenção.
+TRACKING_RETENCAO_MESES = int(os.getenv('TRACKING_RETENCAO_MESES', '0'))
+TRACKING_ARQUIVO_DIR = os.getenv('TRACKING_ARQUIVO_DIR', '')
+
+# Chave do advisory lock: só um worker faz a manutenção por vez
+_LOCK_MANUTENCAO = 72031501
+
+_RE_LIMITES = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def _somar_meses(data, meses):
+    total = data.year * 12 + (data.month - 1) + meses
+    return datetime(total // 12, total % 12 + 1, 1)
+
+
+def _nome_particao(inicio):
+    return f"tracking_events_p{inicio:%Y%m}"
+
+
+def _tabela_particionada(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE relname = 'tracking_events' AND relkind = 'p'")
+    return cur.fetchone() is not None
+
+
+def _limite(valor):
+    """'2026-01-01 00:00:00' -> datetime; MINVALUE/MAXVALUE -> None"""
+    if valor.startswith("'"):
+        return datetime.fromisoformat(valor.strip("'")).replace(tzinfo=None)
+    return None
+
+
+def _listar_particoes(cur):
+    """
+    [(nome, limite_inferior, limite_superior)] das partições de faixa de
+    tracking_events (None = MINVALUE/MAXVALUE). A DEFAULT fica de fora.
+    """
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'tracking_events'
+        ORDER BY c.relname
+    """)
+    particoes = []
+    for nome, limites in cur.fetchall():
+        encontrado = _RE_LIMITES.search(limites or '')
+        if encontrado:
+            particoes.append((nome, _limite(encontrado.group(1)), _limite(encontrado.group(2))))
+    return particoes
+
+
+def _particao_que_cobre(particoes, inicio, fim):
+    """Nome da partição existente cuja faixa cruza [inicio, fim), ou None"""
+    for nome, inferior, superior in particoes:
+        if (inferior is None or inferior < fim) and (superior is None or superior > inicio):
+            return nome
+    return None
+
+
+def criar_particoes_futuras(conn, agora=None):
+    """Garante as partições do mês atual e dos próximos N meses. Retorna as que existem ao final"""
+    # Já carregado pelo pool que emprestou conn (ver db_utils._carregar_psycopg2)
+    import psycopg2
+
+    inicio_mes = _somar_meses(agora or datetime.now(), 0)
+    garantidas = []
+    cur = conn.cursor()
+    particoes = _listar_particoes(cur)
+    for i in range(TRACKING_PARTICOES_A_FRENTE + 1):
+        inicio = _somar_meses(inicio_mes, i)
+        fim = _somar_meses(inicio, 1)
+        nome = _nome_particao(inicio)
+        # O mês já tem partição (a do mês, ou a legada da migração 006 cobrindo até o
+        # fim do mês em que ela rodou): o CREATE só falharia de novo a cada cron
+        existente = _particao_que_cobre(particoes, inicio, fim)
+        if existente is not None:
+            if existente not in garantidas:
+                garantidas.append(existente)
+            continue
+        cur.execute("SAVEPOINT particao")
+        try:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {nome} PARTITION OF tracking_events
+                FOR VALUES FROM (%s) TO (%s)
+            """, (inicio, fim))
+            cur.execute("RELEASE SAVEPOINT particao")
+            garantidas.append(nome)
+        except psycopg2.Error as e:
+            # Ex.: linhas desse mês já caíram na DEFAULT
+            cur.execute("ROLLBACK TO SAVEPOINT particao")
+            logger.warning("Partição não criada: %s", e.pgerror or e, extra={"particao": nome})
+    conn.commit()
+    return garantidas
+
+
+def arquivar_particao(conn, nome):
+    """
+    Exporta a partição para <TRACKING_ARQUIVO_DIR>/<nome>.csv.gz via COPY TO em
+    streaming (sem carregar na memória). Retorna o caminho do arquivo.
+    """
+    os.makedirs(TRACKING_ARQUIVO_DIR, exist_ok=True)
+    destino = os.path.join(TRACKING_ARQUIVO_DIR, f"{nome}.csv.gz")
+    temporario = destino + ".parcial"
+    if os.path.exists(destino):
+        # Exportada numa rodada anterior cujo DROP falhou. A partição está fora da
+        # retenção (nenhum evento novo cai nela), então o arquivo continua completo
+        return destino
+
+    cur = conn.cursor()
+    with gzip.open(temporario, 'wt', encoding='utf-8', newline='') as arquivo:
+        cur.copy_expert(f"COPY (SELECT * FROM {nome} ORDER BY created_at) TO STDOUT WITH CSV HEADER", arquivo)
+    conn.rollback()
+
+    # Só depois do arquivo completo no disco é que ele ganha o nome final
+    os.replace(temporario, destino)
+    return destino
+
+
+def aplicar_retencao(conn, agora=None):
+    """Arquiva e remove as partições inteiramente anteriores à janela de retenção"""
+    import psycopg2
+
+    if TRACKING_RETENCAO_MESES <= 0:
+        return []
+    if not TRACKING_ARQUIVO_DIR:
+        logger.error("Retenção de tracking ligada sem TRACKING_ARQUIVO_DIR: nenhuma partição removida.",
+                     extra={"retencao_meses": TRACKING_RETENCAO_MESES})
+        return []
+
+    corte = _somar_meses(agora or datetime.now(), -(TRACKING_RETENCAO_MESES - 1))
+    removidas = []
+    cur = conn.cursor()
+    for nome, _, limite in _listar_particoes(cur):
+        if limite is None or limite > corte:
+            continue
+
+        try:
+            arquivo = arquivar_particao(conn, nome)
+            cur.execute(f"ALTER TABLE tracking_events DETACH PARTITION {nome}")
+            cur.execute(f"DROP TABLE {nome}")
+            conn.commit()
+        except (psycopg2.Error, OSError) as e:
+            # Desfaz só esta partição (o DETACH volta junto) e segue para as próximas
+            conn.rollback()
+            logger.error("Erro ao arquivar/remover partição: %s", getattr(e, 'pgerror', None) or e,
+                         extra={"particao": nome})
+            continue
+        removidas.append(nome)
+        logger.info("Partição arquivada e removida do banco.", extra={"particao": nome, "arquivo": arquivo})
+    conn.rollback()
+    return removidas
+
+
+def manter_particoes():
+    """Rotina chamada pelo /api/cron-job"""
+    try:
+        with db_connection('particoes') as conn:
+            cur = conn.cursor()
+            if not _tabela_particionada(cur):
+                conn.rollback()
+                return {"status": "ignorado", "motivo": "tabela_nao_particionada"}
+
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (_LOCK_MANUTENCAO,))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return {"status": "ignorado", "motivo": "manutencao_em_andamento"}
+            try:
+                conn.commit()
+                garantidas = criar_particoes_futuras(conn)
+                removidas = aplicar_retencao(conn)
+            finally:
+                conn.rollback()
+                cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_MANUTENCAO,))
+                conn.commit()
+
+        return {"status": "ok", "garantidas": garantidas, "removidas": removidas}
+    except Exception as e:
+        logger.error("Erro na manutenção das partições: %s", e)
+        return {"status": "erro"}
@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from db_utils import find_table_id, invalidate_table_ids, iter_sheet_data
+from background import submit_background
+from metrics import gauge, expor_stats
+from tenants import TENANT_PADRAO
+
+logger = logging.getLogger(__name__)
+
+# --- CACHE DO PORTFÓLIO ---
+# Um cache por site (tenant). Um único refresh por vez em cada site (single-flight);
+# enquanto ele roda, todos recebem o valor antigo. O resultado também vai para um
+# snapshot em disco por site, para que os outros workers do gunicorn aproveitem
+# sem ir ao banco. Com muitos sites, os caches menos usados saem da memória (LRU)
+# quando passam de PORTFOLIO_CACHE_MAX_SITES ou PORTFOLIO_CACHE_MAX_BYTES (medido
+# pelo tamanho do JSON); o snapshot em disco continua lá para a próxima visita.
+CACHE_TIMEOUT_HORAS = float(os.getenv('PORTFOLIO_CACHE_HORAS', '1'))
+PORTFOLIO_SNAPSHOT_PATH = os.getenv(
+    'PORTFOLIO_SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), 'merlo_portfolio.json')
+)
+# Só essas chaves do JSON de cada linha saem do banco
+PORTFOLIO_COLUNAS = ['Título', 'Descrição', 'Link do site', 'Logo', 'Tipo']
+# Quanto tempo uma requisição espera pelo primeiro carregamento (cache ainda vazio)
+PORTFOLIO_ESPERA_SEGUNDOS = float(os.getenv('PORTFOLIO_ESPERA_SEGUNDOS', '10'))
+PORTFOLIO_CACHE_MAX_SITES = int(os.getenv('PORTFOLIO_CACHE_MAX_SITES', '200'))
+PORTFOLIO_CACHE_MAX_BYTES = int(os.getenv('PORTFOLIO_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# Depois de uma busca sem resultado (tabela não encontrada ou leitura vazia), as
+# requisições desse site não vão ao banco por este tempo (cache negativo). Erro do
+# banco não entra: a próxima requisição tenta de novo
+PORTFOLIO_NEGATIVO_SEGUNDOS = float(os.getenv('PORTFOLIO_NEGATIVO_SEGUNDOS', '60'))
+
+PORTFOLIO_STATS = {"carregamentos": 0, "despejos": 0, "falhas": 0, "erros": 0}
+
+_CACHES = OrderedDict()
+_CACHES_LOCK = threading.Lock()
+_BYTES_EM_CACHE = 0
+_RENOVACAO_LOCK = threading.Lock()
+
+
+class _CachePortfolio:
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.projetos = []
+        self.atualizado_em = None  # epoch (time.time) do dado em cache
+        self.falhou_em = None  # time.monotonic da última busca sem resultado
+        self.tentativa_em = None  # time.monotonic do fim da última ida ao banco (qualquer resultado)
+        self.tabela_id = None
+        self.bytes = 0
+        self.refresh_lock = threading.Lock()
+        self.snapshot_path = _caminho_snapshot(tenant.site_source)
+
+
+def _caminho_snapshot(site_source):
+    if site_source == TENANT_PADRAO.site_source:
+        return PORTFOLIO_SNAPSHOT_PATH
+    raiz, ext = os.path.splitext(PORTFOLIO_SNAPSHOT_PATH)
+    return f"{raiz}-{hashlib.sha1(site_source.encode('utf-8')).hexdigest()[:12]}{ext or '.json'}"
+
+
+def _despejar_excesso():
+    """Tira da memória os sites menos usados até caber nos limites (chamado com o lock)"""
+    global _BYTES_EM_CACHE
+    while len(_CACHES) > 1 and (len(_CACHES) > PORTFOLIO_CACHE_MAX_SITES or _BYTES_EM_CACHE > PORTFOLIO_CACHE_MAX_BYTES):
+        _, velho = _CACHES.popitem(last=False)
+        _BYTES_EM_CACHE -= velho.bytes
+        PORTFOLIO_STATS["despejos"] += 1
+
+
+def _cache_do_site(tenant):
+    with _CACHES_LOCK:
+        cache = _CACHES.get(tenant.site_source)
+        if cache is None:
+            cache = _CACHES[tenant.site_source] = _CachePortfolio(tenant)
+            _despejar_excesso()
+        else:
+            _CACHES.move_to_end(tenant.site_source)
+    return cache
+
+
+def _guardar(cache, projetos, atualizado_em, tamanho):
+    global _BYTES_EM_CACHE
+    with _CACHES_LOCK:
+        cache.projetos, cache.atualizado_em = projetos, atualizado_em
+        # Já despejado (outro site ocupou a vaga): o valor vale só para quem o pediu
+        if _CACHES.get(cache.tenant.site_source) is cache:
+            _BYTES_EM_CACHE += tamanho - cache.bytes
+            cache.bytes = tamanho
+            _CACHES.move_to_end(cache.tenant.site_source)
+            _despejar_excesso()
+
+
+def _ttl_segundos():
+    return CACHE_TIMEOUT_HORAS * 3600
+
+
+def _fresco(atualizado_em):
+    return atualizado_em is not None and time.time() - atualizado_em < _ttl_segundos()
+
+
+def _falhou_ha_pouco(cache):
+    return cache.falhou_em is not None and time.monotonic() - cache.falhou_em < PORTFOLIO_NEGATIVO_SEGUNDOS
+
+
+def _registrar_falha(cache):
+    cache.falhou_em = time.monotonic()
+    PORTFOLIO_STATS["falhas"] += 1
+
+
+def _logo_url(logo_url):
+    """Converte link de compartilhamento do Google Drive em link direto de imagem"""
+    logo_url = logo_url.strip()
+    if 'drive.google.com' in logo_url and 'id=' in logo_url:
+        try:
+            file_id = logo_url.split('id=')[1].split('&')[0]
+            logo_url = f"https://lh3.googleusercontent.com/d/{file_id}"
+        except Exception:
+            pass
+    return logo_url
+
+
+def _get_tabela_portfolio_id(cache):
+    """ID da tabela do portfólio do site, memorizado (o nome da tabela praticamente não muda)"""
+    if cache.tabela_id is None and cache.tenant.portfolio_tabelas:
+        # As grafias candidatas são resolvidas numa única consulta, pelo nome exato
+        cache.tabela_id = find_table_id(*cache.tenant.portfolio_tabelas)
+    return cache.tabela_id
+
+
+def _ler_snapshot(caminho):
+    """Lê o snapshot gravado por qualquer worker. Retorna (projetos, atualizado_em, bytes) ou None"""
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            conteudo = f.read()
+        snapshot = json.loads(conteudo)
+        return snapshot['projetos'], snapshot['atualizado_em'], len(conteudo)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _gravar_snapshot(caminho, conteudo):
+    # Grava num temporário e troca com os.replace: leitores nunca veem arquivo pela metade
+    try:
+        pasta = os.path.dirname(caminho) or '.'
+        fd, tmp = tempfile.mkstemp(dir=pasta, prefix='.portfolio-', suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(conteudo)
+        os.replace(tmp, caminho)
+    except OSError as e:
+        logger.warning("Não foi possível gravar snapshot do portfólio: %s", e)
+
+
+def _snapshot_mais_novo(cache):
+    """Usa o snapshot do disco se outro worker já atualizou depois da nossa cópia"""
+    try:
+        mtime = os.path.getmtime(cache.snapshot_path)
+    except OSError:
+        return False
+    if cache.atualizado_em is not None and mtime <= cache.atualizado_em:
+        return False
+
+    snapshot = _ler_snapshot(cache.snapshot_path)
+    if not snapshot or not _fresco(snapshot[1]):
+        return False
+    _guardar(cache, *snapshot)
+    return True
+
+
+def _carregar_do_banco(cache):
+    """
+    Busca dados direto do Banco Neon (PostgreSQL).
+    """
+    site_source = cache.tenant.site_source
+    try:
+        logger.info("Buscando portfólio no banco.", extra={"site_source": site_source})
+        portfolio_tab_id = _get_tabela_portfolio_id(cache)
+
+        if not portfolio_tab_id:
+            logger.warning("Tabela Portfolio não encontrada no banco de dados.", extra={"site_source": site_source})
+            _registrar_falha(cache)
+            return cache.projetos or []
+
+        # Consome a tabela em streaming; chaves ausentes no JSON chegam como None
+        final_projects = []
+        for row in iter_sheet_data(portfolio_tab_id, colunas=PORTFOLIO_COLUNAS):
+            titulo = row.get('Título') or ''
+            if not titulo: continue
+
+            # Reescrita do link do Drive feita aqui, uma vez por refresh
+            item = {
+                'Título': titulo.strip(),
+                'Descrição': (row.get('Descrição') or '').strip(),
+                'Link': (row.get('Link do site') or '').strip(),
+                'Logo': _logo_url(row.get('Logo') or ''),
+                'Tipo': (row.get('Tipo') or '').strip()
+            }
+            final_projects.append(item)
+
+        if not final_projects:
+            # Vazio costuma ser erro de leitura ou ID memorizado que ficou inválido:
+            # mantém o cache anterior e resolve o ID de novo no próximo refresh
+            cache.tabela_id = None
+            invalidate_table_ids()
+            _registrar_falha(cache)
+            logger.warning("Portfólio veio vazio do banco. Mantendo cache anterior.", extra={"site_source": site_source})
+            return cache.projetos
+
+        atualizado_em = time.time()
+        # O mesmo JSON vai para o disco e mede quanto o site ocupa no cache
+        conteudo = json.dumps({"atualizado_em": atualizado_em, "projetos": final_projects}, ensure_ascii=False)
+        _guardar(cache, final_projects, atualizado_em, len(conteudo))
+        cache.falhou_em = None
+        _gravar_snapshot(cache.snapshot_path, conteudo)
+        PORTFOLIO_STATS["carregamentos"] += 1
+        logger.info("Portfólio atualizado via DB.", extra={"projetos": len(final_projects), "site_source": site_source})
+
+        return final_projects
+
+    except Exception as e:
+        cache.tabela_id = None
+        PORTFOLIO_STATS["erros"] += 1
+        logger.error("Erro crítico ao buscar portfólio: %s", e, extra={"site_source": site_source})
+        return cache.projetos if cache.projetos else []
+    finally:
+        cache.tentativa_em = time.monotonic()
+
+
+def _refresh_background(cache):
+    try:
+        if not _snapshot_mais_novo(cache):
+            _carregar_do_banco(cache)
+    finally:
+        cache.refresh_lock.release()
+
+
+def get_portfolio_data(force_refresh=False, tenant=None):
+    """
+    Portfólio em cache (stale-while-revalidate) do site (padrão: TENANT_PADRAO).
+    force_refresh=True (cron) recarrega do banco na hora, mesmo com cache negativo.
+    """
+    tenant = tenant or TENANT_PADRAO
+    if not tenant.portfolio_tabelas:
+        # Site sem tabela de portfólio configurada: nada a buscar nem a guardar
+        return []
+    cache = _cache_do_site(tenant)
+
+    if force_refresh:
+        with cache.refresh_lock:
+            return _carregar_do_banco(cache)
+
+    if _fresco(cache.atualizado_em):
+        return cache.projetos
+
+    if _snapshot_mais_novo(cache):
+        return cache.projetos
+
+    if _falhou_ha_pouco(cache):
+        # A última busca não achou nada: sem ir ao banco de novo a cada requisição
+        return cache.projetos
+
+    if cache.atualizado_em is None:
+        # Processo recém-iniciado (ou site despejado): um snapshot vencido ainda serve enquanto o banco responde
+        snapshot = _ler_snapshot(cache.snapshot_path)
+        if snapshot:
+            _guardar(cache, *snapshot)
+
+    if cache.atualizado_em is not None:
+        # Vencido: devolve o valor antigo e deixa um único refresher recarregar
+        if cache.refresh_lock.acquire(blocking=False):
+            if not submit_background(_refresh_background, cache):
+                cache.refresh_lock.release()
+        return cache.projetos
+
+    # Sem nada em cache: só uma requisição vai ao banco, as outras esperam por ela
+    chegada = time.monotonic()
+    if not cache.refresh_lock.acquire(timeout=PORTFOLIO_ESPERA_SEGUNDOS):
+        return cache.projetos
+    try:
+        # Quem esperou na fila aproveita o resultado (ou a falha, ou o erro) de quem foi ao banco
+        if (cache.atualizado_em is not None or _falhou_ha_pouco(cache)
+                or (cache.tentativa_em is not None and cache.tentativa_em >= chegada)):
+            return cache.projetos
+        return _carregar_do_banco(cache)
+    finally:
+        cache.refresh_lock.release()
+
+
+def versao_portfolio(tenant=None):
+    """
+    Versão dos dados do portfólio do site (data do último refresh), usada na chave
+    do cache de páginas. Passa por get_portfolio_data para disparar o refresh quando vencer.
+    """
+    get_portfolio_data(tenant=tenant)
+    return _cache_do_site(tenant or TENANT_PADRAO).atualizado_em
+
+
+def renovar_portfolios(incluir=()):
+    """
+    Recarrega do banco, um site por vez, os portfólios em memória (mais os de
+    incluir). Roda numa única tarefa de background: com muitos sites, o cron não
+    enche o executor. Retorna quantos sites foram renovados (0 se já havia uma
+    renovação em andamento).
+    """
+    if not _RENOVACAO_LOCK.acquire(blocking=False):
+        return 0
+    try:
+        tenants = {t.site_source: t for t in incluir}
+        with _CACHES_LOCK:
+            tenants.update((c.tenant.site_source, c.tenant) for c in _CACHES.values())
+        for tenant in tenants.values():
+            get_portfolio_data(force_refresh=True, tenant=tenant)
+        return len(tenants)
+    finally:
+        _RENOVACAO_LOCK.release()
+
+
+gauge('portfolio_cache_bytes', 'Tamanho (JSON) dos portfólios em memória', lambda: _BYTES_EM_CACHE)
+gauge('portfolio_cache_sites', 'Sites com portfólio em memória', lambda: len(_CACHES))
+expor_stats('portfolio', PORTFOLIO_STATS, 'Carregamentos do banco e despejos do cache de portfólio')
@@ -0,0 +1,151 @@
+import os
+import time
+import ipaddress
+import threading
+from collections import OrderedDict
+
+from metrics import expor_stats
+
+# --- FILTROS DO /api/track-click ---
+# Rodam na requisição, antes de agendar qualquer trabalho em background:
+# 1. dedup: o mesmo (site, uid, botao, pagina_origem, url_destino) dentro de uma janela
+#    curta conta uma vez só (duplo clique, <a><button> aninhados);
+# 2. rate limit: token bucket por IP e por uid (scripts martelando a API). O IP é o
+#    que o proxy confiável viu (app.ip_do_cliente), e um uid recém-criado não vira
+#    chave: sem cookie, cada requisição ganharia um bucket novo e cheio.
+TRACK_DEDUP_SEGUNDOS = float(os.getenv('TRACK_DEDUP_SEGUNDOS', '2'))
+# Acima disso a geração atual do dedup é trocada antes da hora (limite de memória)
+TRACK_DEDUP_MAX = int(os.getenv('TRACK_DEDUP_MAX', '100000'))
+TRACK_RATE_POR_SEGUNDO = float(os.getenv('TRACK_RATE_POR_SEGUNDO', '2'))
+# Rajada permitida; cobre um lote cheio do t.js (20 eventos)
+TRACK_RATE_RAJADA = float(os.getenv('TRACK_RATE_RAJADA', '20'))
+# Buckets guardados (LRU); um bucket esquecido volta cheio, o que só favorece o visitante
+TRACK_RATE_MAX_CHAVES = int(os.getenv('TRACK_RATE_MAX_CHAVES', '50000'))
+
+FILTRO_STATS = {"aceitos": 0, "duplicados": 0, "limitados": 0}
+
+_LOCK = threading.Lock()
+
+
+class ListaDeIPs:
+    """
+    IPs e redes (CIDR) a ignorar. A busca faz um lookup num set por tamanho de
+    prefixo cadastrado, em vez de percorrer a lista.
+    """
+
+    def __init__(self, entradas=()):
+        # (versão, prefixo) -> {endereço de rede como inteiro}
+        self._redes = {}
+        for entrada in entradas:
+            self.adicionar(entrada)
+
+    @classmethod
+    def de_texto(cls, texto):
+        """'177.5.139.35, 10.0.0.0/8' -> ListaDeIPs"""
+        return cls(e.strip() for e in (texto or '').split(',') if e.strip())
+
+    def adicionar(self, entrada):
+        rede = ipaddress.ip_network(entrada, strict=False)
+        self._redes.setdefault((rede.version, rede.prefixlen), set()).add(int(rede.network_address))
+
+    def __contains__(self, ip):
+        try:
+            endereco = ipaddress.ip_address(ip)
+        except (TypeError, ValueError):
+            return False
+        valor = int(endereco)
+        bits = endereco.max_prefixlen
+        for (versao, prefixo), redes in self._redes.items():
+            if versao == endereco.version and (valor >> (bits - prefixo) << (bits - prefixo)) in redes:
+                return True
+        return False
+
+    def __len__(self):
+        return sum(len(r) for r in self._redes.values())
+
+
+class _Dedup:
+    """
+    Conjunto com janela de tempo em duas gerações: uma chave vista na geração
+    atual ou na anterior é duplicada. A cada janela a anterior é descartada,
+    então a memória fica limitada ao tráfego de ~2 janelas.
+    """
+
+    def __init__(self):
+        self._atual = set()
+        self._anterior = set()
+        self._inicio = time.monotonic()
+
+    def visto(self, chave, agora):
+        if agora - self._inicio >= TRACK_DEDUP_SEGUNDOS or len(self._atual) >= TRACK_DEDUP_MAX:
+            # Passou mais de uma janela inteira: a anterior também já venceu
+            velha = agora - self._inicio >= 2 * TRACK_DEDUP_SEGUNDOS
+            self._anterior = set() if velha else self._atual
+            self._atual = set()
+            self._inicio = agora
+        if chave in self._atual or chave in self._anterior:
+            return True
+        self._atual.add(chave)
+        return False
+
+
+class _TokenBuckets:
+    def __init__(self):
+        # chave -> [tokens, última recarga]
+        self._buckets = OrderedDict()
+
+    def consumir(self, chave, agora):
+        bucket = self._buckets.get(chave)
+        if bucket is None:
+            bucket = self._buckets[chave] = [TRACK_RATE_RAJADA, agora]
+            if len(self._buckets) > TRACK_RATE_MAX_CHAVES:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chave)
+            bucket[0] = min(TRACK_RATE_RAJADA, bucket[0] + (agora - bucket[1]) * TRACK_RATE_POR_SEGUNDO)
+            bucket[1] = agora
+
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+
+_DEDUP = _Dedup()
+_BUCKETS = _TokenBuckets()
+
+
+def filtrar_cliques(cliques):
+    """
+    Aplica dedup e rate limit. Retorna (aceitos, motivo) onde motivo é
+    'duplicado' ou 'limite' quando nada passou.
+    """
+    aceitos = []
+    duplicados = limitados = 0
+    agora = time.monotonic()
+
+    with _LOCK:
+        for clique in cliques:
+            # O cookie do uid vale para todos os sites do deploy: o site entra na chave
+            chave = hash((clique.get('site_source'), clique['uid'], clique['botao'], clique['pagina_origem'],
+                          clique['url_destino']))
+            if _DEDUP.visto(chave, agora):
+                duplicados += 1
+                continue
+            # Os dois buckets precisam ter token; o do IP pega quem troca ou descarta o cookie
+            if not (_BUCKETS.consumir('ip:' + str(clique['ip_address']), agora)
+                    and (clique.get('is_new_user') or _BUCKETS.consumir('uid:' + clique['uid'], agora))):
+                limitados += 1
+                continue
+            aceitos.append(clique)
+
+        FILTRO_STATS["aceitos"] += len(aceitos)
+        FILTRO_STATS["duplicados"] += duplicados
+        FILTRO_STATS["limitados"] += limitados
+
+    if aceitos:
+        return aceitos, None
+    return [], 'limite' if limitados else 'duplicado'
+
+
+expor_stats('tracking_filtro', FILTRO_STATS, 'Cliques aceitos e barrados antes do background')
@@ -1,38 +1,90 @@
-document.addEventListener("DOMContentLoaded", function() {
+(function() {
     // Seleciona TUDO que é clicável e importante:
     // .btn (botões padrão), a (links), button (botões de form), .nav-link (menu)
-    const elementosClicaveis = document.querySelectorAll('.btn, .btn-merlo, .btn-pricing, .nav-link, .navbar-brand, .whatsapp-float, a, button');
-
-    elementosClicaveis.forEach(function(elemento) {
-        elemento.addEventListener('click', function(e) {
-            // 1. Identificar o nome do botão
-            let nomeBotao = elemento.innerText.trim();
-
-            // Se não tiver texto (ex: só icone), tenta pegar title ou aria-label
-            if (!nomeBotao) nomeBotao = elemento.getAttribute('title');
-            if (!nomeBotao) nomeBotao = elemento.getAttribute('aria-label');
-
-            // Se for o Whats flutuante e não pegou nome
-            if (elemento.classList.contains('whatsapp-float')) nomeBotao = "WhatsApp Flutuante";
-
-            // Último recurso: mostra o link
-            if (!nomeBotao && elemento.href) nomeBotao = "Link: " + elemento.getAttribute('href');
-            if (!nomeBotao) nomeBotao = "Botão Sem Nome (Icone/Imagem)";
-
-            // 2. Enviar para o Python (Backend) de forma assíncrona
-            // O 'keepalive: true' garante que o envio ocorra mesmo se a página mudar
-            fetch('/api/track-click', {
-                method: 'POST',
-                keepalive: true,
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    botao: nomeBotao,
-                    pagina_origem: window.location.pathname,
-                    url_destino: elemento.getAttribute('href') || 'Ação local'
-                })
-            }).catch(err => console.error("Erro silencioso no tracker:", err));
+    const SELETOR_CLICAVEIS = '.btn, .btn-merlo, .btn-pricing, .nav-link, .navbar-brand, .whatsapp-float, a, button';
+
+    // Os cliques vão para uma fila e são enviados em lote para /api/track-batch:
+    // depois de um tempo sem cliques, quando a fila enche ou quando a página é escondida/fechada.
+    // O endereço é absoluto: nos sites clientes o t.js roda em outro domínio. Vem do
+    // data-endpoint da tag <script> ou, sem ele, do servidor que serviu este arquivo.
+    const SCRIPT_ATUAL = document.currentScript;
+    const ENDPOINT_LOTE = (SCRIPT_ATUAL && SCRIPT_ATUAL.dataset.endpoint) ||
+        new URL('/api/track-batch', SCRIPT_ATUAL ? SCRIPT_ATUAL.src : window.location.href).href;
+    const ESPERA_OCIOSA_MS = 2000;
+    const TAMANHO_MAX_LOTE = 20;
+
+    let fila = [];
+    let timerEnvio = null;
+
+    function nomeDoElemento(elemento) {
+        // 1. Identificar o nome do botão
+        let nomeBotao = (elemento.innerText || '').trim();
+
+        // Se não tiver texto (ex: só icone), tenta pegar title ou aria-label
+        if (!nomeBotao) nomeBotao = elemento.getAttribute('title');
+        if (!nomeBotao) nomeBotao = elemento.getAttribute('aria-label');
+
+        // Se for o Whats flutuante e não pegou nome
+        if (elemento.classList.contains('whatsapp-float')) nomeBotao = "WhatsApp Flutuante";
+
+        // Último recurso: mostra o link
+        if (!nomeBotao && elemento.href) nomeBotao = "Link: " + elemento.getAttribute('href');
+        if (!nomeBotao) nomeBotao = "Botão Sem Nome (Icone/Imagem)";
+
+        return nomeBotao;
+    }
+
+    function enviarFila() {
+        clearTimeout(timerEnvio);
+        timerEnvio = null;
+        if (!fila.length) return;
+
+        const lote = fila;
+        fila = [];
+        const corpo = JSON.stringify({ eventos: lote });
+
+        // sendBeacon sobrevive à troca de página; se o navegador recusar, cai no fetch com keepalive.
+        // text/plain é um tipo "simples": de outro domínio não precisa de preflight (o
+        // servidor lê o JSON assim mesmo). credentials leva o cookie merlo_uid entre sites.
+        if (navigator.sendBeacon && navigator.sendBeacon(ENDPOINT_LOTE, new Blob([corpo], { type: 'text/plain;charset=UTF-8' }))) {
+            return;
+        }
+
+        fetch(ENDPOINT_LOTE, {
+            method: 'POST',
+            keepalive: true,
+            mode: 'cors',
+            credentials: 'include',
+            headers: {
+                'Content-Type': 'text/plain;charset=UTF-8'
+            },
+            body: corpo
+        }).catch(err => console.error("Erro silencioso no tracker:", err));
+    }
+
+    // 2. Um único listener delegado no documento, em vez de um por elemento.
+    // closest() pega só o clicável mais interno, então <a><button> gera um evento só.
+    document.addEventListener('click', function(e) {
+        const elemento = e.target.closest ? e.target.closest(SELETOR_CLICAVEIS) : null;
+        if (!elemento) return;
+
+        fila.push({
+            botao: nomeDoElemento(elemento),
+            pagina_origem: window.location.pathname,
+            url_destino: elemento.getAttribute('href') || 'Ação local'
         });
+
+        if (fila.length >= TAMANHO_MAX_LOTE) {
+            enviarFila();
+        } else {
+            clearTimeout(timerEnvio);
+            timerEnvio = setTimeout(enviarFila, ESPERA_OCIOSA_MS);
+        }
+    }, true);
+
+    // Página indo para segundo plano ou sendo fechada: envia o que sobrou
+    document.addEventListener('visibilitychange', function() {
+        if (document.visibilityState === 'hidden') enviarFila();
     });
-});
\ No newline at end of file
+    window.addEventListener('pagehide', enviarFila);
+})();
@@ -0,0 +1,187 @@
+import os
+import json
+import logging
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# --- SITES (TENANTS) ---
+# Um deploy atende vários sites clientes do My Ô. O site é identificado pelo host:
+# o do Origin (cliques mandados pelo t.js instalado no domínio do cliente) ou o do
+# Host (páginas servidas por aqui). O site_source de cada um é a chave em users,
+# tracking_events, pending_notifications e nos caches por site (configs, balde
+# do e-mail, portfólio). Os sites além do padrão vêm de um JSON, em
+# TENANTS_ARQUIVO (caminho) ou TENANTS_JSON (texto):
+#
+#   [{"site_source": "Cliente X - Site", "hosts": ["clientex.com.br"],
+#     "host_url": "https://clientex.com.br", "email_destino": "contato@clientex.com.br",
+#     "portfolio_tabelas": ["Portfolio Cliente X"],
+#     "origens": ["https://loja.clientex.com.br"]}]
+#
+# O t.js nos sites clientes posta para cá de outro domínio: as rotas de tracking
+# respondem CORS (com credenciais, por causa do cookie merlo_uid) só para as
+# origens dos sites configurados: https://<host> e https://www.<host> de cada
+# host, mais as de "origens". Nesse caso o cookie vai com SameSite=None; Secure.
+#
+# portfolio_tabelas são procuradas pelo nome exato em user_tables (sem diferenciar
+# acento e maiúsculas): 'Portfolio' não casa com 'Portfolio Cliente X', mas o nome
+# precisa ser único entre os clientes. Host desconhecido cai no site padrão (o da Merlô);
+# com TENANTS_ESTRITO=1 os cliques de origem desconhecida são ignorados.
+TENANTS_ARQUIVO = os.getenv('TENANTS_ARQUIVO')
+TENANTS_JSON = os.getenv('TENANTS_JSON')
+TENANTS_ESTRITO = os.getenv('TENANTS_ESTRITO', '0') == '1'
+
+Tenant = namedtuple('Tenant', ['site_source', 'hosts', 'host_url', 'email_destino', 'portfolio_tabelas'])
+
+# Nome do Site para o DB (Deve ser igual ao configurado no My Ô)
+TENANT_PADRAO = Tenant(
+    site_source="Merlô Digital - Site",
+    hosts=('merlodigital.com',),
+    host_url="https://merlodigital.com",
+    email_destino=os.getenv('EMAIL_DESTINO'),
+    portfolio_tabelas=('Portfolio', 'Portfólio'),
+)
+
+# Preflight guardado pelo navegador por um dia
+CORS_MAX_AGE_SEGUNDOS = 86400
+
+_POR_SITE = {}
+_POR_HOST = {}
+_POR_ORIGEM = {}
+
+
+def normalizar_host(host):
+    """'WWW.Cliente.com.br:443' -> 'cliente.com.br' ('www.' e porta não distinguem sites)"""
+    host = (host or '').strip().lower()
+    if host.startswith('['):
+        host = host[1:host.find(']')] if ']' in host else host
+    elif host.count(':') == 1:
+        host = host.split(':')[0]
+    host = host.rstrip('.')
+    return host[4:] if host.startswith('www.') else host
+
+
+def _tenant_de_config(item):
+    if not isinstance(item, dict) or not item.get('site_source'):
+        raise ValueError(f"site inválido (precisa de site_source): {item!r}")
+    hosts = tuple(normalizar_host(h) for h in item.get('hosts', []) if h)
+    host_url = item.get('host_url') or (f"https://{hosts[0]}" if hosts else TENANT_PADRAO.host_url)
+    return Tenant(
+        site_source=item['site_source'],
+        hosts=hosts,
+        host_url=host_url.rstrip('/'),
+        email_destino=item.get('email_destino'),
+        portfolio_tabelas=tuple(item.get('portfolio_tabelas', [])),
+    )
+
+
+def _origens(tenant, extras=()):
+    """Origens (scheme://host, sem barra) de onde o t.js do site pode postar"""
+    origens = {o.rstrip('/').lower() for o in extras if o}
+    for host in tenant.hosts:
+        origens.update((f"https://{host}", f"https://www.{host}"))
+    partes = urlsplit(tenant.host_url)
+    if partes.scheme and partes.netloc:
+        origens.add(f"{partes.scheme}://{partes.netloc}".lower())
+    return origens
+
+
+def _ler_config():
+    if TENANTS_ARQUIVO:
+        with open(TENANTS_ARQUIVO, encoding='utf-8') as f:
+            return json.load(f)
+    if TENANTS_JSON:
+        return json.loads(TENANTS_JSON)
+    return []
+
+
+def carregar_tenants(itens=None):
+    """
+    (Re)monta os mapas host -> site e site_source -> site. itens: lista no
+    formato do JSON; sem ela, lê TENANTS_ARQUIVO/TENANTS_JSON. Retorna quantos
+    sites ficaram registrados (contando o padrão).
+    """
+    global _POR_SITE, _POR_HOST, _POR_ORIGEM
+    if itens is None:
+        try:
+            itens = _ler_config()
+        except (OSError, ValueError) as e:
+            # Config quebrada não derruba o site: segue só com o padrão
+            logger.error("Erro ao ler configuração de sites: %s", e)
+            itens = []
+
+    por_site = {TENANT_PADRAO.site_source: TENANT_PADRAO}
+    por_host = {h: TENANT_PADRAO for h in TENANT_PADRAO.hosts}
+    por_origem = dict.fromkeys(_origens(TENANT_PADRAO), TENANT_PADRAO)
+    for item in itens:
+        try:
+            tenant = _tenant_de_config(item)
+        except ValueError as e:
+            logger.error("Erro na configuração de sites: %s", e)
+            continue
+        por_site[tenant.site_source] = tenant
+        por_origem.update(dict.fromkeys(_origens(tenant, item.get('origens', [])), tenant))
+        for host in tenant.hosts:
+            if host in por_host and por_host[host].site_source != tenant.site_source:
+                logger.warning("Host em mais de um site; vale o último.", extra={"host": host})
+            por_host[host] = tenant
+
+    # Troca todos de uma vez: leitores nunca veem um mapa pela metade
+    _POR_SITE, _POR_HOST, _POR_ORIGEM = por_site, por_host, por_origem
+    return len(por_site)
+
+
+def resolver_tenant(host, origin=None, estrito=False):
+    """
+    Site pelo Origin (quando veio um) ou pelo Host. Sem correspondência,
+    devolve o site padrão, ou None se estrito.
+    """
+    if origin and origin != 'null':
+        tenant = _POR_ORIGEM.get(origin.rstrip('/').lower())
+        if tenant is not None:
+            return tenant
+    tenant = _POR_HOST.get(normalizar_host(host)) if host else None
+    if tenant is None and not estrito:
+        return TENANT_PADRAO
+    return tenant
+
+
+def tenant_por_site(site_source):
+    """Site pelo site_source (ex.: cliques tirados do balde no cron)"""
+    return _POR_SITE.get(site_source) or TENANT_PADRAO._replace(
+        site_source=site_source, email_destino=None, portfolio_tabelas=()
+    )
+
+
+def cabecalhos_cors(origin, preflight=False):
+    """
+    Cabeçalhos CORS das rotas de tracking para o Origin da requisição. Vazio
+    quando a origem não é de um site configurado (o navegador bloqueia).
+    """
+    if not origin or origin.rstrip('/').lower() not in _POR_ORIGEM:
+        return {}
+    cabecalhos = {
+        'Access-Control-Allow-Origin': origin,
+        'Access-Control-Allow-Credentials': 'true',
+    }
+    if preflight:
+        cabecalhos.update({
+            'Access-Control-Allow-Methods': 'POST, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': str(CORS_MAX_AGE_SEGUNDOS),
+        })
+    return cabecalhos
+
+
+def cookie_entre_sites(host, origin):
+    """True se o clique veio de outro domínio (t.js num site cliente): o cookie precisa de SameSite=None"""
+    if not origin or origin == 'null':
+        return False
+    try:
+        return normalizar_host(urlsplit(origin).hostname) != normalizar_host(host)
+    except ValueError:
+        return False
+
+
+carregar_tenants()
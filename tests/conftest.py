@@ -0,0 +1,19 @@
+import os
+import sys
+import socket
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _porta_fechada():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# Como o perf.py --sem-banco: banco e ip-api numa porta fechada (falham na hora,
+# sem rede) e nada de aquecimento. Vale antes de qualquer import do app.
+os.environ.setdefault('DATABASE_URL', f"postgresql://teste@127.0.0.1:{_porta_fechada()}/nada?connect_timeout=1")
+os.environ.setdefault('GEOIP_API_URL', f"http://127.0.0.1:{_porta_fechada()}/json/")
+os.environ.setdefault('AQUECIMENTO_ATIVO', '0')
+os.environ.setdefault('LOG_NIVEL', 'CRITICAL')
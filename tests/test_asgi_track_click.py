@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('asyncpg')
+from starlette.testclient import TestClient  # noqa: E402
+
+import app as site  # noqa: E402
+import asgi  # noqa: E402
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+# corpo -> status esperado nos dois modos
+CASOS = [
+    ('{"botao": "Fale Conosco"}', 200),
+    ('', 200),
+    ('não é json', 200),
+    ('[{"botao": "Fale Conosco"}]', 400),
+    ('"texto"', 400),
+    ('42', 400),
+]
+
+
+@pytest.fixture(autouse=True)
+def sem_efeitos(monkeypatch):
+    monkeypatch.setattr(site, 'filtrar_cliques', lambda cliques: (cliques, None))
+    monkeypatch.setattr(site, 'submit_background', lambda *a, **k: True)
+    monkeypatch.setattr(asgi, 'filtrar_cliques', lambda cliques: (cliques, None))
+    monkeypatch.setattr(asgi, '_agendar', lambda cliques: True)
+
+
+@pytest.mark.parametrize('corpo, status', CASOS)
+def test_track_click_responde_igual_no_flask_e_no_asgi(corpo, status):
+    cabecalhos = {'User-Agent': USER_AGENT, 'Content-Type': 'application/json'}
+    flask = site.app.test_client().post('/api/track-click', data=corpo, headers=cabecalhos)
+    starlette = TestClient(asgi.app).post('/api/track-click', content=corpo.encode('utf-8'), headers=cabecalhos)
+    assert flask.status_code == status
+    assert starlette.status_code == status
@@ -0,0 +1,198 @@
+import os
+import sys
+import threading
+import subprocess
+from contextlib import contextmanager
+
+import pytest
+
+import click_buffer
+
+THREADS = 8
+CLIQUES_POR_THREAD = 2000
+SITES = ("Site A", "Site B")
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def backend_memoria(monkeypatch):
+    monkeypatch.setattr(click_buffer, 'CLICK_BUFFER_BACKEND', 'memoria')
+    monkeypatch.setattr(click_buffer, '_BUFFERS', {})
+
+
+def test_drenar_concorrente_entrega_cada_clique_uma_vez():
+    """N threads adicionam enquanto outras drenam: todo clique sai exatamente uma vez, no seu site"""
+    entregues = {site: [] for site in SITES}
+    entregues_lock = threading.Lock()
+    produtores_ativos = threading.Event()
+    produtores_ativos.set()
+    largada = threading.Barrier(THREADS + 2)
+
+    def produtor(n):
+        largada.wait()
+        for i in range(CLIQUES_POR_THREAD):
+            site = SITES[i % len(SITES)]
+            click_buffer.adicionar_clique(site, {"site": site, "id": (n, i)})
+
+    def consumidor():
+        largada.wait()
+        while True:
+            # Lê o sinal antes de drenar: depois que ele cai, esta rodada já vê tudo
+            continuar = produtores_ativos.is_set()
+            for site in SITES:
+                lote = click_buffer.drenar_cliques(site)
+                with entregues_lock:
+                    entregues[site].extend(lote)
+            if not continuar:
+                return
+
+    produtores = [threading.Thread(target=produtor, args=(n,)) for n in range(THREADS)]
+    consumidores = [threading.Thread(target=consumidor) for _ in range(2)]
+    for t in produtores + consumidores:
+        t.start()
+    for t in produtores:
+        t.join()
+    produtores_ativos.clear()
+    for t in consumidores:
+        t.join()
+
+    total = 0
+    for site, cliques in entregues.items():
+        ids = [c["id"] for c in cliques]
+        assert len(ids) == len(set(ids)), f"clique entregue mais de uma vez em {site}"
+        assert all(c["site"] == site for c in cliques)
+        total += len(ids)
+    assert total == THREADS * CLIQUES_POR_THREAD
+    assert click_buffer.sites_com_cliques() == []
+
+
+def test_devolver_recoloca_o_lote():
+    click_buffer.adicionar_clique("Site A", {"id": 1})
+    lote = click_buffer.drenar_cliques("Site A")
+    assert click_buffer.tamanho_buffer("Site A") == 0
+
+    click_buffer.devolver_cliques("Site A", lote)
+    assert click_buffer.drenar_cliques("Site A") == [{"id": 1}]
+
+
+# --- Backend Postgres contra um cursor falso ---
+
+class _CursorFalso:
+    """
+    Entende só as consultas do click_buffer, sobre uma tabela em memória. Cada
+    comando roda sob um lock, como se o DELETE ... SKIP LOCKED reivindicasse as
+    linhas de uma vez.
+    """
+
+    def __init__(self, banco):
+        self.banco = banco
+        self._resultado = []
+
+    def executemany(self, sql, parametros):
+        assert sql.startswith("INSERT INTO pending_notifications")
+        with self.banco.lock:
+            for site_source, payload in parametros:
+                self.banco.proximo_id += 1
+                self.banco.linhas.append((self.banco.proximo_id, site_source, payload))
+
+    def execute(self, sql, parametros=()):
+        sql = ' '.join(sql.split())
+        self.banco.consultas.append(sql)
+        with self.banco.lock:
+            linhas = self.banco.linhas
+            if sql.startswith("SELECT count(*)"):
+                self._resultado = [(sum(1 for _, site, _ in linhas if site == parametros[0]),)]
+            elif sql.startswith("SELECT DISTINCT site_source"):
+                self._resultado = [(site,) for site in dict.fromkeys(site for _, site, _ in linhas)]
+            elif sql.startswith("DELETE FROM pending_notifications"):
+                assert "FOR UPDATE SKIP LOCKED" in sql and "RETURNING id, payload" in sql
+                reivindicadas = [linha for linha in linhas if linha[1] == parametros[0]]
+                self.banco.linhas = [linha for linha in linhas if linha[1] != parametros[0]]
+                # RETURNING não garante ordem: devolve embaralhado de propósito
+                self._resultado = [(i, payload) for i, _, payload in reversed(reivindicadas)]
+            else:
+                raise AssertionError(f"consulta inesperada: {sql}")
+
+    def fetchone(self):
+        return self._resultado[0]
+
+    def fetchall(self):
+        return list(self._resultado)
+
+
+class _BancoFalso:
+    def __init__(self):
+        self.linhas = []
+        self.proximo_id = 0
+        self.consultas = []
+        self.commits = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def cursor(self, cursor_factory=None, commit=False, operacao='outros'):
+        assert operacao == 'click_buffer'
+        yield _CursorFalso(self)
+        self.commits.append(commit)
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    banco = _BancoFalso()
+    monkeypatch.setattr(click_buffer, 'CLICK_BUFFER_BACKEND', 'postgres')
+    monkeypatch.setattr(click_buffer, 'db_cursor', banco.cursor)
+    return banco
+
+
+def test_postgres_drena_em_ordem_e_so_uma_vez(banco):
+    assert click_buffer.adicionar_clique("Site A", {"id": 1}) == 1
+    assert click_buffer.adicionar_clique("Site B", {"id": 2}) == 1
+    assert click_buffer.adicionar_clique("Site A", {"id": 3}) == 2
+    assert click_buffer.tamanho_buffer("Site A") == 2
+    assert click_buffer.sites_com_cliques() == ["Site A", "Site B"]
+
+    assert click_buffer.drenar_cliques("Site A") == [{"id": 1}, {"id": 3}]
+    # A drenagem precisa de commit: sem ele o DELETE voltaria atrás
+    assert banco.commits[-1] is True
+    assert click_buffer.drenar_cliques("Site A") == []
+    assert click_buffer.sites_com_cliques() == ["Site B"]
+
+
+def test_postgres_devolver_recoloca_o_lote(banco):
+    click_buffer.adicionar_clique("Site A", {"id": 1, "quando": "2026-01-01"})
+    lote = click_buffer.drenar_cliques("Site A")
+    click_buffer.devolver_cliques("Site A", lote)
+    assert click_buffer.drenar_cliques("Site A") == [{"id": 1, "quando": "2026-01-01"}]
+
+
+def test_postgres_drenar_concorrente_entrega_cada_clique_uma_vez(banco):
+    for i in range(500):
+        click_buffer.adicionar_clique("Site A", {"id": i})
+    entregues = []
+    entregues_lock = threading.Lock()
+    largada = threading.Barrier(THREADS)
+
+    def consumidor():
+        largada.wait()
+        lote = click_buffer.drenar_cliques("Site A")
+        with entregues_lock:
+            entregues.extend(c["id"] for c in lote)
+
+    threads = [threading.Thread(target=consumidor) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(entregues) == list(range(500))
+
+
+@pytest.mark.parametrize('ambiente, esperado', [
+    ({'DATABASE_URL': 'postgresql://x@127.0.0.1/merlo'}, 'postgres'),
+    ({'DATABASE_URL': ''}, 'memoria'),
+    ({'DATABASE_URL': 'postgresql://x@127.0.0.1/merlo', 'CLICK_BUFFER_BACKEND': 'memoria'}, 'memoria'),
+])
+def test_backend_padrao_segue_o_banco(ambiente, esperado):
+    env = {k: v for k, v in os.environ.items() if k != 'CLICK_BUFFER_BACKEND'}
+    env.update(ambiente)
+    saida = subprocess.run([sys.executable, '-c', 'import click_buffer; print(click_buffer.CLICK_BUFFER_BACKEND)'],
+                           cwd=RAIZ, env=env, capture_output=True, text=True, check=True)
+    assert saida.stdout.strip() == esperado
@@ -0,0 +1,51 @@
+import pytest
+
+import app as site
+import tenants
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+ORIGEM_CLIENTE = 'https://clientex.com.br'
+
+
+@pytest.fixture(autouse=True)
+def site_cliente(monkeypatch):
+    tenants.carregar_tenants([{"site_source": "Cliente X - Site", "hosts": ["clientex.com.br"]}])
+    monkeypatch.setattr(site, 'filtrar_cliques', lambda cliques: (cliques, None))
+    monkeypatch.setattr(site, 'submit_background', lambda *a, **k: True)
+    yield
+    tenants.carregar_tenants([])
+
+
+def test_preflight_de_site_configurado():
+    resp = site.app.test_client().options('/api/track-batch', headers={
+        'Origin': ORIGEM_CLIENTE, 'Access-Control-Request-Method': 'POST',
+        'Access-Control-Request-Headers': 'content-type',
+    })
+    assert resp.status_code == 200
+    assert resp.headers['Access-Control-Allow-Origin'] == ORIGEM_CLIENTE
+    assert resp.headers['Access-Control-Allow-Credentials'] == 'true'
+    assert 'POST' in resp.headers['Access-Control-Allow-Methods']
+
+
+def test_origem_desconhecida_sem_cors():
+    resp = site.app.test_client().options('/api/track-batch', headers={'Origin': 'https://outro.com'})
+    assert 'Access-Control-Allow-Origin' not in resp.headers
+
+
+def test_clique_entre_sites_vai_para_o_cliente_com_cookie_samesite_none():
+    resp = site.app.test_client().post(
+        '/api/track-batch', data='{"eventos": [{"botao": "Comprar"}]}', content_type='text/plain',
+        headers={'Origin': ORIGEM_CLIENTE, 'User-Agent': USER_AGENT},
+    )
+    assert resp.status_code == 200
+    assert resp.headers['Access-Control-Allow-Origin'] == ORIGEM_CLIENTE
+    cookie = resp.headers['Set-Cookie']
+    assert 'SameSite=None' in cookie and 'Secure' in cookie
+
+
+def test_clique_do_proprio_site_mantem_samesite_lax():
+    resp = site.app.test_client().post('/api/track-click', json={'botao': 'Fale Conosco'},
+                                       headers={'User-Agent': USER_AGENT})
+    assert resp.status_code == 200
+    assert 'SameSite=Lax' in resp.headers['Set-Cookie']
+    assert 'Secure' not in resp.headers['Set-Cookie']
@@ -0,0 +1,168 @@
+import json
+import time
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+import pytest
+
+import geoip
+
+IP_FALHA = "203.0.113.99"
+
+
+class _IpApiFalsa(BaseHTTPRequestHandler):
+    """ip-api falsa: conta as consultas por IP; IP_FALHA devolve 500 sem JSON"""
+    servidor = None
+
+    def do_GET(self):
+        ip = urlsplit(self.path).path.rsplit('/', 1)[-1]
+        self.servidor.registrar(ip)
+        if ip == IP_FALHA:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        dados = json.dumps({
+            "status": "success", "countryCode": "BR", "regionName": "São Paulo", "city": f"Cidade {ip}",
+            "isp": "Provedor", "org": "Provedor", "zip": "13000-000"
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Servidor:
+    def __init__(self):
+        self.consultas = {}
+        self.liberar = threading.Event()
+        self.liberar.set()
+        self._lock = threading.Lock()
+        _IpApiFalsa.servidor = self
+        self._http = ThreadingHTTPServer(('127.0.0.1', 0), _IpApiFalsa)
+        self._http.daemon_threads = True
+        threading.Thread(target=self._http.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._http.server_address[1]}/json/"
+
+    def registrar(self, ip):
+        with self._lock:
+            self.consultas[ip] = self.consultas.get(ip, 0) + 1
+        self.liberar.wait(5)
+
+    def parar(self):
+        self.liberar.set()
+        self._http.shutdown()
+        self._http.server_close()
+
+
+@pytest.fixture
+def ip_api(monkeypatch):
+    servidor = _Servidor()
+    monkeypatch.setattr(geoip, 'GEOIP_API_URL', servidor.url)
+    monkeypatch.setattr(geoip, 'GEOIP_BACKEND', 'remoto')
+    monkeypatch.setattr(geoip, 'GEOIP_CACHE_CHAVE', 'ip')
+    monkeypatch.setattr(geoip, '_CACHE', type(geoip._CACHE)())
+    monkeypatch.setattr(geoip, '_EM_ANDAMENTO', {})
+    yield servidor
+    servidor.parar()
+
+
+class _Relogio:
+    """Substitui time.monotonic do geoip para avançar o tempo sem dormir"""
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = _Relogio()
+    monkeypatch.setattr(geoip, 'time', SimpleNamespace(monotonic=relogio, perf_counter=time.perf_counter))
+    return relogio
+
+
+def test_cache_expira_pelo_ttl(ip_api, relogio, monkeypatch):
+    monkeypatch.setattr(geoip, 'GEOIP_CACHE_TTL_SEGUNDOS', 60)
+
+    primeiro = geoip.get_location_data_rich("198.51.100.1")
+    assert primeiro["local"] == "Cidade 198.51.100.1/São Paulo (BR)"
+
+    relogio.agora += 59
+    assert geoip.get_location_data_rich("198.51.100.1") == primeiro
+    assert ip_api.consultas["198.51.100.1"] == 1
+
+    relogio.agora += 2
+    assert geoip.get_location_data_rich("198.51.100.1") == primeiro
+    assert ip_api.consultas["198.51.100.1"] == 2
+
+
+def test_lru_expulsa_o_menos_usado(ip_api, monkeypatch):
+    monkeypatch.setattr(geoip, 'GEOIP_CACHE_MAX', 2)
+
+    geoip.get_location_data_rich("198.51.100.1")
+    geoip.get_location_data_rich("198.51.100.2")
+    # Usar o .1 o torna o mais recente: o próximo IP expulsa o .2
+    geoip.get_location_data_rich("198.51.100.1")
+    geoip.get_location_data_rich("198.51.100.3")
+    assert list(geoip._CACHE) == ["198.51.100.1", "198.51.100.3"]
+
+    geoip.get_location_data_rich("198.51.100.1")
+    geoip.get_location_data_rich("198.51.100.2")
+    assert ip_api.consultas == {"198.51.100.1": 1, "198.51.100.2": 2, "198.51.100.3": 1}
+
+
+def test_falha_fica_em_cache_negativo(ip_api, relogio, monkeypatch):
+    monkeypatch.setattr(geoip, 'GEOIP_CACHE_NEGATIVO_SEGUNDOS', 30)
+    monkeypatch.setattr(geoip, 'GEOIP_CACHE_TTL_SEGUNDOS', 3600)
+    negativos_antes = geoip.GEOIP_STATS["hits_negativos"]
+
+    assert geoip.get_location_data_rich(IP_FALHA) == geoip.RESULTADO_ERRO
+    assert geoip.get_location_data_rich(IP_FALHA) == geoip.RESULTADO_ERRO
+    assert ip_api.consultas[IP_FALHA] == 1
+    assert geoip.GEOIP_STATS["hits_negativos"] == negativos_antes + 1
+
+    # O cache negativo dura bem menos que o TTL normal
+    relogio.agora += 31
+    geoip.get_location_data_rich(IP_FALHA)
+    assert ip_api.consultas[IP_FALHA] == 2
+
+
+def test_consultas_simultaneas_do_mesmo_ip_fazem_uma_chamada(ip_api):
+    threads_n = 16
+    ip_api.liberar.clear()
+    coalescidos_antes = geoip.GEOIP_STATS["coalescidos"]
+    largada = threading.Barrier(threads_n)
+    resultados = []
+    resultados_lock = threading.Lock()
+
+    def consultar():
+        largada.wait()
+        resultado = geoip.get_location_data_rich("198.51.100.7")
+        with resultados_lock:
+            resultados.append(resultado)
+
+    threads = [threading.Thread(target=consultar) for _ in range(threads_n)]
+    for t in threads:
+        t.start()
+    # Segura a resposta da ip-api até as outras threads estarem esperando a primeira
+    limite = time.monotonic() + 5
+    while geoip.GEOIP_STATS["coalescidos"] - coalescidos_antes < threads_n - 1 and time.monotonic() < limite:
+        time.sleep(0.01)
+    ip_api.liberar.set()
+    for t in threads:
+        t.join()
+
+    assert ip_api.consultas == {"198.51.100.7": 1}
+    assert len(resultados) == threads_n
+    assert all(r["local"] == "Cidade 198.51.100.7/São Paulo (BR)" for r in resultados)
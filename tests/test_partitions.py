@@ -0,0 +1,92 @@
+import logging
+from datetime import datetime
+
+import pytest
+
+import partitions
+
+AGORA = datetime(2026, 10, 18)
+
+
+class _CursorFalso:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, parametros=()):
+        sql = ' '.join(sql.split())
+        self.conn.comandos.append(sql)
+        if sql.startswith("CREATE TABLE"):
+            nome = sql.split()[5]
+            self.conn.particoes.append((nome, f"FOR VALUES FROM ('{parametros[0]}') TO ('{parametros[1]}')"))
+
+    def fetchall(self):
+        return list(self.conn.particoes)
+
+    def copy_expert(self, sql, arquivo):
+        arquivo.write("id,created_at\n")
+
+
+class _ConexaoFalsa:
+    def __init__(self, particoes):
+        self.particoes = list(particoes)
+        self.comandos = []
+
+    def cursor(self):
+        return _CursorFalso(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def criados(self):
+        return [c.split()[5] for c in self.comandos if c.startswith("CREATE TABLE")]
+
+
+# Como a migração 006 deixa a tabela quando roda em outubro de 2026
+LEGADA = ("tracking_events_legacy", "FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00')")
+DEFAULT = ("tracking_events_default", "DEFAULT")
+
+
+def test_mes_coberto_pela_legada_nao_gera_create_nem_aviso(monkeypatch, caplog):
+    monkeypatch.setattr(partitions, 'TRACKING_PARTICOES_A_FRENTE', 2)
+    conn = _ConexaoFalsa([LEGADA, DEFAULT])
+
+    with caplog.at_level(logging.WARNING, logger='partitions'):
+        garantidas = partitions.criar_particoes_futuras(conn, AGORA)
+        # Segunda rodada do cron: tudo já existe
+        partitions.criar_particoes_futuras(conn, AGORA)
+
+    assert conn.criados() == ["tracking_events_p202611", "tracking_events_p202612"]
+    assert garantidas == ["tracking_events_legacy", "tracking_events_p202611", "tracking_events_p202612"]
+    assert not caplog.records
+
+
+def test_retencao_sem_diretorio_de_arquivo_nao_remove_nada(monkeypatch, caplog):
+    monkeypatch.setattr(partitions, 'TRACKING_RETENCAO_MESES', 1)
+    monkeypatch.setattr(partitions, 'TRACKING_ARQUIVO_DIR', '')
+    conn = _ConexaoFalsa([("tracking_events_p202601", "FOR VALUES FROM ('2026-01-01 00:00:00') TO ('2026-02-01 00:00:00')")])
+
+    with caplog.at_level(logging.ERROR, logger='partitions'):
+        assert partitions.aplicar_retencao(conn, AGORA) == []
+
+    assert not any("DROP" in c or "DETACH" in c for c in conn.comandos)
+    assert "TRACKING_ARQUIVO_DIR" in caplog.text
+
+
+@pytest.mark.parametrize('retencao, esperadas', [(1, ["tracking_events_p202601", "tracking_events_p202609"]),
+                                                 (3, ["tracking_events_p202601"])])
+def test_retencao_arquiva_e_remove_as_particoes_antigas(monkeypatch, tmp_path, retencao, esperadas):
+    monkeypatch.setattr(partitions, 'TRACKING_RETENCAO_MESES', retencao)
+    monkeypatch.setattr(partitions, 'TRACKING_ARQUIVO_DIR', str(tmp_path))
+    conn = _ConexaoFalsa([
+        ("tracking_events_p202601", "FOR VALUES FROM ('2026-01-01 00:00:00') TO ('2026-02-01 00:00:00')"),
+        ("tracking_events_p202609", "FOR VALUES FROM ('2026-09-01 00:00:00') TO ('2026-10-01 00:00:00')"),
+        ("tracking_events_p202610", "FOR VALUES FROM ('2026-10-01 00:00:00') TO ('2026-11-01 00:00:00')"),
+        DEFAULT,
+    ])
+
+    assert partitions.aplicar_retencao(conn, AGORA) == esperadas
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{nome}.csv.gz" for nome in esperadas]
+    assert [c for c in conn.comandos if c.startswith("DROP")] == [f"DROP TABLE {nome}" for nome in esperadas]
@@ -0,0 +1,61 @@
+import pytest
+
+import portfolio
+from tenants import Tenant
+
+
+@pytest.fixture
+def site(monkeypatch, tmp_path):
+    monkeypatch.setattr(portfolio, '_CACHES', type(portfolio._CACHES)())
+    monkeypatch.setattr(portfolio, 'PORTFOLIO_SNAPSHOT_PATH', str(tmp_path / 'portfolio.json'))
+    return Tenant(site_source="Site Teste", hosts=("teste.com.br",), host_url="https://teste.com.br",
+                  email_destino=None, portfolio_tabelas=("Portfólio",))
+
+
+def _busca(monkeypatch, resultado):
+    """find_table_id falso: devolve resultado (ou levanta, se for exceção) e conta as chamadas"""
+    chamadas = []
+
+    def find_table_id(*nomes):
+        chamadas.append(nomes)
+        if isinstance(resultado, Exception):
+            raise resultado
+        return resultado
+
+    monkeypatch.setattr(portfolio, 'find_table_id', find_table_id)
+    return chamadas
+
+
+def test_tabela_ausente_entra_no_cache_negativo(monkeypatch, site):
+    chamadas = _busca(monkeypatch, None)
+    falhas = portfolio.PORTFOLIO_STATS["falhas"]
+
+    assert portfolio.get_portfolio_data(tenant=site) == []
+    assert portfolio.get_portfolio_data(tenant=site) == []
+    assert len(chamadas) == 1
+    assert portfolio.PORTFOLIO_STATS["falhas"] == falhas + 1
+
+
+def test_erro_do_banco_nao_vira_tabela_ausente(monkeypatch, site):
+    chamadas = _busca(monkeypatch, RuntimeError("conexão recusada"))
+    falhas, erros = portfolio.PORTFOLIO_STATS["falhas"], portfolio.PORTFOLIO_STATS["erros"]
+
+    assert portfolio.get_portfolio_data(tenant=site) == []
+    # Sem cache negativo: a próxima requisição tenta de novo
+    assert portfolio.get_portfolio_data(tenant=site) == []
+    assert len(chamadas) == 2
+    assert portfolio.PORTFOLIO_STATS["erros"] == erros + 2
+    assert portfolio.PORTFOLIO_STATS["falhas"] == falhas
+    assert portfolio._cache_do_site(site).falhou_em is None
+
+
+def test_find_table_id_deixa_o_erro_do_banco_subir(monkeypatch):
+    import db_utils
+
+    def falhar(*args):
+        raise RuntimeError("conexão recusada")
+
+    monkeypatch.setattr(db_utils, '_buscar_tabelas', falhar)
+    db_utils.invalidate_table_ids()
+    with pytest.raises(RuntimeError):
+        db_utils.find_table_id('Portfólio')
@@ -0,0 +1,48 @@
+import pytest
+
+import app as site
+import rate_limit
+
+
+@pytest.fixture(autouse=True)
+def filtros_limpos(monkeypatch):
+    monkeypatch.setattr(rate_limit, '_DEDUP', rate_limit._Dedup())
+    monkeypatch.setattr(rate_limit, '_BUCKETS', rate_limit._TokenBuckets())
+    monkeypatch.setattr(rate_limit, 'TRACK_RATE_RAJADA', 3)
+    monkeypatch.setattr(rate_limit, 'TRACK_RATE_POR_SEGUNDO', 0.001)
+
+
+def _clique(n, ip, uid, novo=False):
+    return {"site_source": "Site", "uid": uid, "is_new_user": novo, "ip_address": ip,
+            "botao": f"Botão {n}", "pagina_origem": "/", "url_destino": "/contato"}
+
+
+@pytest.mark.parametrize('saltos, forwarded, esperado', [
+    (1, '6.6.6.6, 200.1.1.1', '200.1.1.1'),
+    (2, '6.6.6.6, 200.1.1.1, 10.0.0.5', '200.1.1.1'),
+    (1, None, '10.0.0.1'),
+    (2, '200.1.1.1', '10.0.0.1'),
+    (0, '6.6.6.6, 200.1.1.1', '10.0.0.1'),
+])
+def test_ip_do_cliente_usa_o_salto_do_proxy_confiavel(monkeypatch, saltos, forwarded, esperado):
+    monkeypatch.setattr(site, 'PROXY_SALTOS', saltos)
+    assert site.ip_do_cliente(forwarded, '10.0.0.1') == esperado
+
+
+def test_forwarded_falso_nao_escapa_do_limite_por_ip(monkeypatch):
+    monkeypatch.setattr(site, 'PROXY_SALTOS', 1)
+    aceitos = 0
+    for n in range(10):
+        # Cada requisição inventa outro "cliente" no começo do X-Forwarded-For
+        ip = site.ip_do_cliente(f"1.2.3.{n}, 200.1.1.1", '10.0.0.1')
+        aceitos += len(rate_limit.filtrar_cliques([_clique(n, ip, 'uid-fixo')])[0])
+    assert aceitos == 3
+
+
+def test_uid_recem_criado_nao_ganha_bucket():
+    aceitos = 0
+    for n in range(10):
+        # Sem cookie: cada requisição chega com um uid novo
+        aceitos += len(rate_limit.filtrar_cliques([_clique(n, '200.1.1.1', f"uid-{n}", novo=True)])[0])
+    assert aceitos == 3
+    assert not any(chave.startswith('uid:') for chave in rate_limit._BUCKETS._buckets)
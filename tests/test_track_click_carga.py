@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import app as site
+from background import BACKGROUND_WORKERS
+
+CLIENTES = 8
+REQUISICOES_POR_CLIENTE = 400
+# Threads fixas além do executor: principal, clientes, amostrador, writer de
+# tracking e worker do outbox de e-mail
+FOLGA_THREADS = CLIENTES + 6
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+def _rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith('VmRSS:'):
+                    return int(linha.split()[1])
+    except OSError:
+        return None
+
+
+@pytest.fixture(autouse=True)
+def sem_filtros(monkeypatch):
+    # A carga vem toda do test client: dedup e rate limit barrariam quase tudo
+    monkeypatch.setattr(site, 'filtrar_cliques', lambda cliques: (cliques, None))
+
+
+def _disparar(n_por_cliente, respostas):
+    def cliente(n):
+        http = site.app.test_client()
+        for i in range(n_por_cliente):
+            resp = http.post('/api/track-click', json={
+                'botao': f"Botão {i % 7}", 'pagina_origem': '/', 'url_destino': '/contato'
+            }, headers={'User-Agent': USER_AGENT, 'X-Forwarded-For': f"10.0.{n}.{i % 250}"})
+            respostas.append(resp.status_code)
+
+    threads = [threading.Thread(target=cliente, args=(n,)) for n in range(CLIENTES)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_track_click_sob_carga_nao_cria_threads_nem_cresce_memoria():
+    """Com o executor saturado os cliques são recusados: threads e RSS ficam estáveis"""
+    # Aquecimento: imports preguiçosos, executor, writer e caches já de pé
+    _disparar(50, [])
+    rss_inicial = _rss_kb()
+
+    pico = [threading.active_count()]
+    parar = threading.Event()
+
+    def amostrar():
+        while not parar.is_set():
+            pico[0] = max(pico[0], threading.active_count())
+            parar.wait(0.005)
+
+    amostrador = threading.Thread(target=amostrar)
+    amostrador.start()
+    respostas = []
+    try:
+        _disparar(REQUISICOES_POR_CLIENTE, respostas)
+    finally:
+        parar.set()
+        amostrador.join()
+
+    assert len(respostas) == CLIENTES * REQUISICOES_POR_CLIENTE
+    assert set(respostas) <= {200}
+    assert pico[0] <= BACKGROUND_WORKERS + FOLGA_THREADS
+
+    rss_final = _rss_kb()
+    if rss_inicial is None or rss_final is None:
+        pytest.skip("sem /proc para medir RSS")
+    # Fila do executor limitada e cliques recusados não ficam retidos: alguns MB de folga
+    assert rss_final - rss_inicial < 30 * 1024
@@ -0,0 +1,91 @@
+import os
+import time
+import logging
+import threading
+
+from metrics import expor_stats
+
+logger = logging.getLogger(__name__)
+
+# --- AQUECIMENTO NA SUBIDA ---
+# Os módulos pesados (user_agents, psycopg2, requests, resend) são importados no
+# primeiro uso e os templates compilados na primeira renderização, o que deixa a
+# subida rápida mas joga esse custo no primeiro visitante. Com AQUECIMENTO_ATIVO=1
+# uma thread por worker adianta esse trabalho logo após a importação, e /readyz
+# responde 503 até terminar: o balanceador só manda tráfego para o worker quente.
+# Desligado, /readyz responde 200 direto (nada a esperar).
+AQUECIMENTO_ATIVO = os.getenv('AQUECIMENTO_ATIVO', '0') == '1'
+
+AQUECIMENTO_STATS = {"pronto": 0, "duracao_ms": 0, "etapas_com_erro": 0}
+
+_ETAPAS = []
+_RESULTADOS = {}
+_PRONTO = threading.Event()
+_PID = None
+_LOCK = threading.Lock()
+
+
+def registrar_etapa(nome, fn):
+    """Adiciona uma etapa (fn sem argumentos) ao aquecimento, na ordem de registro"""
+    _ETAPAS.append((nome, fn))
+
+
+def _aquecer():
+    inicio = time.perf_counter()
+    for nome, fn in _ETAPAS:
+        inicio_etapa = time.perf_counter()
+        try:
+            fn()
+            _RESULTADOS[nome] = {"ok": True}
+        except Exception as e:
+            # Etapa com erro (ex.: banco fora) não segura o worker: o caminho
+            # preguiçoso tenta de novo na requisição
+            AQUECIMENTO_STATS["etapas_com_erro"] += 1
+            # O erro fica só no log: /readyz é público e a mensagem pode citar host/usuário do banco
+            _RESULTADOS[nome] = {"ok": False}
+            logger.warning("Erro no aquecimento: %s", e, extra={"etapa": nome})
+        _RESULTADOS[nome]["ms"] = round((time.perf_counter() - inicio_etapa) * 1000, 1)
+
+    AQUECIMENTO_STATS["duracao_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    AQUECIMENTO_STATS["pronto"] = 1
+    _PRONTO.set()
+    logger.info("Aquecimento concluído.", extra={"duracao_ms": AQUECIMENTO_STATS["duracao_ms"],
+                                                 "etapas": len(_ETAPAS)})
+
+
+def iniciar_aquecimento():
+    """Dispara o aquecimento do processo atual (de novo após um fork com --preload)"""
+    global _PID, _PRONTO
+    if not AQUECIMENTO_ATIVO:
+        return
+
+    pid = os.getpid()
+    with _LOCK:
+        if _PID == pid:
+            return
+        # Thread do processo pai não sobrevive ao fork: recomeça neste worker
+        _PID = pid
+        _PRONTO = threading.Event()
+        _RESULTADOS.clear()
+        AQUECIMENTO_STATS.update(pronto=0, duracao_ms=0, etapas_com_erro=0)
+        threading.Thread(target=_aquecer, daemon=True, name="merlo-aquecimento").start()
+
+
+def pronto():
+    if not AQUECIMENTO_ATIVO:
+        return True
+    iniciar_aquecimento()
+    return _PRONTO.is_set()
+
+
+def estado():
+    """Resumo para o /readyz"""
+    return {
+        "pronto": pronto(),
+        "aquecimento": AQUECIMENTO_ATIVO,
+        "duracao_ms": AQUECIMENTO_STATS["duracao_ms"],
+        "etapas": dict(_RESULTADOS),
+    }
+
+
+expor_stats('aquecimento', AQUECIMENTO_STATS, 'Aquecimento do worker na subida')